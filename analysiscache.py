@@ -0,0 +1,125 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+import os
+import time
+import sqlite3
+import threading
+
+import loghelper
+
+log = loghelper.get_logger('AnalysisCache', loghelper.Color.BrightBlue)
+
+
+
+class AnalysisCache:
+	"""Persistent, library-wide cache of analysis results (duration, cover, tile color).
+	Entries are keyed by file fingerprint and cover dimensions, so results survive
+	files moving between folders and index format changes. Least recently used
+	entries are evicted once the covers stored exceed max_bytes.
+	"""
+
+	def __init__(self, filename, *, max_bytes):
+		self.filename = filename
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		self.db = None
+		self.hits = 0
+		self.misses = 0
+
+		try:
+			os.makedirs(os.path.dirname(filename), exist_ok=True)
+			self.db = sqlite3.connect(filename, check_same_thread=False)
+			self.db.execute('''
+				CREATE TABLE IF NOT EXISTS analysis (
+					fingerprint TEXT NOT NULL,
+					dimensions TEXT NOT NULL,
+					duration INTEGER,
+					cover BLOB,
+					color TEXT,
+					size INTEGER NOT NULL,
+					last_used REAL NOT NULL,
+					PRIMARY KEY (fingerprint, dimensions)
+				)
+			''')
+			self.db.execute('CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)')
+			self.db.commit()
+			log.info(f'Opened analysis cache {filename}')
+		except (OSError, sqlite3.Error) as e:
+			log.error(f'Opening analysis cache {filename}: {e}; continuing without')
+			self.db = None
+
+
+	def get(self, fingerprint, dimensions):
+		"""Returns (duration, cover, color) or None if not cached."""
+		if self.db is None or fingerprint is None:
+			return None
+
+		with self.lock:
+			try:
+				row = self.db.execute('SELECT duration, cover, color FROM analysis WHERE fingerprint = ? AND dimensions = ?',
+					(fingerprint, dimensions)).fetchone()
+				if row is not None:
+					self.db.execute('UPDATE analysis SET last_used = ? WHERE fingerprint = ? AND dimensions = ?',
+						(time.time(), fingerprint, dimensions))
+			except sqlite3.Error as e:
+				log.error(f'Reading from {self.filename}: {e}')
+				row = None
+
+			if row is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+
+		if row is None:
+			return None
+		return row[0], row[1], row[2]
+
+
+	def put(self, fingerprint, dimensions, duration, cover, color):
+		if self.db is None or fingerprint is None:
+			return
+
+		size = len(cover) if cover else 0
+		with self.lock:
+			try:
+				self.db.execute('INSERT OR REPLACE INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?)',
+					(fingerprint, dimensions, duration, cover, color, size, time.time()))
+			except sqlite3.Error as e:
+				log.error(f'Writing to {self.filename}: {e}')
+
+
+	def commit(self):
+		"""Evicts least recently used entries if over budget, commits to disk."""
+		if self.db is None:
+			return
+
+		with self.lock:
+			try:
+				total, = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM analysis').fetchone()
+				if total > self.max_bytes:
+					excess = total - self.max_bytes
+					evict = []
+					for fingerprint, dimensions, size in self.db.execute(
+							'SELECT fingerprint, dimensions, size FROM analysis ORDER BY last_used'):
+						if excess <= 0:
+							break
+						evict.append((fingerprint, dimensions))
+						excess -= size
+					log.info(f'Analysis cache {self.filename} over budget, evicting {len(evict)} entries')
+					self.db.executemany('DELETE FROM analysis WHERE fingerprint = ? AND dimensions = ?', evict)
+				self.db.commit()
+			except sqlite3.Error as e:
+				log.error(f'Committing {self.filename}: {e}')
+
+		log.debug(f'{self}')
+
+
+	def __str__(self):
+		return f'AnalysisCache({self.filename}, hits={self.hits}, misses={self.misses})'
+
+	def __repr__(self):
+		return self.__str__()
@@ -0,0 +1,238 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Library catalog: one SQLite DB at the library root with every indexed file and
+# directory, their duration, fingerprint and state. Clerk keeps it up to date as
+# directories are scanned and state changes; clients and serf can answer
+# library-wide questions from it without opening every directory's DBs.
+#
+# It uses SQLite's default rollback journal rather than WAL, as WAL doesn't work
+# on network filesystems.
+
+import os
+import sqlite3
+import threading
+
+import dbs
+import loghelper
+
+log = loghelper.get_logger('Catalog', loghelper.Color.Cyan)
+
+CATALOG_VERSION = 1
+
+
+
+class Catalog:
+	"""Catalog of the library at root. Paths in the catalog are relative to root;
+	methods take absolute paths. Opened readonly, nothing is created or written,
+	and opening fails if there's no catalog.
+	"""
+
+	def __init__(self, root, readonly=False):
+		self.root = root
+		self.filename = os.path.join(root, dbs.CATALOG_NAME)
+		self.readonly = readonly
+		self.lock = threading.Lock()
+		self.db = None
+
+		try:
+			if readonly:
+				self.db = sqlite3.connect(f'file:{self.filename}?mode=ro', uri=True, check_same_thread=False)
+				version, = self.db.execute('PRAGMA user_version').fetchone()
+				if version != CATALOG_VERSION:
+					raise sqlite3.DatabaseError(f'Unsupported catalog version {version}')
+			else:
+				os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+				self.db = sqlite3.connect(self.filename, check_same_thread=False)
+				self.create()
+			log.info(f'Opened catalog {self.filename}')
+		except (OSError, sqlite3.Error) as e:
+			log.error(f'Opening catalog {self.filename}: {e}; continuing without')
+			if self.db is not None:
+				self.db.close()
+			self.db = None
+
+
+	def create(self):
+		version, = self.db.execute('PRAGMA user_version').fetchone()
+		if version != CATALOG_VERSION:
+			if version:
+				log.warning(f'Rebuilding catalog {self.filename} of version {version}')
+			self.db.executescript('DROP TABLE IF EXISTS dirs; DROP TABLE IF EXISTS entries;')
+		self.db.executescript(f'''
+			CREATE TABLE IF NOT EXISTS dirs (
+				dir TEXT PRIMARY KEY,
+				fingerprint TEXT NOT NULL,
+				state_synced INTEGER NOT NULL
+			);
+			CREATE TABLE IF NOT EXISTS entries (
+				dir TEXT NOT NULL,
+				name TEXT NOT NULL,
+				isdir INTEGER NOT NULL,
+				fingerprint TEXT,
+				duration INTEGER,
+				position REAL NOT NULL DEFAULT 0,
+				tagged INTEGER NOT NULL DEFAULT 0,
+				PRIMARY KEY (dir, name)
+			);
+			CREATE INDEX IF NOT EXISTS entries_tagged ON entries (tagged) WHERE tagged;
+			CREATE INDEX IF NOT EXISTS entries_fingerprint ON entries (fingerprint);
+			PRAGMA user_version = {CATALOG_VERSION};
+		''')
+		self.db.commit()
+
+
+	@classmethod
+	def find(cls, path):
+		"""Returns the catalog (opened readonly) of the library path is in, or None."""
+		path = os.path.abspath(path)
+		while True:
+			if os.path.isfile(os.path.join(path, dbs.CATALOG_NAME)):
+				catalog = cls(path, readonly=True)
+				return catalog if catalog.db is not None else None
+			parent = os.path.dirname(path)
+			if parent == path:
+				return None
+			path = parent
+
+
+	def relative(self, path):
+		rel = os.path.relpath(path, self.root)
+		return '' if rel == '.' else rel
+
+
+	@staticmethod
+	def subtree(rel):
+		"""Returns a WHERE clause and its parameters matching directory rel and
+		everything below it."""
+		if not rel:
+			return '1', ()
+		# '0' sorts right after '/', so this range is everything starting with rel/
+		return '(dir = ? OR (dir >= ? AND dir < ?))', (rel, rel + '/', rel + '0')
+
+
+	def update_dir(self, path, fingerprint, files):
+		"""Updates the entries of directory path from its index files, unless they
+		were already up to date with fingerprint. Their state is kept until
+		update_state() syncs it."""
+		if self.db is None:
+			return
+		rel = self.relative(path)
+
+		with self.lock:
+			try:
+				row = self.db.execute('SELECT fingerprint FROM dirs WHERE dir = ?', (rel,)).fetchone()
+				if row is not None and row[0] == fingerprint:
+					return
+
+				old = {name: (isdir, position, tagged) for name, isdir, position, tagged in
+					self.db.execute('SELECT name, isdir, position, tagged FROM entries WHERE dir = ?', (rel,))}
+				names = {f['name'] for f in files}
+				for name, (isdir, _, _) in old.items():
+					if isdir and name not in names:
+						self.remove_tree(os.path.join(rel, name))
+
+				self.db.execute('DELETE FROM entries WHERE dir = ?', (rel,))
+				self.db.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)', [
+					(rel, f['name'], f['isdir'], f['fingerprint'], f.get('duration'), *old.get(f['name'], (0, 0, 0))[1:])
+					for f in files
+				])
+				self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, 0)', (rel, fingerprint))
+				self.db.commit()
+				log.debug(f'Updated {len(files)} entries of {path}')
+			except sqlite3.Error as e:
+				log.error(f'Updating {self.filename}: {e}')
+				self.db.rollback()
+
+
+	def needs_state(self, path):
+		"""Returns whether the entries of path changed since update_state()."""
+		if self.db is None:
+			return False
+		with self.lock:
+			try:
+				row = self.db.execute('SELECT state_synced FROM dirs WHERE dir = ?', (self.relative(path),)).fetchone()
+			except sqlite3.Error as e:
+				log.error(f'Reading {self.filename}: {e}')
+				return False
+		return row is not None and not row[0]
+
+
+	def update_state(self, path, state):
+		"""Sets the position and tagged state of the entries of path from its state DB."""
+		if self.db is None:
+			return
+		rel = self.relative(path)
+
+		with self.lock:
+			try:
+				self.db.executemany('UPDATE entries SET position = ?, tagged = ? WHERE dir = ? AND name = ?', [
+					(s.get('position', 0), bool(s.get('tagged', False)), rel, name)
+					for name, s in state.items()
+				])
+				self.db.execute('UPDATE dirs SET state_synced = 1 WHERE dir = ?', (rel,))
+				self.db.commit()
+			except sqlite3.Error as e:
+				log.error(f'Updating {self.filename}: {e}')
+				self.db.rollback()
+
+
+	def remove_dir(self, path):
+		"""Removes directory path and everything below it."""
+		if self.db is None:
+			return
+		with self.lock:
+			try:
+				self.remove_tree(self.relative(path))
+				self.db.commit()
+			except sqlite3.Error as e:
+				log.error(f'Updating {self.filename}: {e}')
+				self.db.rollback()
+
+
+	def remove_tree(self, rel):
+		# Called with self.lock held, in a transaction
+		where, params = self.subtree(rel)
+		self.db.execute(f'DELETE FROM entries WHERE {where}', params)
+		self.db.execute(f'DELETE FROM dirs WHERE {where}', params)
+		if rel:
+			parent, name = os.path.split(rel)
+			self.db.execute('DELETE FROM entries WHERE dir = ? AND name = ?', (parent, name))
+
+
+	def tagged(self, path=None):
+		"""Returns the absolute paths of the tagged files in (or below) path."""
+		if self.db is None:
+			return []
+		where, params = self.subtree(self.relative(path or self.root))
+		with self.lock:
+			rows = self.db.execute(f'SELECT dir, name FROM entries WHERE tagged AND NOT isdir AND {where} ORDER BY dir, name', params).fetchall()
+		return [os.path.join(self.root, d, name) for d, name in rows]
+
+
+	def search(self, text, path=None):
+		"""Returns (absolute path, isdir) of entries in (or below) path whose name contains text."""
+		if self.db is None:
+			return []
+		where, params = self.subtree(self.relative(path or self.root))
+		pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+		with self.lock:
+			rows = self.db.execute(f"SELECT dir, name, isdir FROM entries WHERE name LIKE ? ESCAPE '\\' AND {where} ORDER BY dir, name",
+				(pattern, *params)).fetchall()
+		return [(os.path.join(self.root, d, name), bool(isdir)) for d, name, isdir in rows]
+
+
+	def close(self):
+		if self.db is not None:
+			self.db.close()
+			self.db = None
+
+
+	def __str__(self):
+		return f'Catalog({self.filename})'
+
+	def __repr__(self):
+		return self.__str__()
@@ -0,0 +1,201 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Change feed: Clerk appends a line to CHANGES_LOG_NAME in the library root for
+# every directory whose index, state or covers it rewrites, numbered with a
+# sequence number. Clients tail it to find out what changed since they last
+# looked, without rereading DBs.
+#
+# Every line is a JSON object {"seq": n, "kind": "index"|"state"|"covers",
+# "path": directory relative to the root}. Once the log gets large it's compacted:
+# only the latest line per (kind, path) is kept, and at most CHANGES_KEEP lines.
+# It then starts with {"seq": n, "kind": "reset"}: clients that haven't seen n
+# may have missed changes, and should assume everything changed.
+
+import os
+import json
+import threading
+
+import dbs
+import loghelper
+
+log = loghelper.get_logger('ChangeFeed', loghelper.Color.Cyan)
+
+CHANGES_MAX_BYTES = 1024 * 1024
+CHANGES_KEEP = 10000
+RESET = 'reset'
+
+
+
+def parse(lines):
+	"""Yields the records in lines (bytes, complete lines only), skipping damaged ones."""
+	for line in lines:
+		try:
+			record = json.loads(line)
+			yield record['seq'], record['kind'], record.get('path', '')
+		except (ValueError, KeyError, TypeError) as e:
+			log.error(f'Bad change feed line {line!r}: {e}')
+
+
+
+class ChangeLog:
+	"""Writer side of the change feed of the library at root, used by Clerk."""
+
+	def __init__(self, root):
+		self.root = root
+		self.filename = os.path.join(root, dbs.CHANGES_LOG_NAME)
+		self.lock = threading.Lock()
+		self.records = self.read()
+		self.seq = max((seq for seq, kind, path in self.records), default=0)
+		self.size = sum(len(self.format(*record)) for record in self.records)
+		log.info(f'Change feed {self.filename} at sequence {self.seq}')
+
+
+	def read(self):
+		try:
+			with open(self.filename, 'rb') as fd:
+				return list(parse(line for line in fd if line.endswith(b'\n')))
+		except FileNotFoundError:
+			return []
+		except OSError as e:
+			log.error(f'Reading {self.filename}: {e}')
+			return []
+
+
+	@staticmethod
+	def format(seq, kind, path):
+		return (json.dumps({'seq': seq, 'kind': kind, 'path': path}) + '\n').encode('utf-8')
+
+
+	def record(self, kind, path):
+		"""Records that kind ('index', 'state' or 'covers') of directory path changed."""
+		rel = os.path.relpath(path, self.root)
+		rel = '' if rel == '.' else rel
+		with self.lock:
+			self.seq += 1
+			line = self.format(self.seq, kind, rel)
+			try:
+				os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+				with open(self.filename, 'ab') as fd:
+					fd.write(line)
+			except OSError as e:
+				log.error(f'Writing {self.filename}: {e}')
+				return
+			self.records.append((self.seq, kind, rel))
+			self.size += len(line)
+
+			if self.size > CHANGES_MAX_BYTES:
+				self.compact()
+
+
+	def compact(self):
+		# Called with self.lock held
+		reset = 0
+		latest = {}
+		for seq, kind, path in self.records:
+			if kind == RESET:
+				reset = max(reset, seq)
+			else:
+				latest[kind, path] = seq
+		kept = sorted((seq, kind, path) for (kind, path), seq in latest.items())
+		if len(kept) > CHANGES_KEEP:
+			reset = kept[-CHANGES_KEEP - 1][0]
+			kept = kept[-CHANGES_KEEP:]
+		self.records = ([(reset, RESET, '')] if reset else []) + kept
+
+		data = b''.join(self.format(*record) for record in self.records)
+		new_filename = self.filename + dbs.NEW_SUFFIX
+		try:
+			with open(new_filename, 'wb') as fd:
+				fd.write(data)
+			os.rename(new_filename, self.filename)
+		except OSError as e:
+			log.error(f'Compacting {self.filename}: {e}')
+			return
+		log.info(f'Compacted {self.filename} from {self.size} to {len(data)} bytes')
+		self.size = len(data)
+
+
+	def __str__(self):
+		return f'ChangeLog({self.filename}, seq={self.seq})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+class ChangeFeed:
+	"""Reader side of the change feed of the library at root. Starts at the current
+	end of the feed; poll() returns what changed since."""
+
+	def __init__(self, root):
+		self.root = root
+		self.filename = os.path.join(root, dbs.CHANGES_LOG_NAME)
+		self.inode = None
+		self.offset = 0
+		self.seq = None
+		self.poll()
+
+
+	@classmethod
+	def find(cls, path):
+		"""Returns the change feed of the library path is in, or None if Clerk doesn't keep one."""
+		path = os.path.abspath(path)
+		while True:
+			if os.path.isfile(os.path.join(path, dbs.CHANGES_LOG_NAME)):
+				return cls(path)
+			parent = os.path.dirname(path)
+			if parent == path:
+				return None
+			path = parent
+
+
+	def poll(self):
+		"""Returns {(kind, absolute directory path)} of the changes since the last
+		poll, or None if changes may have been missed (everything should be
+		considered changed). Costs a stat if nothing changed."""
+		try:
+			st = os.stat(self.filename)
+			if st.st_ino == self.inode and st.st_size == self.offset:
+				return set()
+			if st.st_ino != self.inode or st.st_size < self.offset:
+				# Compacted (replaced); start over, skipping what we've seen
+				self.inode = st.st_ino
+				self.offset = 0
+			with open(self.filename, 'rb') as fd:
+				fd.seek(self.offset)
+				data = fd.read()
+		except FileNotFoundError:
+			return set()
+		except OSError as e:
+			log.error(f'Reading {self.filename}: {e}')
+			return set()
+
+		# Leave an incomplete last line for next time
+		data = data[:data.rfind(b'\n') + 1]
+		self.offset += len(data)
+
+		changes = set()
+		missed = False
+		for seq, kind, path in parse(data.splitlines()):
+			if self.seq is not None and seq <= self.seq:
+				continue
+			if kind == RESET:
+				missed = missed or self.seq is not None
+			elif self.seq is not None:
+				changes.add((kind, os.path.normpath(os.path.join(self.root, path))))
+			self.seq = max(self.seq or 0, seq)
+
+		if self.seq is None:
+			self.seq = 0
+		return None if missed else changes
+
+
+	def __str__(self):
+		return f'ChangeFeed({self.filename}, seq={self.seq})'
+
+	def __repr__(self):
+		return self.__str__()
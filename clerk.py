@@ -5,7 +5,6 @@
 # Licensed under GPL v2.0, or (at your option) any later version.
 # (SPDX GPL-2.0-or-later) See LICENSE file for details.
 
-COVER_META_TAG = '.meta'
 COVER_WIDTH = 320
 COVER_HEIGHT = 200
 
@@ -13,6 +12,14 @@ THUMB_VIDEO_POSITION = 0.25
 FOLDER_COVER_FILE = '.cover.jpg'
 MKV_COVER_FILE = 'cover.jpg'
 EVENT_COOLDOWN_SECONDS = 1
+SCAN_PROGRESS_SECONDS = 30
+SETTLE_TIMEOUT_SECONDS = 60
+POLL_INTERVAL_SECONDS = 60
+WRITE_SETTLE_SECONDS = 10
+ANALYSIS_CACHE_MB = 1024
+DB_CACHE_MB = 64
+# Number of directories whose state is kept in memory
+STATE_CACHE_DIRS = 4096
 
 
 
@@ -22,20 +29,34 @@ import io
 import stat
 import json
 import time
-import zipfile
+import zlib
+import queue
+import itertools
+import threading
+import contextlib
+import fnmatch
 import enzyme
+import mp4
 import hashlib
 import logging
 import argparse
 import subprocess
 import collections
+import concurrent.futures
 import PIL.Image
 import PIL.ImageOps
 
 import loghelper
 import colorpicker
+import util
+import readiness
 from watch import Watcher
+from analysiscache import AnalysisCache
+from catalog import Catalog
+from changefeed import ChangeLog
+from stateengine import StateEngine, stat_key
 import dbs
+import coverpack
 
 loghelper.set_up_logging(console_level=loghelper.WARNING, file_level=loghelper.DEBUG, filename='clerk.log')
 log = loghelper.get_logger('Clerk', loghelper.Color.Red)
@@ -43,11 +64,40 @@ log = loghelper.get_logger('Clerk', loghelper.Color.Red)
 logging.getLogger('enzyme').setLevel(logging.CRITICAL)
 log.info('Starting Clerk.')
 
+COVER_VARIANT_DB_PATTERN = dbs.COVER_VARIANT_DB_NAME.format(width='*', height='*')
+
+
+def parse_size(text):
+	try:
+		width, height = (int(v) for v in text.lower().split('x'))
+		if width > 0 and height > 0:
+			return width, height
+	except ValueError:
+		pass
+	raise argparse.ArgumentTypeError(f'invalid size {text!r}, expected WIDTHxHEIGHT')
+
+
+def parse_codec(text):
+	try:
+		return dbs.Codec.parse(text)
+	except dbs.CodecError as e:
+		raise argparse.ArgumentTypeError(str(e))
+
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Fabella Clerk. Watches video library for changes, updates indices and state.')
 parser.add_argument('--once', '-o', action='store_true', help="Don't watch the library; just update everything and quit.")
 parser.add_argument('--skip-initial', '-s', action='store_true', help="Skip the initial consistency scan of the library; just watch it for changes.")
+parser.add_argument('--threads', '-j', type=int, default=util.render_thread_count(), help="Number of files to analyze (thumbnail, probe) concurrently.")
+parser.add_argument('--scan-threads', type=int, default=4, help="Number of directories to scan concurrently.")
+parser.add_argument('--cache-size', type=int, default=ANALYSIS_CACHE_MB, help="Size budget of the library-wide analysis cache, in MiB. 0 disables the cache.")
+parser.add_argument('--db-cache-size', type=int, default=DB_CACHE_MB, help="Memory for caching parsed index and state DBs, in MiB. 0 disables the cache.")
+parser.add_argument('--watcher', choices=['auto', 'inotify', 'watchdog', 'poll'], default='auto', help="How to watch the library for changes. auto uses inotify if available; poll is for network filesystems.")
+parser.add_argument('--poll', type=str, action='append', default=[], metavar='PATH', help="Poll this part of the library for changes instead of watching it. May be repeated.")
+parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL_SECONDS, help="Seconds between polls of polled paths.")
+parser.add_argument('--cover-variant', type=parse_size, action='append', metavar='WxH', help="Also store covers of this size, for clients with other tile sizes. May be repeated.")
+parser.add_argument('--cover-variant-encoding', choices=['rgba', 'jpeg'], default='rgba', help="Encoding of cover variants. rgba (compressed raw pixels) costs more disk space, but clients don't need to decode it.")
+parser.add_argument('--db-codec', type=parse_codec, default=dbs.write_codec, metavar='CODEC', help="How to encode index, state and other DBs: 'legacy' (gzipped JSON, readable by all clients), or serializer (json, msgpack) + compressor (none, gzip, zstd, lz4) with an optional level, like json+gzip:1 or msgpack+zstd. Clients must be new enough to read it.")
 parser.add_argument('path', type=str, help='Path to video library')
 args = parser.parse_args()
 
@@ -74,80 +124,197 @@ class TileError(Exception):
 	pass
 
 
+class CoverFormat:
+	"""A cover size and encoding. Each format has its own cover DB. 'jpeg' covers
+	are decoded and cropped by the client; 'rgba' covers are zlib compressed raw
+	RGBA pixels, which the client can upload as texture as-is."""
+
+	def __init__(self, width, height, encoding, variant=False):
+		self.width = width
+		self.height = height
+		self.encoding = encoding
+		self.variant = variant
+		if variant:
+			self.db_name = dbs.COVER_VARIANT_DB_NAME.format(width=width, height=height)
+		else:
+			self.db_name = dbs.COVER_DB_NAME
+
+	@property
+	def size(self):
+		return (self.width, self.height)
+
+	@property
+	def dimensions(self):
+		return f'{self.width}x{self.height}'
+
+	@property
+	def key(self):
+		"""Identifies covers of this format, in tiles and the analysis cache."""
+		if self.encoding == 'jpeg':
+			return self.dimensions
+		return f'{self.dimensions}/{self.encoding}'
+
+	def open(self, path):
+		"""Opens the existing cover DB of this format in path, or returns None."""
+		return coverpack.open_covers(path, self.size if self.variant else None)
+
+	def fit(self, image):
+		if image.size == self.size:
+			return image
+		return PIL.ImageOps.fit(image, self.size, method=PIL.Image.LANCZOS)
+
+	def encode(self, cover):
+		"""Takes an image of this format's size, returns the encoded cover as bytes."""
+		if self.encoding == 'rgba':
+			return zlib.compress(cover.convert('RGBA').tobytes())
+
+		buffer = io.BytesIO()
+		cover.save(buffer, format='JPEG', quality=90, subsampling=0, optimize=True)
+		return buffer.getvalue()
+
+	def __str__(self):
+		return f'CoverFormat({self.key}, {self.db_name})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+def cover_master_size(size):
+	"""Returns the size to scale an image of size to, keeping its aspect ratio, so
+	that every cover format can be cropped from it directly. Cropping to a common
+	master size instead would crop covers of other aspect ratios twice."""
+	sizes = [util.img_fit_draft_size(size, fmt.size) for fmt in cover_formats]
+	return max(w for w, h in sizes), max(h for w, h in sizes)
+
+
+def encode_covers(image):
+	"""Takes an uncropped RGB image of cover_master_size(), encodes it in all cover formats.
+	Also determines representative color. Returns (color, {format key: cover bytes})."""
+	covers = {}
+	color = None
+	for fmt in cover_formats:
+		cover = fmt.fit(image)
+		if not fmt.variant:
+			# Choose a representative color from the primary cover image
+			color = '#' + ''.join(f'{c:02x}' for c in colorpicker.pick(cover))
+		covers[fmt.key] = fmt.encode(cover)
+	return color, covers
+
+
 def scale_cover(fd, path):
-	"""Takes file-like object, reads image from it, scales, encodes to JPEG.
-	Also determines representative color. Returns (color, jpeg bytes)."""
+	"""Takes file-like object, reads image from it, scales it to cover_master_size().
+	Returns the RGB image."""
 	try:
 		with PIL.Image.open(fd) as cover:
+			# JPEG only: decode at reduced size (DCT scaling), as small as the cover allows.
+			# Big posters decode many times faster, in a fraction of the memory.
+			cover.draft('RGB', cover_master_size(cover.size))
 			cover = cover.convert('RGB')
-			cover = PIL.ImageOps.fit(cover, (COVER_WIDTH, COVER_HEIGHT))
+			# Draft may have changed the size a little
+			return cover.resize(cover_master_size(cover.size), PIL.Image.LANCZOS)
 	except PIL.UnidentifiedImageError as e:
 		raise TileError(f'Loading image for {path}: {str(e)}')
 
-	# Choose a representative color from the cover image
-	color = '#' + ''.join(f'{c:02x}' for c in colorpicker.pick(cover))
-
-	buffer = io.BytesIO()
-	cover.save(buffer, format='JPEG', quality=90, subsampling=0, optimize=True)
-	return color, buffer.getvalue()
 
-
-def extract_duration(path):
+def probe_media(path):
+	"""Runs ffprobe once to get both the duration and stream metadata.
+	Returns (duration, streams); duration is None on error."""
 	try:
-		sp = run_command(['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=nokey=1:noprint_wrappers=1', path])
-		return float(sp.stdout)
-	except (subprocess.CalledProcessError, ValueError) as e:
-		log.error(f'Getting video duration for {path}: {e}')
-		return None
+		sp = run_command(['ffprobe', '-v', 'error',
+			'-show_entries', 'format=duration:stream=index,codec_type,codec_name,width,height',
+			'-of', 'json', path])
+		data = json.loads(sp.stdout)
+		return float(data['format']['duration']), data.get('streams', [])
+	except (subprocess.CalledProcessError, ValueError, KeyError, TypeError) as e:
+		log.error(f'Probing {path}: {e}')
+		return None, []
 
 
 def generate_thumbnail(path, duration=None):
+	"""Grabs a keyframe from the video, scaled to cover_master_size() by ffmpeg.
+	The frame is piped as PPM (raw RGB with a header giving its size), so there's
+	no intermediate image compression."""
 	if path.endswith(dbs.VIDEO_EXTENSIONS):
 		log.info(f'Generating thumbnail for {path}')
-		try:
+		if duration is None:
+			duration, streams = probe_media(path)
 			if duration is None:
-				duration = extract_duration(path)
-
-			thumb_pos = str(duration * THUMB_VIDEO_POSITION)
-			sp = run_command(['ffmpeg', '-ss', thumb_pos, '-threads', '1', '-i', path,
-				'-vf', 'scale=1280:720,thumbnail', '-frames:v', '1', '-f', 'apng', '-'])
-			color, jpeg = scale_cover(io.BytesIO(sp.stdout), path)
-			return round(duration), jpeg, color
+				return 0, None
+			if not any(s.get('codec_type') == 'video' for s in streams):
+				log.warning(f'No video stream in {path}, not generating thumbnail')
+				return round(duration), None
+
+		# cover_master_size() as ffmpeg expression: the largest scale factor any format needs
+		scale = None
+		for fmt in cover_formats:
+			fmt_scale = f'max({fmt.width}/iw,{fmt.height}/ih)'
+			scale = fmt_scale if scale is None else f'max({scale},{fmt_scale})'
+		thumb_pos = str(duration * THUMB_VIDEO_POSITION)
+		try:
+			sp = run_command(['ffmpeg', '-v', 'error', '-skip_frame', 'nokey', '-ss', thumb_pos, '-threads', '1', '-i', path,
+				'-map', '0:v:0', '-an', '-sn', '-frames:v', '1',
+				'-vf', f"scale=w='ceil(iw*{scale})':h='ceil(ih*{scale})'",
+				'-pix_fmt', 'rgb24', '-c:v', 'ppm', '-f', 'image2pipe', '-'])
 		except subprocess.CalledProcessError:
 			raise TileError(f'Processing {path}: Command returned error')
 
+		try:
+			frame = PIL.Image.open(io.BytesIO(sp.stdout))
+			frame.load()
+		except (PIL.UnidentifiedImageError, OSError) as e:
+			raise TileError(f'Processing {path}: Bad frame data from ffmpeg: {e}')
+		return round(duration), frame
+
 
 def get_info_image(path):
 	try:
 		with open(path, 'rb') as fd:
 			log.info(f'Found cover {path}')
-			color, jpeg = scale_cover(fd, path)
-			return 0, jpeg, color
+			return 0, scale_cover(fd, path)
 	except OSError as e:
 		log.error(f'Opening cover image {path}: {e}')
-		return 0, None, None
+		return 0, None
 
 
 def get_info_matroska(path):
 	try:
-		with open(path, 'rb') as fd:
-			mkv = enzyme.MKV(fd)
+		# Not mmapped: the file may be truncated or replaced while we're reading it
+		with open(path, 'rb') as fd, enzyme.MKV(fd, use_mmap=False) as mkv:
 			duration = mkv.info.duration
-			duration = round(duration.seconds + duration.microseconds / 1000000)
-			for a in mkv.attachments:
-				if a.mimetype == 'image/jpeg' and a.filename == MKV_COVER_FILE:
-					log.info(f'Found embedded cover in {path}')
-					color, jpeg = scale_cover(a.data, path)
-					return duration, jpeg, color
+			if duration is not None:
+				duration = duration.total_seconds()
+			# Attachments are lazy; only the cover is actually read from the file
+			cover = mkv.get_attachment(MKV_COVER_FILE, 'image/jpeg')
+			if cover is not None:
+				log.info(f'Found embedded cover in {path}')
+				return round(duration or 0), scale_cover(cover.data, path)
 	except (OSError, enzyme.exceptions.Error) as e:
 		log.error(f'Processing metadata from {path}: {e}')
-		return 0, None, None
+		return 0, None
 
-	# If we got here, no embedded cover was found, generate thumbnail
+	# If we got here, no embedded cover was found, generate thumbnail.
+	# Since enzyme already told us the duration, this only takes one ffmpeg run.
 	return generate_thumbnail(path, duration=duration)
 
 
-# returns (duration, jpeg cover image, tile color)
+def get_info_mp4(path):
+	try:
+		with open(path, 'rb') as fd:
+			info = mp4.MP4(fd)
+	except (OSError, mp4.Error) as e:
+		log.error(f'Processing metadata from {path}: {e}')
+		# Let ffmpeg have a go at it
+		return generate_thumbnail(path)
+
+	if info.cover:
+		log.info(f'Found embedded cover in {path}')
+		return round(info.duration or 0), scale_cover(io.BytesIO(info.cover), path)
+
+	# No embedded cover, generate thumbnail
+	return generate_thumbnail(path, duration=info.duration)
+
+
+# returns (duration, cover image)
 def get_video_info(path):
 	_, ext = os.path.splitext(path)
 	ext = ext.lower()
@@ -156,11 +323,20 @@ def get_video_info(path):
 		return get_info_image(path)
 	if ext == '.mkv':
 		return get_info_matroska(path)
-	if ext == '.mp4':
-		return (round(extract_duration(path)), None, None)
+	if ext in ['.mp4', '.m4v', '.mov']:
+		return get_info_mp4(path)
 	
 	log.warning(f'Getting video info: unsupported filetype: {path}')
-	return (0, None, None)
+	return (0, None)
+
+
+# returns (duration, {format key: cover}, tile color)
+def analyze_file(path):
+	duration, image = get_video_info(path)
+	if image is None:
+		return duration, {}, None
+	color, covers = encode_covers(image)
+	return duration, covers, color
 
 
 class BaseTile:
@@ -190,9 +366,9 @@ class BaseTile:
 
 
 	def analyze(self):
-		duration, image, color = get_video_info(self.cover_source_path())
+		duration, covers, color = analyze_file(self.cover_source_path())
 		self.duration = duration
-		self.cover_image = image
+		self.covers = covers
 		self.tile_color = color
 
 
@@ -233,26 +409,29 @@ class IndexedTile(BaseTile):
 
 		self.path = path
 		self.full_path = os.path.join(path, self.name)
-		self.cover_image = None
+		self.covers = {}
+		self.covers_in_db = set()
 		self.cover_needs_update = True
 
 
 
 class RealTile(BaseTile):
-	def __init__(self, parent_path, name):
-		self.name = name
-		self.path = path
-		self.full_path = os.path.join(path, name)
+	def __init__(self, parent_path, entry):
+		"""entry is the os.DirEntry for this tile, from scanning parent_path."""
+		self.name = entry.name
+		self.path = parent_path
+		self.full_path = entry.path
 
 		# Not yet determined
 		self.duration = None
 		self.tile_color = None
-		self.cover_image = None
+		self.covers = {}
+		self.covers_in_db = set()
 		self.cover_needs_update = True
 
-		# Get file attrs
+		# Get file attrs; DirEntry caches these
 		try:
-			st = os.stat(self.full_path)
+			st = entry.stat()
 		except OSError as e:
 			# Can't stat the file we were just created for? Fatal.
 			raise ValueError(repr(e))
@@ -268,17 +447,23 @@ class RealTile(BaseTile):
 		else:
 			self.isdir = False
 			self.fingerprint = f'inode={st.st_ino}:size={st.st_size}:mtime={st.st_mtime_ns}'
+			self.mtime = st.st_mtime
 
-	def valid(self):
-		"""True if the tile is "valid". Meaning the name/filetype/etc checks out."""
-		if self.name.startswith('.'):
+	@staticmethod
+	def wanted(entry):
+		"""True if a DirEntry should become a tile. Meaning the name/filetype/etc checks out.
+		Only needs the file type, which DirEntry usually knows without a stat()."""
+		if entry.name.startswith('.'):
 			return False
 
-		if self.isdir:
-			return True
+		try:
+			if entry.is_dir():
+				return True
+		except OSError:
+			return False
 
 		# File
-		return self.name.endswith(dbs.VIDEO_EXTENSIONS)
+		return entry.name.endswith(dbs.VIDEO_EXTENSIONS)
 
 
 
@@ -311,6 +496,15 @@ class Meta:
 		tiles = [[t.name, t.isdir, t.fingerprint] for t in tiles]
 		return hashlib.sha256(json.dumps(tiles).encode('utf8')).hexdigest()
 
+	@classmethod
+	def summarize(cls, mtime, tiles):
+		"""Returns the summary of a scan, as kept in dbs.SCAN_DB_NAME."""
+		return {
+			'mtime': mtime,
+			'fingerprint': cls.fingerprint(tiles),
+			'covers': [fmt.key for fmt in cover_formats],
+		}
+
 	def __eq__(self, other):
 		if other is None:
 			return False
@@ -324,14 +518,86 @@ class Meta:
 
 
 
+def analyze_tiles(tiles, cache=None):
+	"""Runs analyze_file() for all tiles concurrently on the analysis pool.
+	Results are stored on the tiles; a failure only affects its own tile.
+	Tiles found in the analysis cache (in all cover formats) aren't analyzed again."""
+	uncached = []
+	for tile in tiles:
+		infos = {}
+		for fmt in cover_formats:
+			info = cache.get(tile.fingerprint, fmt.key) if cache else None
+			if info is None:
+				uncached.append(tile)
+				break
+			infos[fmt.key] = info
+		else:
+			log.debug(f'Found {tile.name} in analysis cache')
+			tile.duration, _, tile.tile_color = infos[cover_formats[0].key]
+			tile.covers = {key: cover for key, (_, cover, _) in infos.items() if cover}
+
+	# Used to do this in multiprocessing.Pool(), but this deadlocked often
+	# https://pythonspeed.com/articles/python-multiprocessing/
+	# The heavy lifting happens in ffmpeg/ffprobe subprocesses and in PIL, which
+	# release the GIL, so threads are good enough.
+	futures = [analysis_pool.submit(analyze_file, tile.cover_source_path()) for tile in uncached]
+	for tile, future in zip(uncached, futures):
+		try:
+			duration, covers, color = future.result()
+		except Exception as e:
+			log.error(f'Analyzing {tile.cover_source_path()}: {e}')
+			duration, covers, color = 0, {}, None
+		else:
+			# Don't remember analyses that yielded nothing; these are likely errors
+			if cache and (duration or covers):
+				for fmt in cover_formats:
+					cache.put(tile.fingerprint, fmt.key, duration, covers.get(fmt.key), color)
+		tile.duration = duration
+		tile.covers = covers
+		tile.tile_color = color
+
+	if cache and uncached:
+		cache.commit()
+
+
+
+# How many directory scans took which path:
+#   unchanged  summary of the last scan matched, nothing else looked at
+#   verified   index and cover DBs compared, nothing written
+#   updated    index or cover DBs rewritten, without analyzing files
+#   analyzed   files analyzed
+#   gone       directory disappeared
+scan_stats = collections.Counter()
+scan_stats_lock = threading.Lock()
+
+
+def count_scan(tier):
+	with scan_stats_lock:
+		scan_stats[tier] += 1
+
+
+def find_root(path):
+	"""Returns the library root path is in, or None."""
+	for root in roots:
+		if os.path.commonpath((path, root)) == root:
+			return root
+	return None
+
+
+
 def scan(path):
 	log.debug(f'Scanning {path}')
 	if not os.path.isdir(path):
 		log.info(f'{path} is gone, nothing to do')
+		update_catalog(path, None)
+		record_change('index', path)
+		count_scan('gone')
 		return
 
 	index_db_name = os.path.join(path, dbs.INDEX_DB_NAME)
+	scan_db_name = os.path.join(path, dbs.SCAN_DB_NAME)
 	orig_index = dbs.json_read(index_db_name, dbs.INDEX_DB_SCHEMA)
+	orig_scan = dbs.json_read(scan_db_name, dbs.SCAN_DB_SCHEMA, default=None)
 
 	#### Check meta version, extract file info index
 	indexes = []
@@ -347,6 +613,47 @@ def scan(path):
 			log.error(f'Error parsing index DB version {index_db_name}: {str(e)}')
 
 
+	#### List actual files, convert into tiles
+	real_tiles = []
+	try:
+		# Stat before listing; changes made while listing don't match the summary next time
+		dir_mtime = os.stat(path).st_mtime_ns
+		with os.scandir(path) as it:
+			entries = list(it)
+	except FileNotFoundError:
+		log.warning(f'Directory disappeared while we were working on it: {path}')
+		update_catalog(path, None)
+		record_change('index', path)
+		count_scan('gone')
+		return
+	names = [entry.name for entry in entries]
+
+	for entry in entries:
+		if not RealTile.wanted(entry):
+			continue
+		try:
+			tile = RealTile(path, entry)
+			real_tiles.append(tile)
+		except ValueError as e:
+			log.error(f'Error inspecting {path} {entry.name}: {repr(e)}')
+
+	real_tiles = sorted(real_tiles)
+	mtimes = {tile.name: int(tile.mtime) for tile in real_tiles if not tile.isdir}
+
+
+	#### Fast path: if nothing changed since the last scan, the index and cover DBs
+	#### are still good; no need to look at them any further.
+	# The index must still be the one that scan wrote; another (older) Clerk may have replaced it
+	summary = Meta.summarize(dir_mtime, real_tiles)
+	if indexed_meta == Meta.from_tiles(real_tiles) and orig_scan is not None and orig_scan.get('summary') == summary and \
+			tuple(orig_scan['index']) == stat_key(index_db_name) and \
+			all(os.path.isfile(os.path.join(path, fmt.db_name)) for fmt in cover_formats if real_tiles):
+		log.info(f'{path} unchanged since last scan, skipping')
+		update_catalog(path, summary['fingerprint'], orig_index['files'])
+		count_scan('unchanged')
+		return
+
+
 	#### Convert index to tiles
 	indexed_tiles = []
 	for data in indexes:
@@ -358,50 +665,56 @@ def scan(path):
 	del indexes
 
 
-	#### Covers DB
-	cover_db_name = os.path.join(path, dbs.COVER_DB_NAME)
-	cover_db_fingerprint = None
-	try:
-		with zipfile.ZipFile(cover_db_name, 'r') as fd:
-			log.debug(f'Found existing covers DB {cover_db_name}')
-			cover_meta = json.loads(fd.read(COVER_META_TAG))
-			if cover_meta['version'] != dbs.INDEX_META_VERSION:
-				log.info(f'Existing {cover_db_name} outdated version, discarding')
-			elif cover_meta['dimensions'] != f'{COVER_WIDTH}x{COVER_HEIGHT}':
-				log.info(f'Existing {cover_db_name} has wrong cover dimensions, discarding')
-			elif cover_meta['fingerprint'] != Meta.fingerprint(indexed_tiles):
-				log.warning(f'Existing {cover_db_name} fingerprint doesn\'t match {index_db_name}, discarding')
-			else:
-				for tile in indexed_tiles:
-					tile.cover_image = fd.read(tile.name)
-					if tile.cover_image == b'':
-						tile.cover_image = None
-					tile.cover_needs_update = False
-				cover_db_fingerprint = cover_meta['fingerprint']
-	except FileNotFoundError:
-		log.info(f'Cover DB {cover_db_name} missing')
-	except (OSError, zipfile.BadZipFile, json.JSONDecodeError, KeyError, TypeError) as e:
-		log.error(f'Parsing {cover_db_name}: {e}')
-
-
-	#### List actual files, convert into tiles
-	real_tiles = []
-	try:
-		names = os.listdir(path)
-	except FileNotFoundError:
-		log.warning(f'Directory disappeared while we were working on it: {path}')
-		return
+	#### Cover DBs, one for every cover format
+	cover_db_fingerprints = {}
+	for fmt in cover_formats:
+		covers = fmt.open(path)
+		if covers is None:
+			continue
+		with covers:
+			log.debug(f'Found existing covers DB {covers.filename}')
+			try:
+				cover_meta = covers.meta
+				if cover_meta['version'] != dbs.INDEX_META_VERSION:
+					log.info(f'Existing {covers.filename} outdated version, discarding')
+				elif cover_meta['dimensions'] != fmt.dimensions or cover_meta.get('encoding', 'jpeg') != fmt.encoding:
+					log.info(f'Existing {covers.filename} has wrong cover dimensions or encoding, discarding')
+				elif cover_meta['fingerprint'] != Meta.fingerprint(indexed_tiles):
+					log.warning(f'Existing {covers.filename} fingerprint doesn\'t match {index_db_name}, discarding')
+				elif not all(tile.name in covers for tile in indexed_tiles):
+					log.warning(f'Existing {covers.filename} is missing covers, discarding')
+				else:
+					# Don't load the covers; when the DB is rewritten, they're copied over from the old one
+					for tile in indexed_tiles:
+						tile.covers_in_db.add(fmt.key)
+					# A legacy covers.zip is never up to date; it must be converted
+					if covers.filename == os.path.join(path, fmt.db_name):
+						cover_db_fingerprints[fmt.key] = cover_meta['fingerprint']
+			except (KeyError, TypeError) as e:
+				log.error(f'Parsing {covers.filename}: {e}')
+
+	# Tiles missing from any cover DB (say, a newly configured variant) need analysis
+	for tile in indexed_tiles:
+		tile.cover_needs_update = len(tile.covers_in_db) < len(cover_formats)
+
+
+	#### Files still being written are indexed without fingerprint or analysis,
+	#### so the rest of the directory is up to date. Check them again later.
+	retry = None
+	indexed_fingerprints = {tile.name: tile.fingerprint for tile in indexed_tiles}
+	partial = readiness.partial_names(names)
+	for tile in real_tiles:
+		if tile.isdir or indexed_fingerprints.get(tile.name) == tile.fingerprint:
+			continue
+		wait = file_readiness.check(tile.full_path, tile.mtime, partial)
+		if wait is not None:
+			tile.fingerprint = None
+			retry = wait if retry is None else min(retry, wait)
 
-	for name in names:
-		try:
-			tile = RealTile(path, name)
-			real_tiles.append(tile)
-		except ValueError as e:
-			log.error(f'Error inspecting {path} {name}: {repr(e)}')
 
-	# Filter and sort
-	real_tiles = [tile for tile in real_tiles if tile.valid()]
-	real_tiles = sorted(real_tiles)
+	# Not-ready files change without their stat changing; don't summarize until they're done
+	if retry is not None:
+		summary = None
 
 
 	#### If the index matches reality, we're done.
@@ -423,228 +736,378 @@ def scan(path):
 			log.debug(f'Tile for {name} is stale, re-inspecting')
 
 	#### Update covers/tile_color/duration etc; this is the expensive part
-	update_tiles = [tile for tile in real_tiles if tile.cover_needs_update]
-	paths = [tile.cover_source_path() for tile in update_tiles]
-	# Used to do this in multiprocessing.Pool(), but this deadlocked often
-	# https://pythonspeed.com/articles/python-multiprocessing/
-	# Maybe use a threadpool?
-	new_info = [get_video_info(p) for p in paths]
-	for tile, (duration, image, color) in zip(update_tiles, new_info):
-		tile.duration = duration
-		tile.cover_image = image
-		tile.tile_color = color
-
-	#### Write index
+	update_tiles = [tile for tile in real_tiles if tile.cover_needs_update and (tile.isdir or tile.fingerprint is not None)]
+	analyze_tiles(update_tiles, analysis_caches.get(find_root(path)))
+
+	#### Write index, and what this scan saw: the summary for the fast path next
+	#### time, and file mtimes. Both together, so the state lane sees them match.
+	scan = {'mtimes': mtimes}
+	if summary is not None:
+		scan['summary'] = summary
+	with dir_locks(path):
+		if index_needs_update:
+			dbs.json_write(index_db_name, Meta.full_json(real_tiles))
+		scan['index'] = list(stat_key(index_db_name) or ())
+		if scan != orig_scan:
+			dbs.json_write(scan_db_name, scan)
 	if index_needs_update:
-		dbs.json_write(index_db_name, Meta.full_json(real_tiles))
+		record_change('index', path)
 
 	#### Write covers
-	# FIXME: error checking
 	real_fingerprint = Meta.fingerprint(real_tiles)
-	if cover_db_fingerprint == real_fingerprint:
-		log.info(f'Existing cover DB {cover_db_name} is up to date, skipping')
-	else:
-		if real_tiles:
+	covers_written = False
+	if real_tiles:
+		for fmt in cover_formats:
+			cover_db_name = os.path.join(path, fmt.db_name)
+			if cover_db_fingerprints.get(fmt.key) == real_fingerprint:
+				log.info(f'Existing cover DB {cover_db_name} is up to date, skipping')
+				continue
 			log.info(f'Writing new cover DB {cover_db_name}')
-			with zipfile.ZipFile(cover_db_name + dbs.NEW_SUFFIX, 'w') as fd:
-				meta = {
-					'version': dbs.INDEX_META_VERSION,
-					'dimensions': f'{COVER_WIDTH}x{COVER_HEIGHT}',
-					'fingerprint': real_fingerprint,
-				}
-				fd.writestr(COVER_META_TAG, json.dumps(meta, indent='\t'))
-
-				# Write cover images
-				for tile in real_tiles:
-					fd.writestr(tile.name, tile.cover_image or b'')
-			os.rename(cover_db_name + dbs.NEW_SUFFIX, cover_db_name)
-		else:
-			if os.path.isfile(cover_db_name):
-				log.info(f'No files here, removing {cover_db_name}')
-				os.remove(cover_db_name)
-			else:
-				log.debug(f'No files here, not writing {cover_db_name}')
+			covers_written = True
+			try:
+				write_cover_db(path, real_tiles, real_fingerprint, fmt)
+			except (OSError, coverpack.Error, TileError) as e:
+				log.error(f'Writing {cover_db_name}: {e}')
+		remove_cover_dbs(path, keep={dbs.LEGACY_COVER_DB_NAME} | {fmt.db_name for fmt in cover_formats})
+	else:
+		log.debug(f'No files here, not writing cover DBs')
+		remove_cover_dbs(path)
+	if covers_written:
+		record_change('covers', path)
 
+	update_catalog(path, real_fingerprint, Meta.full_json(real_tiles)['files'])
 
+	if update_tiles:
+		count_scan('analyzed')
+	elif index_needs_update or covers_written:
+		count_scan('updated')
+	else:
+		count_scan('verified')
 
-def process_state_queue(path, roots):
-	if not os.path.isdir(path):
-		log.debug(f'{path} is gone, nothing to do')
+	if retry is not None:
+		log.info(f'Some files in {path} are not completely written yet, scanning again in {retry:.0f}s')
+	return retry
+
+
+
+def update_catalog(path, fingerprint, files=()):
+	"""Updates the catalog of path's library with its index files (fingerprint
+	being that of its tiles), or removes path if fingerprint is None."""
+	catalog = catalogs.get(find_root(path))
+	if catalog is None:
 		return
+	if fingerprint is None:
+		catalog.remove_dir(path)
+	else:
+		catalog.update_dir(path, fingerprint, files)
+
 
-	log.info(f'Processing state events for {path}')
-
-	queue_dir_name = os.path.join(path, dbs.QUEUE_DIR_NAME)
-	state_db_name = os.path.join(path, dbs.STATE_DB_NAME)
-
-	new = not os.path.isdir(queue_dir_name)
-
-	# Ensure queue dir exists
-	os.makedirs(queue_dir_name, exist_ok=True)
-	os.chmod(queue_dir_name, 0o775)
-
-	#### Load original state
-	previous_state = dbs.json_read(state_db_name, dbs.STATE_DB_SCHEMA)
-	# Deep copy for later
-	orig_state = {n: dict(s) for n, s in previous_state.items()}
-
-	if new:
-		# This is a new directory. Setting orig_state = None will force a propagation
-		# of state to the parent (notably, for position: 1).
-		orig_state = None
-
-	# Load filenames from index
-	index = dbs.json_read([path, dbs.INDEX_DB_NAME], dbs.INDEX_DB_SCHEMA, default={'files': []})['files']
-	new_state = {}
-
-	# Match index to previous state on name AND fingerprint
-	remaining = []
-	for idx in index:
-		name = idx['name']
-		state = previous_state.get(name, {})
-		fp = state.get('fingerprint', None)
-		if fp is not None and fp == idx['fingerprint']:
-			new_state[name] = state
-			previous_state.pop(name)
-			log.debug(f'Found name+fingerprint match in previous state for "{name}"')
-		else:
-			remaining.append(idx)
-
-	# Match index to previous state on just fingerprint; these were probably renamed
-	index = remaining
-	remaining = []
-	duplicate_fps = {None} \
-		| {fp for fp, c in collections.Counter([i.get('fingerprint') for i in index]).items() if c > 1} \
-		| {fp for fp, c in collections.Counter([s.get('fingerprint') for s in previous_state.values()]).items() if c > 1}
-	if duplicate_fps != {None}:
-		log.warning(f'Duplicate fingerprints will be ignored: {duplicate_fps}')
-	previous_state_by_fp = {s['fingerprint']: (n, s) for n, s in previous_state.items() if s.get('fingerprint') not in duplicate_fps}
-	for idx in index:
-		name = idx['name']
-		fp = idx.get('fingerprint')
-		if fp in duplicate_fps:
-			remaining.append(idx)
-			continue
-		try:
-			oldname, state = previous_state_by_fp[fp]
-		except KeyError:
-			remaining.append(idx)
-			continue
-		else:
-			new_state[name] = state
-			previous_state.pop(oldname)
-			log.info(f'Found fingerprint match in previous state for "{name}"; renamed from "{oldname}"')
-
-	# Match index to previous state on just name; these were probably updated
-	index = remaining
-	remaining = []
-	for idx in index:
-		name = idx['name']
-		fp = idx.get('fingerprint')
-		try:
-			state = previous_state[name]
-		except KeyError:
-			new_state[name] = {} if fp is None else {'fingerprint': fp}
-			log.info(f'New file "{name}" has no match in previous state')
-		else:
-			log.info(f'Found name match in previous state for "{name}" fingerprint changed from {state.get("fingerprint")} to {fp}')
-			if fp is None:
-				state.pop('fingerprint', None)
-			else:
-				state['fingerprint'] = fp
-			new_state[name] = state
-			previous_state.pop(name)
 
-	# Remaining entries from previous state are unmatched; they were probably removed
-	for n, s in previous_state.items():
-		log.info(f'"{n}" in previous state was not matched to any current file; ignored')
+def record_change(kind, path):
+	"""Records in the change feed of path's library that its kind (index, state, covers) changed."""
+	changelog = changelogs.get(find_root(path))
+	if changelog is not None:
+		changelog.record(kind, path)
 
-	#### Collect any state update files
-	state_queue = {}
+
+
+def remove_cover_dbs(path, keep=()):
+	"""Removes the cover DBs in path, except those named in keep. This cleans up
+	after variant sizes that are no longer configured, and after empty directories."""
+	db_dir = os.path.dirname(dbs.COVER_DB_NAME)
+	db_names = {dbs.COVER_DB_NAME, dbs.LEGACY_COVER_DB_NAME}
 	try:
-		for f in os.scandir(queue_dir_name):
+		for name in os.listdir(os.path.join(path, db_dir)):
+			db_name = os.path.join(db_dir, name)
+			if fnmatch.fnmatchcase(db_name, COVER_VARIANT_DB_PATTERN):
+				db_names.add(db_name)
+	except FileNotFoundError:
+		return
+
+	for db_name in sorted(db_names - set(keep)):
+		filename = os.path.join(path, db_name)
+		if os.path.isfile(filename):
+			log.info(f'Removing cover DB {filename}')
+			os.remove(filename)
+
+
+
+def write_cover_db(path, tiles, fingerprint, fmt):
+	"""Writes a new cover DB of format fmt for tiles. New covers come from tile.covers;
+	covers of tiles that were reused from the index are copied over from the
+	existing cover DB (or legacy covers.zip), one at a time, so this doesn't need
+	all covers in memory at once. Removes the legacy covers.zip afterwards."""
+	cover_db_name = os.path.join(path, fmt.db_name)
+	legacy_db_name = os.path.join(path, dbs.LEGACY_COVER_DB_NAME)
+	meta = {
+		'version': dbs.INDEX_META_VERSION,
+		'dimensions': fmt.dimensions,
+		'encoding': fmt.encoding,
+		'fingerprint': fingerprint,
+	}
+
+	old_db = None
+	if any(fmt.key in tile.covers_in_db for tile in tiles):
+		old_db = fmt.open(path)
+		if old_db is None:
+			raise TileError(f'Cover DB {cover_db_name} disappeared while we were working on it')
+
+	copied = 0
+	try:
+		with coverpack.PackWriter(cover_db_name + dbs.NEW_SUFFIX, meta) as pack:
+			for tile in tiles:
+				if fmt.key in tile.covers_in_db:
+					pack.add(tile.name, old_db.get(tile.name))
+					copied += 1
+				else:
+					pack.add(tile.name, tile.covers.get(fmt.key) or b'')
+	finally:
+		if old_db is not None:
+			old_db.close()
+
+	log.debug(f'Copied {copied} and wrote {len(tiles) - copied} covers to {cover_db_name}')
+	os.rename(cover_db_name + dbs.NEW_SUFFIX, cover_db_name)
+
+	if not fmt.variant and os.path.isfile(legacy_db_name):
+		log.info(f'Removing legacy cover DB {legacy_db_name}')
+		os.remove(legacy_db_name)
+
+
+
+class DirectoryLocks:
+	"""Serializes work on a directory between the scan workers and the state lane.
+	Locks are created on demand and dropped once nobody holds or waits for them."""
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.locks = {}
+
+	@contextlib.contextmanager
+	def __call__(self, path):
+		with self.lock:
+			entry = self.locks.setdefault(path, [threading.Lock(), 0])
+			entry[1] += 1
+		try:
+			with entry[0]:
+				yield
+		finally:
+			with self.lock:
+				entry[1] -= 1
+				if not entry[1]:
+					del self.locks[path]
+
+
+dir_locks = DirectoryLocks()
+
+
+
+class ScanExecutor:
+	"""Scans directories on a pool of worker threads. Shallow directories are
+	scanned first (breadth-first), as those are the ones browsed first. A directory
+	is never scanned by two workers at once: if it's submitted while being scanned,
+	it's scanned again afterwards. Finished scans are collected with results();
+	wake() is called after each one."""
+
+	def __init__(self, workers, wake):
+		self.wake = wake
+		self.lock = threading.Lock()
+		self.queue = queue.PriorityQueue()
+		self.seq = itertools.count()
+		self.queued = set()
+		self.running = set()
+		self.again = set()
+		self.finished = []
+
+		# Progress of the current batch: everything submitted since we were last idle
+		self.batch_start = None
+		self.batch_total = 0
+		self.batch_done = 0
+		self.last_progress = 0
+
+		for i in range(workers):
+			threading.Thread(target=self.run, name=f'scan-{i}', daemon=True).start()
+
+
+	def submit(self, path):
+		with self.lock:
+			if path in self.queued:
+				return
+			if path in self.running:
+				self.again.add(path)
+				return
+			self.enqueue(path)
+
+
+	def enqueue(self, path):
+		# Called with self.lock held
+		if not self.queued and not self.running:
+			self.batch_start = time.time()
+			self.batch_total = 0
+			self.batch_done = 0
+			self.last_progress = self.batch_start
+		self.queued.add(path)
+		self.batch_total += 1
+		self.queue.put((path.count('/'), next(self.seq), path))
+
+
+	def run(self):
+		while True:
+			_, _, path = self.queue.get()
+			with self.lock:
+				self.queued.discard(path)
+				self.running.add(path)
+
 			try:
-				if not f.is_file() or f.path.endswith(dbs.NEW_SUFFIX):
-					continue
-				updates = dbs.json_read(f.path, dbs.STATE_UPDATE_SCHEMA, default={})
-				state_queue[f.stat().st_mtime, f.path] = updates
-			except OSError as e:
-				log.error(f'Reading {f.path}: {str(e)}')
-	except OSError as e:
-		log.error(f'Reading {queue_dir_name}: {str(e)}')
-		state_queue = {}
+				retry = scan(path)
+			except Exception as e:
+				log.exception(f'Scanning {path}: {e}')
+				retry = None
 
-	#### Apply the requested state updates
-	for meta, updates in sorted(state_queue.items()):
-		for name, update in updates.items():
-			log.debug(f'State update for {name}: {update}')
+			with self.lock:
+				self.running.discard(path)
+				self.finished.append((path, retry))
+				self.batch_done += 1
+				if path in self.again:
+					self.again.discard(path)
+					self.enqueue(path)
+				self.progress()
+			self.wake()
 
-			if name not in new_state:
-				new_state[name] = {}
-			this_state = new_state[name]
 
-			if 'position' in update:
-				if update['position'] > 0:
-					this_state['position'] = update['position']
-				else:
-					this_state.pop('position', None)
+	def progress(self):
+		# Called with self.lock held
+		now = time.time()
+		if now - self.last_progress < SCAN_PROGRESS_SECONDS or not self.queued:
+			return
+		self.last_progress = now
+		rate = self.batch_done / max(now - self.batch_start, 0.001)
+		eta = (self.batch_total - self.batch_done) / rate
+		log.info(f'Scanned {self.batch_done}/{self.batch_total} directories ({rate:.1f}/s), ETA {util.duration_format(int(eta), seconds=True)}')
 
-			if 'tagged' in update:
-				if update['tagged']:
-					this_state['tagged'] = True
-				else:
-					this_state.pop('tagged', None)
 
-	#### Write new state
-	if new_state == orig_state:
-		log.debug('State unchanged, not updating.')
-	else:
-		if new_state:
-			dbs.json_write(state_db_name, new_state)
-		else:
-			log.debug(f'Empty state; removing {state_db_name}')
+	def results(self):
+		"""Returns (path, retry) for the scans finished since the last call."""
+		with self.lock:
+			finished, self.finished = self.finished, []
+		return finished
+
+
+	def idle(self):
+		with self.lock:
+			return not self.queued and not self.running and not self.finished
+
+
+	def __str__(self):
+		return f'ScanExecutor(queued={len(self.queued)}, running={len(self.running)})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+class StateLane:
+	"""Processes state queues on a thread of its own, so state updates from clients
+	don't wait for scans. Everything submitted while the previous batch was being
+	processed goes to engine as one batch."""
+
+	def __init__(self, engine):
+		self.engine = engine
+		self.cond = threading.Condition()
+		self.pending = {}
+		self.busy = False
+		self.last_done = 0
+		threading.Thread(target=self.run, name='state', daemon=True).start()
+
+
+	def submit(self, path):
+		with self.cond:
+			self.pending[path] = None
+			self.cond.notify()
+
+
+	def run(self):
+		while True:
+			with self.cond:
+				while not self.pending:
+					self.cond.wait()
+				paths = list(self.pending)
+				self.pending.clear()
+				self.busy = True
+
 			try:
-				os.unlink(state_db_name)
-			except FileNotFoundError:
-				pass
-			except OSError as e:
-				log.error(f'Removing {state_db_name}: {str(e)}')
-
-		# Propagate state upwards (but not outside root dir)
-		if path not in roots:
-			flat = {'tagged': any(s.get('tagged', False) for s in new_state.values())}
-
-			if any(0 < s.get('position', 0) < 1 for s in new_state.values()):
-				flat['position'] = 0.5
-			elif any(s.get('position', 0) == 0 for s in new_state.values()):
-				flat['position'] = 0
-			else:
-				flat['position'] = 1
+				self.engine.process(paths)
+			except Exception as e:
+				log.exception(f'Processing state events for {", ".join(paths)}: {e}')
+			finally:
+				with self.cond:
+					self.busy = False
+					self.last_done = time.time()
 
-			dbs.json_write([os.path.dirname(path), dbs.QUEUE_DIR_NAME, ...], {os.path.basename(path): flat})
 
-	for update_mtime, update_name in state_queue.keys():
-		try:
-			log.debug(f'Removing {update_name}')
-			os.unlink(update_name)
-		except OSError as e:
-			log.error(f'Removing {update_name}: {str(e)}')
+	def idle(self, quiet=0):
+		"""Returns whether nothing is pending, and nothing was processed in the last
+		quiet seconds (its writes may still cause events)."""
+		with self.cond:
+			return not self.pending and not self.busy and time.time() - self.last_done >= quiet
 
 
+	def __str__(self):
+		return f'StateLane(pending={len(self.pending)}, busy={self.busy})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+dbs.write_codec = args.db_codec
+log.info(f'Writing DBs as {dbs.write_codec}')
+if args.db_cache_size > 0:
+	dbs.enable_read_cache(args.db_cache_size * 1024 * 1024)
+
+cover_formats = [CoverFormat(COVER_WIDTH, COVER_HEIGHT, 'jpeg')]
+for width, height in dict.fromkeys(args.cover_variant or []):
+	cover_formats.append(CoverFormat(width, height, args.cover_variant_encoding, variant=True))
+log.info(f'Cover formats: {", ".join(fmt.key for fmt in cover_formats)}')
+
+analysis_threads = max(args.threads, 1)
+log.info(f'Analyzing up to {analysis_threads} files concurrently')
+analysis_pool = concurrent.futures.ThreadPoolExecutor(max_workers=analysis_threads, thread_name_prefix='analysis')
 
 roots = [os.path.abspath(args.path)]
 if not roots:
 	print('Must specify at least one root')
 	exit(1)
-watcher = Watcher(roots)
+analysis_caches = {}
+if args.cache_size > 0:
+	for root in roots:
+		analysis_caches[root] = AnalysisCache(os.path.join(root, dbs.ANALYSIS_CACHE_NAME), max_bytes=args.cache_size * 1024 * 1024)
+catalogs = {root: Catalog(root) for root in roots}
+changelogs = {root: ChangeLog(root) for root in roots}
+watcher = Watcher(roots, backend=args.watcher, poll=args.poll, poll_interval=args.poll_interval)
+# With a watcher that tells when directories settle, we scan as soon as files are
+# completely written. Until then, a long timeout; writes may never seem to finish.
+unsettled_delay = SETTLE_TIMEOUT_SECONDS if watcher.settles else EVENT_COOLDOWN_SECONDS
+# Only trust write/close events from watchers that report closes reliably
+file_readiness = readiness.Readiness(WRITE_SETTLE_SECONDS, trust_events=watcher.settles)
+
+scan_threads = max(args.scan_threads, 1)
+log.info(f'Scanning up to {scan_threads} directories concurrently')
+scanner = ScanExecutor(scan_threads, watcher.wake)
+state_lane = StateLane(StateEngine(roots, dir_locks, max_dirs=STATE_CACHE_DIRS, catalogs=catalogs, changelogs=changelogs))
 
 if not args.skip_initial:
 	for root in roots:
 		watcher.push(root, recursive=True)
 
+# path: time at which to scan it
 scan_dirty = {}
-state_dirty = {}
-for event in watcher.events(timeout=EVENT_COOLDOWN_SECONDS):
+scanned = False
+while True:
+	# Wake up when the next scan is due. In --once mode, quit after a quiet while.
+	timeout = max(min(scan_dirty.values()) - time.time(), 0) if scan_dirty else None
+	if args.once:
+		timeout = EVENT_COOLDOWN_SECONDS if timeout is None else min(timeout, EVENT_COOLDOWN_SECONDS)
+	event = watcher.get(timeout)
 	if event:
 		log.debug(f'Got event: {event}')
 
@@ -654,6 +1117,12 @@ for event in watcher.events(timeout=EVENT_COOLDOWN_SECONDS):
 		if event.isdir and not event.hidden():
 			# Case: path/ itself
 			if event.evtype in {'modified', 'created'}:
+				# Only process index events after a little while. In case a file is being
+				# written, this postpones scanning until the file is completely done.
+				scan_dirty[event.path] = now + EVENT_COOLDOWN_SECONDS
+
+			# Case: path/ no longer has files being written to
+			if event.evtype == 'settled' and event.path in scan_dirty:
 				scan_dirty[event.path] = now
 
 			# Case: path/foo/
@@ -664,18 +1133,19 @@ for event in watcher.events(timeout=EVENT_COOLDOWN_SECONDS):
 			# Case: path/.fabella/queue/foo
 			if os.path.dirname(event.path).endswith('/' + dbs.QUEUE_DIR_NAME):
 				if not event.path.endswith(dbs.NEW_SUFFIX):
-					state_dirty[os.path.dirname(os.path.dirname(os.path.dirname(event.path)))] = now
+					state_lane.submit(os.path.dirname(os.path.dirname(os.path.dirname(event.path))))
 
 			# Case: path/.fabella/state.json.gz
 			elif event.path.endswith('/' + dbs.STATE_DB_NAME):
-				state_dirty[os.path.dirname(os.path.dirname(event.path))] = now
+				state_lane.submit(os.path.dirname(os.path.dirname(event.path)))
 
 			# Case: path/.fabella/index.json.gz
 			elif event.path.endswith('/' + dbs.INDEX_DB_NAME):
 				watcher.push(os.path.dirname(os.path.dirname(event.path)))
 
-			# Case: path/.fabella/covers.zip
-			elif event.path.endswith('/' + dbs.COVER_DB_NAME):
+			# Case: path/.fabella/covers.pack, path/.fabella/covers.WxH.pack, path/.fabella/covers.zip
+			elif event.path.endswith(('/' + dbs.COVER_DB_NAME, '/' + dbs.LEGACY_COVER_DB_NAME)) \
+					or fnmatch.fnmatchcase(event.path, '*/' + COVER_VARIANT_DB_PATTERN):
 				watcher.push(os.path.dirname(os.path.dirname(event.path)))
 
 			# Case: path/.cover.jpg
@@ -684,25 +1154,30 @@ for event in watcher.events(timeout=EVENT_COOLDOWN_SECONDS):
 
 			# Case: path/foo.bar
 			else:
-				# Only do something for file extensions we care about
-				if event.path.endswith(dbs.VIDEO_EXTENSIONS):
-					watcher.push(os.path.dirname(event.path))
+				# Only do something for file extensions we care about. Scanned once path/
+				# settles; mark it directly, as the 'settled' event is already queued.
+				path = os.path.dirname(event.path)
+				if event.path.endswith(dbs.VIDEO_EXTENSIONS) and find_root(path) is not None:
+					file_readiness.event(event)
+					scan_dirty[path] = now + unsettled_delay
 
 	# Items needing a full scan (index/cover update)
-	for path, age in list(scan_dirty.items()):
-		# Only process index events after a little while. In case a file is being
-		# written, this postpones scanning until the file is completely done.
-		if now - age > EVENT_COOLDOWN_SECONDS:
+	for path, due in list(scan_dirty.items()):
+		if now >= due:
 			del scan_dirty[path]
-			scan(path)
-			state_dirty[path] = now
+			scanner.submit(path)
+
+	for path, retry in scanner.results():
+		scanned = True
+		if retry is not None:
+			scan_dirty.setdefault(path, now + retry)
+		state_lane.submit(path)
 
-	# Items needing a state update
-	for path, age in list(state_dirty.items()):
-		# Don't think we need a cooldown for state updates.
-		#if now - age > EVENT_COOLDOWN_SECONDS:
-		del state_dirty[path]
-		process_state_queue(path, roots)
+	if scanned and not scan_dirty and scanner.idle():
+		log.info(f'Scanned directories: {", ".join(f"{n} {tier}" for tier, n in scan_stats.most_common())}')
+		if dbs.read_cache is not None:
+			log.info(f'DB read cache: {dbs.read_cache}')
+		scanned = False
 
-	if args.once and not scan_dirty and not state_dirty:
+	if args.once and not scan_dirty and scanner.idle() and state_lane.idle(EVENT_COOLDOWN_SECONDS):
 		break
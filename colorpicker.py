@@ -7,6 +7,16 @@
 import math
 import PIL
 
+import loghelper
+
+log = loghelper.get_logger('ColorPicker', loghelper.Color.BrightBlue)
+
+try:
+	import numpy
+except ModuleNotFoundError:
+	log.warning("Couldn't load numpy module; picking tile colors will be slower")
+	numpy = None
+
 
 def color_distance(c1, c2):
 	"""Return a number indicating how dissimilar two color tuples are."""
@@ -16,10 +26,8 @@ def color_distance(c1, c2):
 	return sum(abs(a - b) ** (1/2) for a, b in zip(c1, c2))
 
 
-def pick(img, colors=32):
-	"""Pick a representative color for img. colors should be 1-256.
-	A higher number of colors should give a better result, but will be slower.
-	"""
+def histogram(img, colors):
+	"""Quantize img into colors; returns a {color-tuple: count} histogram."""
 
 	# Quantize the image into colors; this will effectively generate a histogram for us
 	quantized = img.quantize(colors, method=PIL.Image.Quantize.FASTOCTREE)
@@ -29,19 +37,48 @@ def pick(img, colors=32):
 	palette = [tuple(palette[i*3:i*3+3]) for i in range(colors)]
 
 	# [color-tuple: count] histogram
-	histogram = {palette[color]: count for count, color in quantized.getcolors(colors)}
+	return {palette[color]: count for count, color in quantized.getcolors(colors)}
+
+
+def pick(img, colors=32):
+	"""Pick a representative color for img. colors should be 1-256.
+	A higher number of colors should give a better result, but will be slower.
+	With numpy, even 256 colors is cheap.
+	"""
+	if numpy is None:
+		return pick_python(img, colors)
+	return pick_numpy(img, colors)
+
+
+def pick_python(img, colors=32):
+	"""Pure Python pick(); the number of color_distance() calls is quadratic in colors."""
+	hist = histogram(img, colors)
 
 	best_color = None
 	best_distance = math.inf
 	# We consider all colors in the histogram as candidates for the "best color".
 	# For every color, we calculate the cumulative distance to all colors in the
 	# histogram, and we select the color with the lowest such cumulative distance.
-	for color in histogram.keys():
+	for color in hist.keys():
 		distance = 0
-		for other, count in histogram.items():
+		for other, count in hist.items():
 			distance += color_distance(color, other) * count
 		if distance < best_distance:
 			best_color = color
 			best_distance = distance
 
 	return best_color
+
+
+def pick_numpy(img, colors=32):
+	"""Vectorized pick(); same result as pick_python(), but computes the distance
+	of all pairs of colors and the count-weighted sums in one go."""
+	hist = histogram(img, colors)
+	candidates = list(hist.keys())
+	palette = numpy.array(candidates, dtype=numpy.float64)
+	counts = numpy.array(list(hist.values()), dtype=numpy.float64)
+
+	# [i, j] is color_distance(palette[i], palette[j])
+	distances = numpy.sqrt(numpy.abs(palette[:, None, :] - palette[None, :, :])).sum(axis=2)
+	# argmin returns the first of equal distances, like the strict < in pick_python()
+	return candidates[int(numpy.argmin(distances @ counts))]
@@ -46,6 +46,8 @@ class menu:
 	text_size = 36
 	header_hspace = 64
 	header_vspace = 32
+	# How often to check Clerk's change feed for changes to the folder shown; 0 disables it
+	refresh_interval = 2
 
 class video:
 	position_bar_height = 1
@@ -61,3 +63,7 @@ class ui:
 class performance:
 	text_cache_items = 512
 	text_low_quality_outline = False
+	# Append state updates to a journal per client, instead of writing a queue file each
+	state_journal = False
+	# Memory for caching index and state DBs of folders visited; 0 disables it
+	db_cache_mb = 32
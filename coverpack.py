@@ -0,0 +1,276 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Cover pack: a memory-mappable container for cover images, replacing covers.zip.
+#
+# Layout (all integers little-endian):
+#   header   magic 'FBCP', u16 version, u16 reserved, u32 count, u32 meta length,
+#            u64 table offset, u64 names offset; padded to HEADER_SIZE
+#   meta     JSON object, directly after the header
+#   blobs    cover images, each starting on a PAGE_SIZE boundary
+#   table    count entries of u32 name offset, u32 name length, u64 blob offset,
+#            u64 blob length; sorted by (utf-8) name
+#   names    utf-8 names, concatenated; name offsets are relative to this
+#
+# Readers mmap the file and look names up with a binary search on the table, so
+# opening a pack is cheap and only the pages of covers actually used are read.
+
+import os
+import io
+import json
+import mmap
+import struct
+import zipfile
+
+import dbs
+import loghelper
+
+log = loghelper.get_logger('CoverPack', loghelper.Color.BrightBlue)
+
+MAGIC = b'FBCP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHIIQQ')
+HEADER_SIZE = 64
+ENTRY = struct.Struct('<IIQQ')
+PAGE_SIZE = 4096
+
+# Member holding the meta data in legacy covers.zip files
+ZIP_META_TAG = '.meta'
+
+
+
+class Error(Exception):
+	pass
+
+
+
+class CoverPack:
+	"""Reader for a cover pack. get() returns zero-copy memoryviews into the mmapped file."""
+
+	def __init__(self, filename):
+		self.filename = filename
+		with open(filename, 'rb') as fd:
+			try:
+				self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+			except ValueError as e:
+				# Empty file
+				raise Error(f'{filename}: {e}')
+		self.view = memoryview(self.mmap)
+
+		try:
+			if len(self.mmap) < HEADER_SIZE:
+				raise Error(f'{filename}: Truncated header')
+			magic, version, _, self.count, meta_len, self.table_offset, self.names_offset = HEADER.unpack_from(self.mmap)
+			if magic != MAGIC:
+				raise Error(f'{filename}: Not a cover pack')
+			if version != VERSION:
+				raise Error(f'{filename}: Unsupported cover pack version {version}')
+			if self.table_offset + self.count * ENTRY.size > len(self.mmap) or self.names_offset > len(self.mmap):
+				raise Error(f'{filename}: Truncated table')
+			self.meta = json.loads(bytes(self.mmap[HEADER_SIZE:HEADER_SIZE + meta_len]))
+		except (Error, ValueError):
+			self.close()
+			raise
+
+
+	def entry(self, idx):
+		name_off, name_len, blob_off, blob_len = ENTRY.unpack_from(self.mmap, self.table_offset + idx * ENTRY.size)
+		start = self.names_offset + name_off
+		return self.mmap[start:start + name_len], blob_off, blob_len
+
+
+	def find(self, name):
+		"""Binary search for name. Returns (blob offset, blob length) or None."""
+		key = name.encode('utf-8')
+		lo, hi = 0, self.count
+		while lo < hi:
+			mid = (lo + hi) // 2
+			mid_name, blob_off, blob_len = self.entry(mid)
+			if mid_name < key:
+				lo = mid + 1
+			elif mid_name > key:
+				hi = mid
+			else:
+				return blob_off, blob_len
+		return None
+
+
+	def get(self, name):
+		"""Returns the cover for name as memoryview (possibly empty), or None if it's not in the pack."""
+		found = self.find(name)
+		if found is None:
+			return None
+		blob_off, blob_len = found
+		if blob_len and blob_off + blob_len > len(self.mmap):
+			raise Error(f'{self.filename}: Truncated cover for {name}')
+		return self.view[blob_off:blob_off + blob_len]
+
+
+	def names(self):
+		return [self.entry(i)[0].decode('utf-8') for i in range(self.count)]
+
+
+	def __contains__(self, name):
+		return self.find(name) is not None
+
+
+	def close(self):
+		try:
+			self.view.release()
+			self.mmap.close()
+		except BufferError:
+			# Someone still holds a memoryview; the mmap will be closed once that's gone
+			pass
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __str__(self):
+		return f'CoverPack({self.filename}, count={self.count})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+class PackWriter:
+	"""Writes a cover pack. Covers are written as they're added, only the table is kept in memory."""
+
+	def __init__(self, filename, meta):
+		self.filename = filename
+		self.fd = open(filename, 'wb')
+		self.entries = {}
+
+		meta = json.dumps(meta).encode('utf-8')
+		self.meta_len = len(meta)
+		self.fd.write(bytes(HEADER_SIZE))
+		self.fd.write(meta)
+
+
+	def add(self, name, data):
+		if name in self.entries:
+			raise ValueError(f'Duplicate name {name} in {self.filename}')
+
+		# Page-align every cover. Empty ones take no space; aligning those could
+		# leave their offset past the end of the file.
+		pos = self.fd.tell()
+		if data:
+			pos += -pos % PAGE_SIZE
+			self.fd.seek(pos)
+			self.fd.write(data)
+		self.entries[name] = (pos, len(data))
+
+
+	def close(self):
+		if self.fd is None:
+			return
+
+		names = io.BytesIO()
+		table = io.BytesIO()
+		for name in sorted(self.entries, key=lambda n: n.encode('utf-8')):
+			blob_off, blob_len = self.entries[name]
+			encoded = name.encode('utf-8')
+			table.write(ENTRY.pack(names.tell(), len(encoded), blob_off, blob_len))
+			names.write(encoded)
+
+		self.fd.seek(0, os.SEEK_END)
+		table_offset = self.fd.tell()
+		self.fd.write(table.getvalue())
+		names_offset = self.fd.tell()
+		self.fd.write(names.getvalue())
+
+		self.fd.seek(0)
+		self.fd.write(HEADER.pack(MAGIC, VERSION, 0, len(self.entries), self.meta_len, table_offset, names_offset))
+		self.fd.close()
+		self.fd = None
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, *args):
+		if exc_type is None:
+			self.close()
+		else:
+			self.fd.close()
+			self.fd = None
+
+
+
+class ZipCovers:
+	"""Compatibility reader for legacy covers.zip files, with the same interface as CoverPack."""
+
+	def __init__(self, filename):
+		self.filename = filename
+		self.zip = zipfile.ZipFile(filename, 'r')
+		try:
+			self.meta = json.loads(self.zip.read(ZIP_META_TAG))
+			self.members = set(self.zip.namelist())
+		except (KeyError, ValueError) as e:
+			self.zip.close()
+			raise Error(f'{filename}: {e}')
+		self.count = len(self.members) - 1
+
+
+	def get(self, name):
+		if name not in self.members:
+			return None
+		return self.zip.read(name)
+
+
+	def names(self):
+		return [name for name in self.zip.namelist() if name != ZIP_META_TAG]
+
+
+	def __contains__(self, name):
+		return name in self.members
+
+
+	def close(self):
+		self.zip.close()
+
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __str__(self):
+		return f'ZipCovers({self.filename}, count={self.count})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+def open_covers(path, size=None):
+	"""Opens the cover DB for directory path: the cover pack, or a legacy covers.zip
+	if there's no (readable) pack. If size (width, height) is given, opens the cover
+	pack of that variant size instead. Returns None if nothing can be read."""
+	if size is None:
+		candidates = [(dbs.COVER_DB_NAME, CoverPack), (dbs.LEGACY_COVER_DB_NAME, ZipCovers)]
+	else:
+		width, height = size
+		candidates = [(dbs.COVER_VARIANT_DB_NAME.format(width=width, height=height), CoverPack)]
+
+	for name, cls in candidates:
+		filename = os.path.join(path, name)
+		try:
+			covers = cls(filename)
+			log.debug(f'Opened {covers}')
+			return covers
+		except FileNotFoundError:
+			continue
+		except (OSError, Error, zipfile.BadZipFile) as e:
+			log.error(f'Opening cover DB {filename}: {e}')
+
+	log.info(f'No {candidates[0][0]} in {path}')
+	return None
@@ -9,13 +9,30 @@
 INDEX_DB_NAME = '.fabella/index.json.gz'
 INDEX_META_VERSION = 2
 
-COVER_DB_NAME = '.fabella/covers.zip'
+COVER_DB_NAME = '.fabella/covers.pack'
+# Additional cover packs for other tile sizes; format with width and height
+COVER_VARIANT_DB_NAME = '.fabella/covers.{width}x{height}.pack'
+LEGACY_COVER_DB_NAME = '.fabella/covers.zip'
+ANALYSIS_CACHE_NAME = '.fabella/analysis.sqlite'
+# Only in library roots
+CATALOG_NAME = '.fabella/catalog.sqlite'
+CHANGES_LOG_NAME = '.fabella/changes.log'
 
 STATE_DB_NAME = '.fabella/state.json.gz'
+# What Clerk's last scan saw; kept out of the index, which older versions validate strictly
+SCAN_DB_NAME = '.fabella/scan.json.gz'
+# Aggregate stats of subdirectories, kept by Clerk along with their state
+STATS_DB_NAME = '.fabella/stats.json.gz'
+POLL_SNAPSHOT_NAME = '.fabella/poll.json.gz'
+POLL_SNAPSHOT_VERSION = 1
 QUEUE_DIR_NAME = '.fabella/queue'
 NEW_SUFFIX = '.new'
+# Per-client state journals in QUEUE_DIR_NAME, and how far Clerk has read them
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_OFFSETS_NAME = '.fabella/journal.json.gz'
+JOURNAL_MAX_RECORD = 1024 * 1024
 
-VIDEO_FILETYPES = ['mkv', 'mp4', 'webm', 'avi', 'wmv']
+VIDEO_FILETYPES = ['mkv', 'mp4', 'm4v', 'mov', 'webm', 'avi', 'wmv']
 VIDEO_EXTENSIONS = tuple('.' + ext for ext in VIDEO_FILETYPES)
 
 STATE_DB_SCHEMA = {
@@ -25,7 +42,56 @@ STATE_DB_SCHEMA = {
 		'tagged?': int,
 	}
 }
+STATS_DB_SCHEMA = {
+	# Subdirectory name: aggregates of the videos in (and below) it
+	'*': {
+		'files': int,
+		'unseen': int,
+		'watching': int,
+		# Seconds
+		'duration': int,
+		'remaining': int,
+		# Newest video's mtime, in seconds
+		'newest': int,
+	}
+}
 STATE_UPDATE_SCHEMA = STATE_DB_SCHEMA
+JOURNAL_RECORD_SCHEMA = {
+	'time': float,
+	'updates': STATE_UPDATE_SCHEMA,
+}
+JOURNAL_OFFSETS_SCHEMA = {
+	# Journal file name
+	'*': {
+		'inode': int,
+		'offset': int,
+	}
+}
+POLL_SNAPSHOT_SCHEMA = {
+	'version': int,
+	'dirs': {
+		# Directory path, relative to the polled directory
+		'*': {
+			'mtime': int,
+			'dirs': [str],
+			# [size, mtime] of every file
+			'files': {'*': [int]},
+		}
+	}
+}
+SCAN_DB_SCHEMA = {
+	# Directory mtime, fingerprint of its tiles and cover formats at the last scan;
+	# missing while files in it aren't completely written
+	'summary?': {
+		'mtime': int,
+		'fingerprint': str,
+		'covers': [str],
+	},
+	# [mtime_ns, size, inode] of the index written by that scan
+	'index': [int],
+	# Video name: mtime, in seconds
+	'mtimes': {'*': int},
+}
 INDEX_DB_SCHEMA = {
 	'meta': { 'version': int },
 	'files': [
@@ -45,12 +111,42 @@ import os
 import gzip
 import zlib
 import json
+import time
 import uuid
+import socket
+import struct
+import marshal
+import threading
+import collections
 
 import loghelper
 
 log = loghelper.get_logger('DBs', loghelper.Color.Magenta)
 
+# Optional codecs; only needed to write (and read) DBs with them
+try:
+	import zstandard
+except ModuleNotFoundError:
+	zstandard = None
+try:
+	import lz4.frame
+except ModuleNotFoundError:
+	lz4 = None
+try:
+	import msgpack
+except ModuleNotFoundError:
+	msgpack = None
+
+# Journal record header: u32 payload length, u32 payload crc32 (little-endian)
+JOURNAL_RECORD_HEADER = struct.Struct('<II')
+
+# DB frame header: magic, u8 version, u8 serializer, u8 compressor, u8 reserved,
+# u64 payload length (little-endian). Legacy DBs have no header: they're (gzipped) JSON.
+FRAME_MAGIC = b'FBDB'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sBBBBQ')
+GZIP_MAGIC = b'\x1f\x8b'
+
 
 
 class JsonValidationError(Exception):
@@ -58,59 +154,331 @@ class JsonValidationError(Exception):
 
 
 
-def json_validate(data, schema, keyname=None):
-	if isinstance(schema, dict):
-		if not isinstance(data, dict):
-			raise JsonValidationError(f'Expected object for {keyname}, not {data}')
-		mandatory, optional, wildcard = {}, {}, None
-		for k, v in schema.items():
-			if k == '*':
-				wildcard = v
-			elif k.endswith('?'):
-				optional[k[:-1]] = v
-			else:
-				mandatory[k] = v
+# Validators compiled by compile_schema: id(schema): (schema, validator)
+compiled_schemas = {}
 
-		unknown = []
-		for k, v in data.items():
-			if k in mandatory:
-				json_validate(v, mandatory[k], keyname=k)
-				del mandatory[k]
-			elif k in optional:
-				json_validate(v, optional[k], keyname=k)
-			elif wildcard is not None:
-				json_validate(v, wildcard, keyname=k)
-			else:
-				unknown.append(k)
 
-		if unknown:
-			raise JsonValidationError(f'Extra keys {unknown} in {data}')
-		if mandatory:
-			raise JsonValidationError(f'Missing keys {list(mandatory.keys())} in {data}')
+
+def compile_schema(schema):
+	"""Returns a function validator(data, keyname=None) that checks data against
+	schema, like json_validate() does. Schemas are compiled once and cached."""
+	try:
+		cached_schema, validator = compiled_schemas[id(schema)]
+		if cached_schema is schema:
+			return validator
+	except KeyError:
+		pass
+
+	if isinstance(schema, dict):
+		validator = compile_object(schema)
 
 	elif isinstance(schema, list):
 		if len(schema) != 1:
 			raise ValueError(f'Schema list must have length one: {schema}')
-		schema = schema[0]
-		for idx, item in enumerate(data):
-			json_validate(item, schema, keyname=str(idx))
+		item_validator = compile_schema(schema[0])
+		def validator(data, keyname=None):
+			# Indexes are only formatted into error messages, same as str(idx)
+			for idx, item in enumerate(data):
+				item_validator(item, idx)
 
 	# Optional hack
 	elif isinstance(schema, tuple):
 		if len(schema) != 1:
 			raise ValueError(f'Schema tuple must have length one: {schema}')
-		schema = schema[0]
-		if data is not None:
-			json_validate(data, schema, keyname=keyname)
+		value_validator = compile_schema(schema[0])
+		def validator(data, keyname=None):
+			if data is not None:
+				value_validator(data, keyname)
 
 	elif schema in {str, bool, int, float}:
-		if schema is float:
-			schema = (int, float)
-		if not isinstance(data, schema):
-			raise JsonValidationError(f'Key {keyname}={data!r} should be type {schema}')
+		types = (int, float) if schema is float else schema
+		def validator(data, keyname=None):
+			if not isinstance(data, types):
+				raise JsonValidationError(f'Key {keyname}={data!r} should be type {types}')
 	else:
 		raise KeyError(f'Unsupported schema type: {schema}')
 
+	# Keep the schema alive, so its id isn't reused
+	compiled_schemas[id(schema)] = (schema, validator)
+	return validator
+
+
+
+def compile_object(schema):
+	# key: (validator, mandatory)
+	fields = {}
+	wildcard = None
+	for k, v in schema.items():
+		if k == '*':
+			wildcard = compile_schema(v)
+		elif k.endswith('?'):
+			fields[k[:-1]] = (compile_schema(v), False)
+		else:
+			fields[k] = (compile_schema(v), True)
+	mandatory = [k for k, (_, is_mandatory) in fields.items() if is_mandatory]
+
+	if not fields and wildcard is not None:
+		def validator(data, keyname=None):
+			if not isinstance(data, dict):
+				raise JsonValidationError(f'Expected object for {keyname}, not {data}')
+			for k, v in data.items():
+				wildcard(v, k)
+		return validator
+
+	def validator(data, keyname=None):
+		if not isinstance(data, dict):
+			raise JsonValidationError(f'Expected object for {keyname}, not {data}')
+		unknown = []
+		seen = 0
+		for k, v in data.items():
+			field = fields.get(k)
+			if field is not None:
+				field[0](v, k)
+				seen += field[1]
+			elif wildcard is not None:
+				wildcard(v, k)
+			else:
+				unknown.append(k)
+
+		if unknown:
+			raise JsonValidationError(f'Extra keys {unknown} in {data}')
+		if seen != len(mandatory):
+			raise JsonValidationError(f'Missing keys {[k for k in mandatory if k not in data]} in {data}')
+	return validator
+
+
+
+def json_validate(data, schema, keyname=None):
+	compile_schema(schema)(data, keyname)
+
+
+
+class CodecError(ValueError):
+	pass
+
+
+
+class Codec:
+	"""How DBs are encoded: a serializer (json or msgpack) and a compressor (none,
+	gzip, zstd or lz4) at an optional level. Written as 'serializer+compressor:level',
+	for example 'json+gzip:1' or 'msgpack+zstd'. Encoded DBs start with a frame
+	header, so readers can tell them apart. 'legacy' is tab-indented JSON, gzipped
+	at level 9 without a header, which clients of every version can read.
+	"""
+
+	SERIALIZERS = {'json': 1, 'msgpack': 2}
+	COMPRESSORS = {'none': 0, 'gzip': 1, 'zstd': 2, 'lz4': 3}
+	# Levels each compressor takes (zstd's negative levels are its fast modes)
+	LEVELS = {'none': range(0), 'gzip': range(0, 10), 'zstd': range(-131072, 23), 'lz4': range(0, 17)}
+
+	def __init__(self, serializer='json', compressor='gzip', level=None, legacy=False):
+		if serializer not in self.SERIALIZERS:
+			raise CodecError(f'Unknown serializer {serializer!r}; choose from {", ".join(self.SERIALIZERS)}')
+		if compressor not in self.COMPRESSORS:
+			raise CodecError(f'Unknown compressor {compressor!r}; choose from {", ".join(self.COMPRESSORS)}')
+		for name, module in [('msgpack', msgpack), ('zstd', zstandard), ('lz4', lz4)]:
+			if name in {serializer, compressor} and module is None:
+				raise CodecError(f'{name} is not available')
+		if level is not None and level not in self.LEVELS[compressor]:
+			levels = self.LEVELS[compressor]
+			if not levels:
+				raise CodecError(f'Compressor {compressor} takes no level')
+			raise CodecError(f'Compression level {level} out of range for {compressor} ({levels[0]} to {levels[-1]})')
+
+		self.serializer = serializer
+		self.compressor = compressor
+		self.level = level
+		self.legacy = legacy
+
+
+	@classmethod
+	def parse(cls, spec):
+		if spec == 'legacy':
+			return cls('json', 'gzip', 9, legacy=True)
+		serializer, _, compressor = spec.partition('+')
+		compressor, _, level = (compressor or 'none').partition(':')
+		try:
+			level = int(level) if level else None
+		except ValueError:
+			raise CodecError(f'Bad compression level in {spec!r}')
+		return cls(serializer, compressor, level)
+
+
+	def encode(self, data):
+		if self.serializer == 'json':
+			if self.legacy:
+				raw = json.dumps(data, indent='\t').encode('utf-8')
+			else:
+				raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+		else:
+			raw = msgpack.packb(data)
+
+		payload = compress(self.compressor, raw, self.level)
+		if self.legacy:
+			return payload
+		header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, self.SERIALIZERS[self.serializer],
+			self.COMPRESSORS[self.compressor], 0, len(payload))
+		return header + payload
+
+
+	def __str__(self):
+		if self.legacy:
+			return 'legacy' if self.compressor != 'none' else 'plain'
+		return f'{self.serializer}+{self.compressor}' + (f':{self.level}' if self.level is not None else '')
+
+	def __repr__(self):
+		return f'Codec({self})'
+
+
+
+def compress(compressor, raw, level=None):
+	if compressor == 'gzip':
+		return gzip.compress(raw, compresslevel=6 if level is None else level)
+	if compressor == 'zstd':
+		return zstandard.ZstdCompressor(level=3 if level is None else level).compress(raw)
+	if compressor == 'lz4':
+		return lz4.frame.compress(raw, compression_level=0 if level is None else level)
+	return raw
+
+
+
+def decompress(compressor, payload):
+	if compressor == 'gzip':
+		# Single gzip member; ignores the padding after it
+		decompressor = zlib.decompressobj(wbits=31)
+		raw = decompressor.decompress(payload)
+		if not decompressor.eof:
+			raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+		return raw
+	if compressor == 'zstd':
+		if zstandard is None:
+			raise CodecError('zstd is not available')
+		return zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+	if compressor == 'lz4':
+		if lz4 is None:
+			raise CodecError('lz4 is not available')
+		return lz4.frame.decompress(payload)
+	return payload
+
+
+
+def decode(data):
+	"""Decodes DB contents written by any Codec, or a legacy (gzipped) JSON DB."""
+	if data.startswith(FRAME_MAGIC):
+		if len(data) < FRAME_HEADER.size:
+			raise CodecError('Truncated frame header')
+		_, version, serializer, compressor, _, length = FRAME_HEADER.unpack_from(data)
+		if version != FRAME_VERSION:
+			raise CodecError(f'Unsupported frame version {version}')
+		serializers = {v: k for k, v in Codec.SERIALIZERS.items()}
+		compressors = {v: k for k, v in Codec.COMPRESSORS.items()}
+		if serializer not in serializers or compressor not in compressors:
+			raise CodecError(f'Unknown codec {serializer}/{compressor}')
+		payload = data[FRAME_HEADER.size:FRAME_HEADER.size + length]
+		if len(payload) < length:
+			raise CodecError(f'Truncated: {len(payload)} of {length} bytes')
+		serializer = serializers[serializer]
+		raw = decompress(compressors[compressor], payload)
+	elif data.startswith(GZIP_MAGIC):
+		serializer = 'json'
+		raw = decompress('gzip', data)
+	else:
+		serializer = 'json'
+		raw = data
+
+	if serializer == 'msgpack':
+		if msgpack is None:
+			raise CodecError('msgpack is not available')
+		return msgpack.unpackb(raw)
+	return json.loads(raw)
+
+
+
+# Codec for *.gz DBs, and for everything else
+write_codec = Codec.parse('legacy')
+PLAIN_CODEC = Codec('json', 'none', legacy=True)
+
+# Everything decoding damaged DBs can raise
+DECODE_ERRORS = (EOFError, zlib.error, ValueError, RuntimeError) + ((zstandard.ZstdError,) if zstandard else ())
+
+
+
+class ReadCache:
+	"""Parsed and validated DBs, keyed by filename and (inode, size, mtime), so a
+	replaced file is never served from the cache. Entries are stored marshalled:
+	that's compact, and every get() returns a fresh copy that callers may modify.
+	Least recently used entries are evicted once they exceed max_bytes.
+	"""
+
+	def __init__(self, max_bytes):
+		self.max_bytes = max_bytes
+		self.lock = threading.Lock()
+		# filename: (stat key, schema, marshalled data)
+		self.entries = collections.OrderedDict()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+
+	@staticmethod
+	def stat_key(st):
+		return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+	def get(self, filename, st, schema):
+		"""Returns the cached data for filename with stat st, or None."""
+		with self.lock:
+			entry = self.entries.get(filename)
+			if entry is None or entry[0] != self.stat_key(st) or entry[1] is not schema:
+				self.misses += 1
+				return None
+			self.entries.move_to_end(filename)
+			self.hits += 1
+		return marshal.loads(entry[2])
+
+
+	def put(self, filename, st, schema, data):
+		blob = marshal.dumps(data)
+		if len(blob) > self.max_bytes:
+			return
+		with self.lock:
+			self.drop(filename)
+			self.entries[filename] = (self.stat_key(st), schema, blob)
+			self.size += len(blob)
+			while self.size > self.max_bytes:
+				self.drop(next(iter(self.entries)))
+
+
+	def drop(self, filename):
+		# Called with self.lock held
+		entry = self.entries.pop(filename, None)
+		if entry is not None:
+			self.size -= len(entry[2])
+
+
+	def invalidate(self, filename):
+		with self.lock:
+			self.drop(filename)
+
+
+	def __str__(self):
+		return f'ReadCache(entries={len(self.entries)}, bytes={self.size}/{self.max_bytes}, hits={self.hits}, misses={self.misses})'
+
+	def __repr__(self):
+		return self.__str__()
+
+
+
+# Set by enable_read_cache()
+read_cache = None
+
+
+def enable_read_cache(max_bytes):
+	"""Makes json_read() cache what it reads, up to max_bytes."""
+	global read_cache
+	read_cache = ReadCache(max_bytes)
+	log.info(f'Caching DBs up to {max_bytes // (1024 * 1024)} MiB')
+
 
 
 def json_read(paths, schema, default=...):
@@ -118,21 +486,30 @@ def json_read(paths, schema, default=...):
 		paths = [paths]
 	filename = os.path.join(*paths)
 
-	openfunc = gzip.open if filename.endswith('.gz') else open
 	if default is ...:
 		default = {}
 
 	try:
-		with openfunc(filename) as fd:
+		with open(filename, 'rb') as fd:
+			cache = read_cache
+			if cache is not None:
+				st = os.fstat(fd.fileno())
+				data = cache.get(filename, st, schema)
+				if data is not None:
+					return data
+
 			log.debug(f'Reading DB {filename}')
-			data = json.load(fd)
+			data = decode(fd.read())
 			json_validate(data, schema)
 
+			if cache is not None:
+				cache.put(filename, st, schema, data)
+
 	except FileNotFoundError:
 		log.info(f'Missing DB {filename}, using default')
 		data = default
 
-	except (OSError, EOFError, zlib.error, json.JSONDecodeError, JsonValidationError) as e:
+	except (OSError, JsonValidationError) + DECODE_ERRORS as e:
 		log.error(f'Reading {filename}: {str(e)}')
 		data = default
 
@@ -140,32 +517,114 @@ def json_read(paths, schema, default=...):
 
 
 
-# ... in paths gets replaced with a uuid
-def json_write(paths, data):
+# ... in paths gets replaced with a uuid. Files named *.gz are written with
+# write_codec (unless codec is given), others as plain JSON.
+def json_write(paths, data, codec=None):
 	if isinstance(paths, str):
 		paths = [paths]
 	paths = [(str(uuid.uuid4()) if p is ... else p) for p in paths]
 	filename = os.path.join(*paths)
 	os.makedirs(os.path.dirname(filename), exist_ok=True)
 
-	openfunc = gzip.open if filename.endswith('.gz') else open
+	if codec is None:
+		codec = write_codec if filename.endswith('.gz') else PLAIN_CODEC
 	new_filename = filename + NEW_SUFFIX
 
 	log.debug(f'Writing DB {filename}')
 	try:
 		os.makedirs(os.path.dirname(filename), exist_ok=True)
-		with openfunc(new_filename, 'wt') as fd:
-			json.dump(data, fd, indent='\t')
+		encoded = codec.encode(data)
 
-		if filename.endswith('.gz'):
+		if codec.compressor != 'none':
 			# UGHHHHHHHH.
 			# sshfs messes up when a file is replaced, frequently causing clients to short-read
 			# files, which then (rightly) trips up gzip. So we try padding the compressed stream
 			# so the short-read still returns enough data for gzip.
-			with open(new_filename, 'ab') as fd:
-				fd.write(bytes(4096))
+			encoded += bytes(4096)
+
+		with open(new_filename, 'wb') as fd:
+			fd.write(encoded)
 
 		# Atomic file replacement
 		os.rename(new_filename, filename)
 	except OSError as e:
 		log.error(f'Writing {filename}: {str(e)}')
+
+	if read_cache is not None:
+		read_cache.invalidate(filename)
+
+
+
+def client_id():
+	"""Identifies this client (host and user) in journal names."""
+	return f'{socket.gethostname()}-{os.getuid()}'
+
+
+
+def journal_append(paths, record):
+	"""Appends record (JSON data) to journal file paths, as a single write."""
+	if isinstance(paths, str):
+		paths = [paths]
+	filename = os.path.join(*paths)
+
+	payload = json.dumps(record).encode('utf-8')
+	data = JOURNAL_RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+	log.debug(f'Appending to journal {filename}')
+	try:
+		os.makedirs(os.path.dirname(filename), exist_ok=True)
+		fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o664)
+		try:
+			os.write(fd, data)
+		finally:
+			os.close(fd)
+	except OSError as e:
+		log.error(f'Appending to {filename}: {str(e)}')
+
+
+
+def journal_read(filename, schema, offset=0):
+	"""Reads the complete records in journal filename from offset on. Returns the
+	valid records and the offset to continue from. Damaged records are skipped; an
+	incomplete one at the end is left for next time, as it's probably being written."""
+	with open(filename, 'rb') as fd:
+		fd.seek(offset)
+		data = fd.read()
+
+	records = []
+	pos = 0
+	while len(data) - pos >= JOURNAL_RECORD_HEADER.size:
+		length, crc = JOURNAL_RECORD_HEADER.unpack_from(data, pos)
+		if length > JOURNAL_MAX_RECORD:
+			log.error(f'Reading {filename}: Bad record length {length} at offset {offset + pos}; skipping the rest')
+			pos = len(data)
+			break
+		end = pos + JOURNAL_RECORD_HEADER.size + length
+		if end > len(data):
+			break
+		payload = data[pos + JOURNAL_RECORD_HEADER.size:end]
+		pos = end
+
+		if zlib.crc32(payload) != crc:
+			log.error(f'Reading {filename}: Bad checksum for record at offset {offset + pos - len(payload)}; skipped')
+			continue
+		try:
+			record = json.loads(payload)
+			json_validate(record, schema)
+		except (ValueError, JsonValidationError) as e:
+			log.error(f'Reading {filename}: {str(e)}')
+			continue
+		records.append(record)
+
+	return records, offset + pos
+
+
+
+def write_state_update(path, updates, journal=False):
+	"""Queues state updates ({name: {'position': ..., 'tagged': ...}}) for the files
+	in directory path, for Clerk to apply: as a record in this client's journal, or
+	as a queue file of its own."""
+	if journal:
+		journal_append([path, QUEUE_DIR_NAME, client_id() + JOURNAL_SUFFIX], {'time': time.time(), 'updates': updates})
+	else:
+		json_write([path, QUEUE_DIR_NAME, ...], updates)
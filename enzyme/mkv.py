@@ -1,6 +1,7 @@
-from .exceptions import ParserError, MalformedMKVError
+from .exceptions import ParserError, MalformedMKVError, ReadError
 from .parsers import ebml
 from datetime import timedelta
+from io import BytesIO
 import logging
 
 
@@ -17,6 +18,7 @@ __all__ = [
     "Tag",
     "SimpleTag",
     "Chapter",
+    "Attachment",
 ]
 logger = logging.getLogger(__name__)
 
@@ -29,10 +31,19 @@ class MKV:
     """Matroska Video file
 
     :param stream: seekable file-like object
+    :param bool recurse_seek_head: also parse SeekHead elements referenced from the SeekHead
+    :param bool buffered: parse through a read-ahead cache instead of reading each field from `stream`
+        (see :func:`~enzyme.parsers.ebml.open_stream`)
+    :param bool use_mmap: with `buffered`, parse from a memory map of the file instead, if it can be mapped
+    :param bool lazy_attachments: don't read attachment data while parsing; :class:`Attachment` then
+        only holds its position and reads the data when asked, so `stream` and the MKV must stay open
+
+    The buffer or memory map is released by :meth:`close`; use the MKV as a context manager.
+    `stream` itself is left open.
 
     """
 
-    def __init__(self, stream, recurse_seek_head=False):
+    def __init__(self, stream, recurse_seek_head=False, buffered=True, use_mmap=False, lazy_attachments=True):
         # default attributes
         self.info = None
         self.video_tracks = []
@@ -44,8 +55,17 @@ class MKV:
 
         # keep track of the elements parsed
         self.recurse_seek_head = recurse_seek_head
+        self.lazy_attachments = lazy_attachments
         self._parsed_positions = set()
 
+        # the wrapper we opened, if any, closed by close()
+        self._stream = None
+        if buffered:
+            wrapped = ebml.open_stream(stream, use_mmap=use_mmap)
+            if wrapped is not stream:
+                self._stream = wrapped
+            stream = wrapped
+
         try:
             # get the Segment element
             logger.info("Reading Segment element")
@@ -66,7 +86,23 @@ class MKV:
             seek_head.load(stream, specs, ignore_element_names=["Void", "CRC-32"])
             self._parse_seekhead(seek_head, segment, stream, specs)
         except ParserError as e:
+            self.close()
             raise MalformedMKVError("Parsing error: %s" % e)
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        """Release the buffer or memory map opened for parsing. Lazy attachments can't be read after this."""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     def _parse_seekhead(self, seek_head, segment, stream, specs):
         for seek in seek_head:
@@ -126,11 +162,31 @@ class MKV:
             elif element_name == 'Attachments':
                 logger.info('Processing element %s from SeekHead at position %d', element_name, element_position)
                 stream.seek(element_position)
-                self.attachments.extend([Attachment.fromelement(t) for t in ebml.parse_element(stream, specs, True, ignore_element_names=['Void', 'CRC-32'])])
+                lazy = ['FileData'] if self.lazy_attachments else None
+                attachments = ebml.parse_element(stream, specs, True, ignore_element_names=['Void', 'CRC-32'], lazy_element_names=lazy)
+                self.attachments.extend([Attachment.fromelement(t, stream) for t in attachments])
             else:
                 logger.debug("Element %s ignored", element_name)
             self._parsed_positions.add(element_position)
 
+    def get_attachment(self, filename=None, mimetype=None):
+        """Get the first attachment matching `filename` and/or `mimetype`
+
+        With lazy attachments, only the data of the returned attachment is ever read.
+
+        :param string filename: file name the attachment must have, or None for any
+        :param string mimetype: mime type the attachment must have, or None for any
+        :return: the matching :class:`Attachment`, or None
+
+        """
+        for attachment in self.attachments:
+            if filename is not None and attachment.filename != filename:
+                continue
+            if mimetype is not None and attachment.mimetype != mimetype:
+                continue
+            return attachment
+        return None
+
     def to_dict(self):
         return {
             "info": self.info.__dict__,
@@ -475,24 +531,57 @@ class Chapter:
 
 
 class Attachment(object):
-    """Object for the Attachments EBML element"""
-    def __init__(self, filename, mimetype, uid, data, length, description=None, referral=None, used_start_time=None, used_end_time=None):
+    """Object for the Attachments EBML element
+
+    `data` is a file-like object with the attachment contents. For lazy attachments
+    (`data` not given, but `stream` and `position` are), it is read from the stream
+    every time it is accessed.
+
+    """
+    def __init__(self, filename, mimetype, uid, data, length, description=None, referral=None, used_start_time=None, used_end_time=None, stream=None, position=None):
         self.filename = filename
         self.mimetype = mimetype
-        self.data = data
+        self._data = data
         self.length = length
         self.uid = uid
         self.description = description
         self.referral = referral
         self.used_start_time = used_start_time
         self.used_end_time = used_end_time
+        self._stream = stream
+        self.position = position
+
+    @property
+    def data(self):
+        if self._data is not None:
+            return self._data
+        return BytesIO(self.read())
+
+    def read(self):
+        """Read the attachment contents
+
+        :return: the attachment data
+        :rtype: bytes
+
+        """
+        if self._data is not None:
+            self._data.seek(0)
+            data = self._data.read()
+            self._data.seek(0)
+            return data
+        self._stream.seek(self.position)
+        data = self._stream.read(self.length)
+        if len(data) < self.length:
+            raise ReadError("Less than %d bytes read (%d)" % (self.length, len(data)))
+        return data
 
     @classmethod
-    def fromelement(cls, element):
+    def fromelement(cls, element, stream=None):
         """Load the :class:`Attachment` from an :class:`~enzyme.parsers.ebml.Element`
 
         :param element: the AttachedFile element
         :type element: :class:`~enzyme.parsers.ebml.Element`
+        :param stream: the stream `element` was parsed from; needed if FileData was parsed lazily
 
         """
         filename = element.get('FileName')
@@ -509,10 +598,18 @@ class Attachment(object):
         if used_end_time is not None:
             used_end_time = timedelta(microseconds=used_end_time // 1000)
 
-        length = data.seek(0, 2)
-        data.seek(0)
-
-        return cls(filename, mimetype, uid, data, length, description, referral, used_start_time, used_end_time)
+        position = None
+        if data is not None:
+            length = data.seek(0, 2)
+            data.seek(0)
+        elif 'FileData' in element and stream is not None:
+            # Lazily parsed; remember where to find it
+            position = element['FileData'].position
+            length = element['FileData'].size
+        else:
+            raise MalformedMKVError('Attachment %s has no data' % filename)
+
+        return cls(filename, mimetype, uid, data, length, description, referral, used_start_time, used_end_time, stream, position)
 
     def __repr__(self):
         return '<%s [%s, %s, %i bytes]>' % (self.__class__.__name__, self.filename, self.mimetype, self.length)
@@ -1,2 +1,3 @@
 from .core import *
 from .readers import *
+from .streams import *
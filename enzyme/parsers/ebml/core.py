@@ -1,6 +1,8 @@
 from ...exceptions import ReadError
 from .readers import *
 from xml.dom import minidom
+import functools
+import hashlib
 import logging
 
 try:
@@ -24,6 +26,7 @@ __all__ = [
     "parse",
     "parse_element",
     "get_matroska_specs",
+    "compile_matroska_specs",
 ]
 logger = logging.getLogger(__name__)
 
@@ -158,7 +161,9 @@ class MasterElement(Element):
         return iter(self.data)
 
 
-def parse(stream, specs, size=None, ignore_element_types=None, ignore_element_names=None, max_level=None):
+def parse(
+    stream, specs, size=None, ignore_element_types=None, ignore_element_names=None, max_level=None, lazy_element_names=None
+):
     """Parse a stream for `size` bytes according to the `specs`
 
     :param stream: file-like object from which to read
@@ -168,6 +173,7 @@ def parse(stream, specs, size=None, ignore_element_types=None, ignore_element_na
     :param list ignore_element_types: list of element types to ignore
     :param list ignore_element_names: list of element names to ignore
     :param int max_level: maximum level of elements
+    :param list lazy_element_names: list of element names whose data is not read (see :func:`parse_element`)
     :return: parsed data as a tree of :class:`~enzyme.parsers.ebml.core.Element`
     :rtype: list
 
@@ -182,7 +188,7 @@ def parse(stream, specs, size=None, ignore_element_types=None, ignore_element_na
     elements = []
     while size is None or stream.tell() - start < size:
         try:
-            element = parse_element(stream, specs)
+            element = parse_element(stream, specs, lazy_element_names=lazy_element_names)
             if element is None:
                 continue
             logger.debug("%s %s parsed", element.__class__.__name__, element.name)
@@ -208,7 +214,13 @@ def parse(stream, specs, size=None, ignore_element_types=None, ignore_element_na
                         element.size,
                     )
                     element.data = parse(
-                        stream, specs, element.size, ignore_element_types, ignore_element_names, max_level
+                        stream,
+                        specs,
+                        element.size,
+                        ignore_element_types,
+                        ignore_element_names,
+                        max_level,
+                        lazy_element_names,
                     )
             elements.append(element)
         except ReadError:
@@ -219,7 +231,13 @@ def parse(stream, specs, size=None, ignore_element_types=None, ignore_element_na
 
 
 def parse_element(
-    stream, specs, load_children=False, ignore_element_types=None, ignore_element_names=None, max_level=None
+    stream,
+    specs,
+    load_children=False,
+    ignore_element_types=None,
+    ignore_element_names=None,
+    max_level=None,
+    lazy_element_names=None,
 ):
     """Extract a single :class:`Element` from the `stream` according to the `specs`
 
@@ -229,6 +247,8 @@ def parse_element(
     :param list ignore_element_types: list of element types to ignore
     :param list ignore_element_names: list of element names to ignore
     :param int max_level: maximum level for children elements
+    :param list lazy_element_names: list of element names whose data is not read; their
+        `data` is None and it can be read later from `position` and `size`
     :return: the parsed element
     :rtype: :class:`Element`
 
@@ -249,30 +269,96 @@ def parse_element(
     if element_type == MASTER:
         element = MasterElement(element_id, element_name, element_level, stream.tell(), element_size)
         if load_children:
-            element.data = parse(stream, specs, element.size, ignore_element_types, ignore_element_names, max_level)
+            element.data = parse(
+                stream,
+                specs,
+                element.size,
+                ignore_element_types,
+                ignore_element_names,
+                max_level,
+                lazy_element_names,
+            )
     else:
         element = Element(element_id, element_type, element_name, element_level, stream.tell(), element_size)
-        element.data = READERS[element_type](stream, element_size)
+        if lazy_element_names is not None and element_name in lazy_element_names:
+            stream.seek(element_size, 1)
+        else:
+            element.data = READERS[element_type](stream, element_size)
     return element
 
 
+def _matroska_xml():
+    return files(__package__).joinpath("specs", "matroska.xml").read_bytes()
+
+
+def _parse_matroska_xml(xml):
+    """Parse the Matroska specs XML
+
+    :return: list of (id, type, name, level, webm) tuples
+    :rtype: list
+
+    """
+    specs = []
+    xmldoc = minidom.parseString(xml)
+    for element in xmldoc.getElementsByTagName("element"):
+        specs.append(
+            (
+                int(element.getAttribute("id"), 16),
+                SPEC_TYPES[element.getAttribute("type")],
+                element.getAttribute("name"),
+                int(element.getAttribute("level")),
+                element.hasAttribute("webm") and element.getAttribute("webm") == "1",
+            )
+        )
+    return specs
+
+
+def compile_matroska_specs(filename):
+    """Write the Matroska specs XML out as a Python module, so it doesn't have to be parsed at runtime
+
+    :param string filename: the module to write, normally ``enzyme/parsers/ebml/matroska_specs.py``
+
+    """
+    xml = _matroska_xml()
+    with open(filename, "w") as fd:
+        fd.write("# Generated from specs/matroska.xml by compile_matroska_specs(); do not edit.\n")
+        fd.write("# Regenerate with: python -c 'import enzyme; enzyme.parsers.ebml.compile_matroska_specs(\"%s\")'\n\n" % filename)
+        fd.write("SOURCE_SHA256 = %r\n\n" % hashlib.sha256(xml).hexdigest())
+        fd.write("# (id, type, name, level, webm)\n")
+        fd.write("SPECS = [\n")
+        for spec in _parse_matroska_xml(xml):
+            fd.write("    (0x%X, %d, %r, %d, %r),\n" % spec)
+        fd.write("]\n")
+
+
+@functools.lru_cache(maxsize=None)
 def get_matroska_specs(webm_only=False):
     """Get the Matroska specs
 
+    The specs are loaded from the precompiled ``matroska_specs`` module if it is
+    up to date with ``specs/matroska.xml``, otherwise the XML is parsed. Either way,
+    this only happens once; the same dict is returned on every call, and it must
+    not be modified.
+
     :param bool webm_only: load *only* WebM specs
     :return: the specs in the appropriate format. See :ref:`specs`
     :rtype: dict
 
     """
-    specs = {}
-    spec_file = files(__package__).joinpath("specs", "matroska.xml")
-    with spec_file.open("rb") as resource:
-        xmldoc = minidom.parse(resource)
-        for element in xmldoc.getElementsByTagName("element"):
-            if not webm_only or element.hasAttribute("webm") and element.getAttribute("webm") == "1":
-                specs[int(element.getAttribute("id"), 16)] = (
-                    SPEC_TYPES[element.getAttribute("type")],
-                    element.getAttribute("name"),
-                    int(element.getAttribute("level")),
-                )
-    return specs
+    xml = _matroska_xml()
+    try:
+        from . import matroska_specs
+
+        if matroska_specs.SOURCE_SHA256 != hashlib.sha256(xml).hexdigest():
+            raise ImportError("matroska_specs is outdated")
+        specs = matroska_specs.SPECS
+    except ImportError as e:
+        logger.warning("Parsing specs/matroska.xml: %s", e)
+        specs = _parse_matroska_xml(xml)
+
+    return {
+        element_id: (element_type, name, level)
+        for element_id, element_type, name, level, webm in specs
+        if not webm_only or webm
+    }
+
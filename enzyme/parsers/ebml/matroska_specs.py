@@ -0,0 +1,227 @@
+# Generated from specs/matroska.xml by compile_matroska_specs(); do not edit.
+# Regenerate with: python -c 'import enzyme; enzyme.parsers.ebml.compile_matroska_specs("enzyme/parsers/ebml/matroska_specs.py")'
+
+SOURCE_SHA256 = '4faa55db84b3ff970752bdd532dd598f51f3afd2b862a8cec92dda9592bdc627'
+
+# (id, type, name, level, webm)
+SPECS = [
+    (0x1A45DFA3, 6, 'EBML', 0, False),
+    (0x4286, 1, 'EBMLVersion', 1, False),
+    (0x42F7, 1, 'EBMLReadVersion', 1, False),
+    (0x42F2, 1, 'EBMLMaxIDLength', 1, False),
+    (0x42F3, 1, 'EBMLMaxSizeLength', 1, False),
+    (0x4282, 3, 'DocType', 1, False),
+    (0x4287, 1, 'DocTypeVersion', 1, False),
+    (0x4285, 1, 'DocTypeReadVersion', 1, False),
+    (0xEC, 7, 'Void', -1, False),
+    (0xBF, 7, 'CRC-32', -1, False),
+    (0x1B538667, 6, 'SignatureSlot', -1, False),
+    (0x7E8A, 1, 'SignatureAlgo', 1, False),
+    (0x7E9A, 1, 'SignatureHash', 1, False),
+    (0x7EA5, 7, 'SignaturePublicKey', 1, False),
+    (0x7EB5, 7, 'Signature', 1, False),
+    (0x7E5B, 6, 'SignatureElements', 1, False),
+    (0x7E7B, 6, 'SignatureElementList', 2, False),
+    (0x6532, 7, 'SignedElement', 3, False),
+    (0x18538067, 6, 'Segment', 0, False),
+    (0x114D9B74, 6, 'SeekHead', 1, False),
+    (0x4DBB, 6, 'Seek', 2, False),
+    (0x53AB, 7, 'SeekID', 3, False),
+    (0x53AC, 1, 'SeekPosition', 3, False),
+    (0x1549A966, 6, 'Info', 1, False),
+    (0x73A4, 7, 'SegmentUID', 2, False),
+    (0x7384, 4, 'SegmentFilename', 2, False),
+    (0x3CB923, 7, 'PrevUID', 2, False),
+    (0x3C83AB, 4, 'PrevFilename', 2, False),
+    (0x3EB923, 7, 'NextUID', 2, False),
+    (0x3E83BB, 4, 'NextFilename', 2, False),
+    (0x4444, 7, 'SegmentFamily', 2, False),
+    (0x6924, 6, 'ChapterTranslate', 2, False),
+    (0x69FC, 1, 'ChapterTranslateEditionUID', 3, False),
+    (0x69BF, 1, 'ChapterTranslateCodec', 3, False),
+    (0x69A5, 7, 'ChapterTranslateID', 3, False),
+    (0x2AD7B1, 1, 'TimecodeScale', 2, False),
+    (0x4489, 2, 'Duration', 2, False),
+    (0x4461, 5, 'DateUTC', 2, False),
+    (0x7BA9, 4, 'Title', 2, False),
+    (0x4D80, 4, 'MuxingApp', 2, False),
+    (0x5741, 4, 'WritingApp', 2, False),
+    (0x1F43B675, 6, 'Cluster', 1, False),
+    (0xE7, 1, 'Timecode', 2, False),
+    (0x5854, 6, 'SilentTracks', 2, False),
+    (0x58D7, 1, 'SilentTrackNumber', 3, False),
+    (0xA7, 1, 'Position', 2, False),
+    (0xAB, 1, 'PrevSize', 2, False),
+    (0xA3, 7, 'SimpleBlock', 2, True),
+    (0xA0, 6, 'BlockGroup', 2, False),
+    (0xA1, 7, 'Block', 3, False),
+    (0xA2, 7, 'BlockVirtual', 3, False),
+    (0x75A1, 6, 'BlockAdditions', 3, False),
+    (0xA6, 6, 'BlockMore', 4, False),
+    (0xEE, 1, 'BlockAddID', 5, False),
+    (0xA5, 7, 'BlockAdditional', 5, False),
+    (0x9B, 1, 'BlockDuration', 3, False),
+    (0xFA, 1, 'ReferencePriority', 3, False),
+    (0xFB, 0, 'ReferenceBlock', 3, False),
+    (0xFD, 0, 'ReferenceVirtual', 3, False),
+    (0xA4, 7, 'CodecState', 3, False),
+    (0x8E, 6, 'Slices', 3, False),
+    (0xE8, 6, 'TimeSlice', 4, False),
+    (0xCC, 1, 'LaceNumber', 5, False),
+    (0xCD, 1, 'FrameNumber', 5, False),
+    (0xCB, 1, 'BlockAdditionID', 5, False),
+    (0xCE, 1, 'Delay', 5, False),
+    (0xCF, 1, 'SliceDuration', 5, False),
+    (0xC8, 6, 'ReferenceFrame', 3, False),
+    (0xC9, 1, 'ReferenceOffset', 4, False),
+    (0xCA, 1, 'ReferenceTimeCode', 4, False),
+    (0xAF, 7, 'EncryptedBlock', 2, False),
+    (0x1654AE6B, 6, 'Tracks', 1, False),
+    (0xAE, 6, 'TrackEntry', 2, False),
+    (0xD7, 1, 'TrackNumber', 3, False),
+    (0x73C5, 1, 'TrackUID', 3, False),
+    (0x83, 1, 'TrackType', 3, False),
+    (0xB9, 1, 'FlagEnabled', 3, True),
+    (0x88, 1, 'FlagDefault', 3, False),
+    (0x55AA, 1, 'FlagForced', 3, False),
+    (0x9C, 1, 'FlagLacing', 3, False),
+    (0x6DE7, 1, 'MinCache', 3, False),
+    (0x6DF8, 1, 'MaxCache', 3, False),
+    (0x23E383, 1, 'DefaultDuration', 3, False),
+    (0x23314F, 2, 'TrackTimecodeScale', 3, False),
+    (0x537F, 0, 'TrackOffset', 3, False),
+    (0x55EE, 1, 'MaxBlockAdditionID', 3, False),
+    (0x536E, 4, 'Name', 3, False),
+    (0x22B59C, 3, 'Language', 3, False),
+    (0x86, 3, 'CodecID', 3, False),
+    (0x63A2, 7, 'CodecPrivate', 3, False),
+    (0x258688, 4, 'CodecName', 3, False),
+    (0x7446, 1, 'AttachmentLink', 3, False),
+    (0x3A9697, 4, 'CodecSettings', 3, False),
+    (0x3B4040, 3, 'CodecInfoURL', 3, False),
+    (0x26B240, 3, 'CodecDownloadURL', 3, False),
+    (0xAA, 1, 'CodecDecodeAll', 3, False),
+    (0x6FAB, 1, 'TrackOverlay', 3, False),
+    (0x6624, 6, 'TrackTranslate', 3, False),
+    (0x66FC, 1, 'TrackTranslateEditionUID', 4, False),
+    (0x66BF, 1, 'TrackTranslateCodec', 4, False),
+    (0x66A5, 7, 'TrackTranslateTrackID', 4, False),
+    (0xE0, 6, 'Video', 3, False),
+    (0x9A, 1, 'FlagInterlaced', 4, True),
+    (0x53B8, 1, 'StereoMode', 4, True),
+    (0x53B9, 1, 'OldStereoMode', 4, False),
+    (0xB0, 1, 'PixelWidth', 4, False),
+    (0xBA, 1, 'PixelHeight', 4, False),
+    (0x54AA, 1, 'PixelCropBottom', 4, False),
+    (0x54BB, 1, 'PixelCropTop', 4, False),
+    (0x54CC, 1, 'PixelCropLeft', 4, False),
+    (0x54DD, 1, 'PixelCropRight', 4, False),
+    (0x54B0, 1, 'DisplayWidth', 4, False),
+    (0x54BA, 1, 'DisplayHeight', 4, False),
+    (0x54B2, 1, 'DisplayUnit', 4, False),
+    (0x54B3, 1, 'AspectRatioType', 4, False),
+    (0x2EB524, 7, 'ColourSpace', 4, False),
+    (0x2FB523, 2, 'GammaValue', 4, False),
+    (0x2383E3, 2, 'FrameRate', 4, False),
+    (0xE1, 6, 'Audio', 3, False),
+    (0xB5, 2, 'SamplingFrequency', 4, False),
+    (0x78B5, 2, 'OutputSamplingFrequency', 4, False),
+    (0x9F, 1, 'Channels', 4, False),
+    (0x7D7B, 7, 'ChannelPositions', 4, False),
+    (0x6264, 1, 'BitDepth', 4, False),
+    (0xE2, 6, 'TrackOperation', 3, False),
+    (0xE3, 6, 'TrackCombinePlanes', 4, False),
+    (0xE4, 6, 'TrackPlane', 5, False),
+    (0xE5, 1, 'TrackPlaneUID', 6, False),
+    (0xE6, 1, 'TrackPlaneType', 6, False),
+    (0xE9, 6, 'TrackJoinBlocks', 4, False),
+    (0xED, 1, 'TrackJoinUID', 5, False),
+    (0xC0, 1, 'TrickTrackUID', 3, False),
+    (0xC1, 7, 'TrickTrackSegmentUID', 3, False),
+    (0xC6, 1, 'TrickTrackFlag', 3, False),
+    (0xC7, 1, 'TrickMasterTrackUID', 3, False),
+    (0xC4, 7, 'TrickMasterTrackSegmentUID', 3, False),
+    (0x6D80, 6, 'ContentEncodings', 3, False),
+    (0x6240, 6, 'ContentEncoding', 4, False),
+    (0x5031, 1, 'ContentEncodingOrder', 5, False),
+    (0x5032, 1, 'ContentEncodingScope', 5, False),
+    (0x5033, 1, 'ContentEncodingType', 5, False),
+    (0x5034, 6, 'ContentCompression', 5, False),
+    (0x4254, 1, 'ContentCompAlgo', 6, False),
+    (0x4255, 7, 'ContentCompSettings', 6, False),
+    (0x5035, 6, 'ContentEncryption', 5, False),
+    (0x47E1, 1, 'ContentEncAlgo', 6, False),
+    (0x47E2, 7, 'ContentEncKeyID', 6, False),
+    (0x47E3, 7, 'ContentSignature', 6, False),
+    (0x47E4, 7, 'ContentSigKeyID', 6, False),
+    (0x47E5, 1, 'ContentSigAlgo', 6, False),
+    (0x47E6, 1, 'ContentSigHashAlgo', 6, False),
+    (0x1C53BB6B, 6, 'Cues', 1, False),
+    (0xBB, 6, 'CuePoint', 2, False),
+    (0xB3, 1, 'CueTime', 3, False),
+    (0xB7, 6, 'CueTrackPositions', 3, False),
+    (0xF7, 1, 'CueTrack', 4, False),
+    (0xF1, 1, 'CueClusterPosition', 4, False),
+    (0xF0, 1, 'CueRelativePosition', 4, False),
+    (0xB2, 1, 'CueDuration', 4, False),
+    (0x5378, 1, 'CueBlockNumber', 4, False),
+    (0xEA, 1, 'CueCodecState', 4, False),
+    (0xDB, 6, 'CueReference', 4, False),
+    (0x96, 1, 'CueRefTime', 5, False),
+    (0x97, 1, 'CueRefCluster', 5, False),
+    (0x535F, 1, 'CueRefNumber', 5, False),
+    (0xEB, 1, 'CueRefCodecState', 5, False),
+    (0x1941A469, 6, 'Attachments', 1, False),
+    (0x61A7, 6, 'AttachedFile', 2, False),
+    (0x467E, 4, 'FileDescription', 3, False),
+    (0x466E, 4, 'FileName', 3, False),
+    (0x4660, 3, 'FileMimeType', 3, False),
+    (0x465C, 7, 'FileData', 3, False),
+    (0x46AE, 1, 'FileUID', 3, False),
+    (0x4675, 7, 'FileReferral', 3, False),
+    (0x4661, 1, 'FileUsedStartTime', 3, False),
+    (0x4662, 1, 'FileUsedEndTime', 3, False),
+    (0x1043A770, 6, 'Chapters', 1, True),
+    (0x45B9, 6, 'EditionEntry', 2, True),
+    (0x45BC, 1, 'EditionUID', 3, False),
+    (0x45BD, 1, 'EditionFlagHidden', 3, False),
+    (0x45DB, 1, 'EditionFlagDefault', 3, False),
+    (0x45DD, 1, 'EditionFlagOrdered', 3, False),
+    (0xB6, 6, 'ChapterAtom', 3, True),
+    (0x73C4, 1, 'ChapterUID', 4, True),
+    (0x5654, 4, 'ChapterStringUID', 4, True),
+    (0x91, 1, 'ChapterTimeStart', 4, True),
+    (0x92, 1, 'ChapterTimeEnd', 4, False),
+    (0x98, 1, 'ChapterFlagHidden', 4, False),
+    (0x4598, 1, 'ChapterFlagEnabled', 4, False),
+    (0x6E67, 7, 'ChapterSegmentUID', 4, False),
+    (0x6EBC, 1, 'ChapterSegmentEditionUID', 4, False),
+    (0x63C3, 1, 'ChapterPhysicalEquiv', 4, False),
+    (0x8F, 6, 'ChapterTrack', 4, False),
+    (0x89, 1, 'ChapterTrackNumber', 5, False),
+    (0x80, 6, 'ChapterDisplay', 4, True),
+    (0x85, 4, 'ChapString', 5, True),
+    (0x437C, 3, 'ChapLanguage', 5, True),
+    (0x437E, 3, 'ChapCountry', 5, False),
+    (0x6944, 6, 'ChapProcess', 4, False),
+    (0x6955, 1, 'ChapProcessCodecID', 5, False),
+    (0x450D, 7, 'ChapProcessPrivate', 5, False),
+    (0x6911, 6, 'ChapProcessCommand', 5, False),
+    (0x6922, 1, 'ChapProcessTime', 6, False),
+    (0x6933, 7, 'ChapProcessData', 6, False),
+    (0x1254C367, 6, 'Tags', 1, False),
+    (0x7373, 6, 'Tag', 2, False),
+    (0x63C0, 6, 'Targets', 3, False),
+    (0x68CA, 1, 'TargetTypeValue', 4, False),
+    (0x63CA, 3, 'TargetType', 4, False),
+    (0x63C5, 1, 'TagTrackUID', 4, False),
+    (0x63C9, 1, 'TagEditionUID', 4, False),
+    (0x63C4, 1, 'TagChapterUID', 4, False),
+    (0x63C6, 1, 'TagAttachmentUID', 4, False),
+    (0x67C8, 6, 'SimpleTag', 3, False),
+    (0x45A3, 4, 'TagName', 4, False),
+    (0x447A, 3, 'TagLanguage', 4, False),
+    (0x4484, 1, 'TagDefault', 4, False),
+    (0x4487, 4, 'TagString', 4, False),
+    (0x4485, 7, 'TagBinary', 4, False),
+]
@@ -44,18 +44,14 @@ def read_element_id(stream):
 
     """
     char = _read(stream, 1)
-    byte = ord(char)
-    if byte & 0x80:
-        return byte
-    elif byte & 0x40:
-        return unpack(">H", char + _read(stream, 1))[0]
-    elif byte & 0x20:
-        b, h = unpack(">BH", char + _read(stream, 2))
-        return b * 2**16 + h
-    elif byte & 0x10:
-        return unpack(">L", char + _read(stream, 3))[0]
-    else:
-        ValueError("Not an Element ID")
+    # The position of the first set bit determines the length (1 to 4 bytes)
+    length = 9 - char[0].bit_length()
+    if length == 1:
+        return char[0]
+    elif length <= 4:
+        return int.from_bytes(char + _read(stream, length - 1), "big")
+    # Not an Element ID
+    return None
 
 
 def read_element_size(stream):
@@ -68,29 +64,16 @@ def read_element_size(stream):
 
     """
     char = _read(stream, 1)
-    byte = ord(char)
-    if byte & 0x80:
-        return unpack(">B", bytes((byte ^ 0x80,)))[0]
-    elif byte & 0x40:
-        return unpack(">H", bytes((byte ^ 0x40,)) + _read(stream, 1))[0]
-    elif byte & 0x20:
-        b, h = unpack(">BH", bytes((byte ^ 0x20,)) + _read(stream, 2))
-        return b * 2**16 + h
-    elif byte & 0x10:
-        return unpack(">L", bytes((byte ^ 0x10,)) + _read(stream, 3))[0]
-    elif byte & 0x08:
-        b, l = unpack(">BL", bytes((byte ^ 0x08,)) + _read(stream, 4))
-        return b * 2**32 + l
-    elif byte & 0x04:
-        h, l = unpack(">HL", bytes((byte ^ 0x04,)) + _read(stream, 5))
-        return h * 2**32 + l
-    elif byte & 0x02:
-        b, h, l = unpack(">BHL", bytes((byte ^ 0x02,)) + _read(stream, 6))
-        return b * 2**48 + h * 2**32 + l
-    elif byte & 0x01:
-        return unpack(">Q", bytes((byte ^ 0x01,)) + _read(stream, 7))[0]
-    else:
-        ValueError("Not an Element Size")
+    byte = char[0]
+    if not byte:
+        # Not an Element Size
+        return None
+    # The position of the first set bit determines the length (1 to 8 bytes)
+    length = 9 - byte.bit_length()
+    value = byte & (0xFF >> length)
+    if length == 1:
+        return value
+    return int.from_bytes(bytes((value,)) + _read(stream, length - 1), "big")
 
 
 def read_element_integer(stream, size):
@@ -104,28 +87,9 @@ def read_element_integer(stream, size):
     :rtype: int
 
     """
-    if size == 1:
-        return unpack(">b", _read(stream, 1))[0]
-    elif size == 2:
-        return unpack(">h", _read(stream, 2))[0]
-    elif size == 3:
-        b, h = unpack(">bH", _read(stream, 3))
-        return b * 2**16 + h
-    elif size == 4:
-        return unpack(">l", _read(stream, 4))[0]
-    elif size == 5:
-        b, l = unpack(">bL", _read(stream, 5))
-        return b * 2**32 + l
-    elif size == 6:
-        h, l = unpack(">hL", _read(stream, 6))
-        return h * 2**32 + l
-    elif size == 7:
-        b, h, l = unpack(">bHL", _read(stream, 7))
-        return b * 2**48 + h * 2**32 + l
-    elif size == 8:
-        return unpack(">q", _read(stream, 8))[0]
-    else:
+    if not 1 <= size <= 8:
         raise SizeError(size)
+    return int.from_bytes(_read(stream, size), "big", signed=True)
 
 
 def read_element_uinteger(stream, size):
@@ -139,28 +103,9 @@ def read_element_uinteger(stream, size):
     :rtype: int
 
     """
-    if size == 1:
-        return unpack(">B", _read(stream, 1))[0]
-    elif size == 2:
-        return unpack(">H", _read(stream, 2))[0]
-    elif size == 3:
-        b, h = unpack(">BH", _read(stream, 3))
-        return b * 2**16 + h
-    elif size == 4:
-        return unpack(">L", _read(stream, 4))[0]
-    elif size == 5:
-        b, l = unpack(">BL", _read(stream, 5))
-        return b * 2**32 + l
-    elif size == 6:
-        h, l = unpack(">HL", _read(stream, 6))
-        return h * 2**32 + l
-    elif size == 7:
-        b, h, l = unpack(">BHL", _read(stream, 7))
-        return b * 2**48 + h * 2**32 + l
-    elif size == 8:
-        return unpack(">Q", _read(stream, 8))[0]
-    else:
+    if not 1 <= size <= 8:
         raise SizeError(size)
+    return int.from_bytes(_read(stream, size), "big")
 
 
 def read_element_float(stream, size):
@@ -0,0 +1,186 @@
+from collections import OrderedDict
+import io
+import mmap
+import os
+import logging
+
+
+__all__ = ["BufferStream", "ReadAheadStream", "open_stream"]
+logger = logging.getLogger(__name__)
+
+
+class BufferStream:
+    """Read-only, seekable file-like object over an in-memory buffer
+
+    Reads are slices of the buffer, so parsing doesn't issue any system calls. When
+    the buffer is an :class:`mmap.mmap`, the only I/O is the page faults for the
+    parts of the file that are actually looked at.
+
+    :param buffer: bytes, bytearray, memoryview or mmap to read from
+
+    """
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._size = len(buffer)
+        self._position = 0
+
+    def read(self, size=-1):
+        start = self._position
+        if size is None or size < 0:
+            end = self._size
+        else:
+            end = min(start + size, self._size)
+        if end <= start:
+            return b""
+        self._position = end
+        return bytes(self._buffer[start:end])
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("Invalid whence (%r)" % whence)
+        if position < 0:
+            raise ValueError("Negative seek position %d" % position)
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b""
+        self._size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ReadAheadStream:
+    """Read-only, seekable file-like object caching `block_size` blocks of the underlying stream
+
+    For streams that can't be memory mapped. EBML parsing mostly seeks around and
+    reads tiny fields; this turns those into a few block-sized reads of the
+    underlying stream. Reads of at least `block_size` bytes bypass the cache.
+
+    :param stream: seekable file-like object to read from
+    :param int block_size: size of the cached blocks
+    :param int max_blocks: number of blocks to keep cached
+
+    """
+
+    def __init__(self, stream, block_size=64 * 1024, max_blocks=16):
+        self._stream = stream
+        self._block_size = block_size
+        self._max_blocks = max_blocks
+        self._blocks = OrderedDict()
+        self._position = stream.tell()
+
+    def _block(self, index):
+        try:
+            self._blocks.move_to_end(index)
+            return self._blocks[index]
+        except KeyError:
+            pass
+        self._stream.seek(index * self._block_size)
+        block = self._stream.read(self._block_size)
+        self._blocks[index] = block
+        if len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+        return block
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size >= self._block_size:
+            self._stream.seek(self._position)
+            data = self._stream.read(size)
+            self._position += len(data)
+            return data
+
+        chunks = []
+        while size > 0:
+            index, offset = divmod(self._position, self._block_size)
+            chunk = self._block(index)[offset : offset + size]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._stream.seek(0, io.SEEK_END) + offset
+        else:
+            raise ValueError("Invalid whence (%r)" % whence)
+        if position < 0:
+            raise ValueError("Negative seek position %d" % position)
+        self._position = position
+        return position
+
+    def tell(self):
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_stream(stream, use_mmap=False):
+    """Wrap `stream` for fast EBML parsing
+
+    Uses a :class:`ReadAheadStream`, or with `use_mmap`, memory maps the underlying
+    file if possible. Only map files that can't be truncated while they're mapped:
+    touching a page past the end of a truncated file kills the process with SIGBUS.
+    Streams that are already wrapped are returned as-is.
+
+    :param stream: seekable file-like object
+    :param bool use_mmap: memory map the file instead of reading ahead
+    :return: a :class:`BufferStream` or :class:`ReadAheadStream`
+
+    """
+    if isinstance(stream, (BufferStream, ReadAheadStream)):
+        return stream
+    if not use_mmap:
+        return ReadAheadStream(stream)
+    try:
+        fileno = stream.fileno()
+        if os.fstat(fileno).st_size == 0:
+            raise ValueError("Cannot mmap an empty file")
+        buffer = mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation) as e:
+        logger.debug("Not memory mapping stream (%s), using read-ahead", e)
+        return ReadAheadStream(stream)
+    wrapped = BufferStream(buffer)
+    wrapped.seek(stream.tell())
+    return wrapped
@@ -0,0 +1,54 @@
+#! /usr/bin/env python
+# Compares the pure Python and numpy implementations of colorpicker.pick(), in
+# time per image and in the colors they pick, which should be identical.
+# Images are fitted to cover size first, as Clerk does.
+#
+# Usage: colorpicker-bench.py [--colors 32,128,256] <image> [...]
+
+import os
+import sys
+import time
+import argparse
+import PIL.Image
+import PIL.ImageOps
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import colorpicker
+
+COVER_SIZE = (320, 200)
+
+
+def run(func, images, colors):
+	start = time.perf_counter()
+	picked = [func(img, colors) for img in images]
+	return picked, (time.perf_counter() - start) / len(images) * 1000
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--colors', default='32,128,256')
+parser.add_argument('images', nargs='+')
+args = parser.parse_args()
+
+if colorpicker.numpy is None:
+	print('numpy is not available')
+	sys.exit(1)
+
+images = []
+for path in args.images:
+	with PIL.Image.open(path) as img:
+		images.append(PIL.ImageOps.fit(img.convert('RGB'), COVER_SIZE))
+
+print(f'{len(images)} images')
+print(f'{"colors":>6} {"python ms":>10} {"numpy ms":>10} {"speedup":>8} {"mismatches":>10}')
+mismatches = 0
+for colors in [int(c) for c in args.colors.split(',')]:
+	ref, python_ms = run(colorpicker.pick_python, images, colors)
+	out, numpy_ms = run(colorpicker.pick_numpy, images, colors)
+	bad = [(path, a, b) for path, a, b in zip(args.images, ref, out) if a != b]
+	mismatches += len(bad)
+	print(f'{colors:6} {python_ms:10.2f} {numpy_ms:10.2f} {python_ms / numpy_ms:7.1f}x {len(bad):10}')
+	for path, a, b in bad:
+		print(f'  {path}: python picked {a}, numpy picked {b}')
+
+if mismatches:
+	sys.exit(1)
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+# Compares scaling cover images to cover size with a full decode vs. a reduced
+# size (draft) decode, like clerk.scale_cover() does. Reports decode time and
+# the difference between both results, which should stay within TOLERANCE.
+#
+# Usage: cover-draft-bench.py [--size WxH] <image> [...]
+
+import os
+import sys
+import time
+import argparse
+import PIL.Image
+import PIL.ImageOps
+import PIL.ImageChops
+import PIL.ImageStat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import util
+
+ROUNDS = 5
+# Mean absolute difference per channel, 0-255
+TOLERANCE = 2.0
+
+
+def full(path, size):
+	with PIL.Image.open(path) as img:
+		img = img.convert('RGB')
+		return PIL.ImageOps.fit(img, size), img.size
+
+
+def draft(path, size):
+	with PIL.Image.open(path) as img:
+		img.draft('RGB', util.img_fit_draft_size(img.size, size))
+		img = img.convert('RGB')
+		return PIL.ImageOps.fit(img, size), img.size
+
+
+def run(func, path, size):
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		result, decoded_size = func(path, size)
+	return result, decoded_size, (time.perf_counter() - start) / ROUNDS * 1000
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', default='320x200')
+parser.add_argument('images', nargs='+')
+args = parser.parse_args()
+size = tuple(int(v) for v in args.size.split('x'))
+
+print(f'{"file":32} {"source":>11} {"decoded":>11} {"full ms":>8} {"draft ms":>8} {"speedup":>7} {"diff":>5}')
+failed = 0
+total_full, total_draft = 0, 0
+for path in args.images:
+	name = os.path.basename(path)[:32]
+	ref, full_size, full_ms = run(full, path, size)
+	out, draft_size, draft_ms = run(draft, path, size)
+	total_full += full_ms
+	total_draft += draft_ms
+
+	diff = sum(PIL.ImageStat.Stat(PIL.ImageChops.difference(ref, out)).mean) / 3
+	ok = diff <= TOLERANCE
+	failed += not ok
+	print(f'{name:32} {"%dx%d" % full_size:>11} {"%dx%d" % draft_size:>11} {full_ms:8.1f} {draft_ms:8.1f} {full_ms / draft_ms:6.1f}x {diff:5.2f}{"" if ok else " FAIL"}')
+
+print(f'Total: {total_full:.1f} ms full, {total_draft:.1f} ms draft ({total_full / total_draft:.1f}x)')
+if failed:
+	print(f'{failed} image(s) differ more than the tolerance of {TOLERANCE}')
+	sys.exit(1)
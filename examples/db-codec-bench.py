@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+# Compares DB codecs: write and read time (including schema validation) and file
+# size, for an index and a state DB. Uses the given directory's DBs, or generated
+# ones of --entries files. Codecs that aren't available are skipped.
+#
+# Usage: db-codec-bench.py [--entries 5000] [--codecs legacy,json,...] [<library dir>]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dbs
+
+ROUNDS = 20
+CODECS = 'legacy,json,json+gzip:1,json+gzip,json+zstd,json+lz4,msgpack,msgpack+zstd,msgpack+lz4'
+
+
+def generate(entries):
+	files, state = [], {}
+	for i in range(entries):
+		name = f'Some Show S{i // 20 + 1:02}E{i % 20 + 1:02} - Episode title {i}.mkv'
+		fingerprint = f'inode={random.randrange(1 << 30)}:size={random.randrange(1 << 32)}:mtime={random.randrange(1 << 60)}'
+		files.append({'name': name, 'isdir': False, 'fingerprint': fingerprint,
+			'tile_color': f'#{random.randrange(1 << 24):06x}', 'duration': random.randrange(600, 4000)})
+		state[name] = {'fingerprint': fingerprint}
+		if random.random() < 0.5:
+			state[name]['position'] = random.choice([1, random.random()])
+	return {'meta': {'version': dbs.INDEX_META_VERSION}, 'files': files}, state
+
+
+def run(filename, data, schema, codec):
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		dbs.json_write(filename, data, codec=codec)
+	write_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		result = dbs.json_read(filename, schema)
+	read_ms = (time.perf_counter() - start) / ROUNDS * 1000
+
+	assert result == data
+	return write_ms, read_ms, os.path.getsize(filename)
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--entries', type=int, default=5000)
+parser.add_argument('--codecs', default=CODECS)
+parser.add_argument('path', nargs='?')
+args = parser.parse_args()
+
+if args.path:
+	index = dbs.json_read([args.path, dbs.INDEX_DB_NAME], dbs.INDEX_DB_SCHEMA, default=None)
+	state = dbs.json_read([args.path, dbs.STATE_DB_NAME], dbs.STATE_DB_SCHEMA, default=None)
+	if index is None or state is None:
+		print(f'No index and state in {args.path}')
+		sys.exit(1)
+else:
+	index, state = generate(args.entries)
+
+codecs = []
+for spec in args.codecs.split(','):
+	try:
+		codecs.append(dbs.Codec.parse(spec))
+	except dbs.CodecError as e:
+		print(f'Skipping {spec}: {e}')
+
+print(f'index: {len(index["files"])} entries, state: {len(state)} entries')
+print(f'{"codec":16} {"db":6} {"write ms":>9} {"read ms":>9} {"bytes":>9}')
+with tempfile.TemporaryDirectory() as tmp:
+	for codec in codecs:
+		for name, data, schema in [('index', index, dbs.INDEX_DB_SCHEMA), ('state', state, dbs.STATE_DB_SCHEMA)]:
+			write_ms, read_ms, size = run(os.path.join(tmp, f'{name}.json.gz'), data, schema, codec)
+			print(f'{str(codec):16} {name:6} {write_ms:9.2f} {read_ms:9.2f} {size:9}')
@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# Compares enzyme MKV parse time and the number of read() calls that reach the
+# OS, reading straight from the file vs. through the buffered/mmap stream.
+#
+# Usage: ebml-bench.py <file.mkv> [...]
+
+import os
+import io
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import enzyme
+
+ROUNDS = 20
+
+
+class CountingFileIO(io.FileIO):
+	"""FileIO that counts the read calls, which map 1:1 onto read syscalls."""
+	reads = 0
+
+	def read(self, *args):
+		CountingFileIO.reads += 1
+		return super().read(*args)
+
+	def readinto(self, *args):
+		CountingFileIO.reads += 1
+		return super().readinto(*args)
+
+
+def run(path, wrap, buffered, use_mmap):
+	CountingFileIO.reads = 0
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		with wrap(CountingFileIO(path)) as fd:
+			with enzyme.MKV(fd, buffered=buffered, use_mmap=use_mmap) as mkv:
+				for a in mkv.attachments:
+					a.data.read()
+	elapsed = (time.perf_counter() - start) / ROUNDS
+	return elapsed * 1000, CountingFileIO.reads / ROUNDS
+
+
+print(f'{"file":40} {"mode":12} {"ms/parse":>10} {"reads/parse":>12}')
+for path in sys.argv[1:]:
+	name = os.path.basename(path)[:40]
+	for mode, wrap, buffered, use_mmap in [
+		('direct', io.BufferedReader, False, False),
+		('read-ahead', io.BufferedReader, True, False),
+		('mmap', io.BufferedReader, True, True),
+	]:
+		ms, reads = run(path, wrap, buffered, use_mmap)
+		print(f'{name:40} {mode:12} {ms:10.2f} {reads:12.1f}')
@@ -0,0 +1,142 @@
+#! /usr/bin/env python
+# Compares dbs.json_validate() (compiled schemas) with the recursive interpreter it
+# replaced, on a generated index of --entries files: time per validation, and the
+# error messages for a set of broken DBs, which should be identical.
+#
+# Usage: schema-bench.py [--entries 5000]
+
+import os
+import sys
+import copy
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import dbs
+
+ROUNDS = 20
+
+
+# The interpreter json_validate() used to be
+def interpreted_validate(data, schema, keyname=None):
+	if isinstance(schema, dict):
+		if not isinstance(data, dict):
+			raise dbs.JsonValidationError(f'Expected object for {keyname}, not {data}')
+		mandatory, optional, wildcard = {}, {}, None
+		for k, v in schema.items():
+			if k == '*':
+				wildcard = v
+			elif k.endswith('?'):
+				optional[k[:-1]] = v
+			else:
+				mandatory[k] = v
+
+		unknown = []
+		for k, v in data.items():
+			if k in mandatory:
+				interpreted_validate(v, mandatory[k], keyname=k)
+				del mandatory[k]
+			elif k in optional:
+				interpreted_validate(v, optional[k], keyname=k)
+			elif wildcard is not None:
+				interpreted_validate(v, wildcard, keyname=k)
+			else:
+				unknown.append(k)
+
+		if unknown:
+			raise dbs.JsonValidationError(f'Extra keys {unknown} in {data}')
+		if mandatory:
+			raise dbs.JsonValidationError(f'Missing keys {list(mandatory.keys())} in {data}')
+
+	elif isinstance(schema, list):
+		if len(schema) != 1:
+			raise ValueError(f'Schema list must have length one: {schema}')
+		schema = schema[0]
+		for idx, item in enumerate(data):
+			interpreted_validate(item, schema, keyname=str(idx))
+
+	# Optional hack
+	elif isinstance(schema, tuple):
+		if len(schema) != 1:
+			raise ValueError(f'Schema tuple must have length one: {schema}')
+		schema = schema[0]
+		if data is not None:
+			interpreted_validate(data, schema, keyname=keyname)
+
+	elif schema in {str, bool, int, float}:
+		if schema is float:
+			schema = (int, float)
+		if not isinstance(data, schema):
+			raise dbs.JsonValidationError(f'Key {keyname}={data!r} should be type {schema}')
+	else:
+		raise KeyError(f'Unsupported schema type: {schema}')
+
+
+def generate(entries):
+	files = []
+	for i in range(entries):
+		files.append({'name': f'Some Show S{i // 20 + 1:02}E{i % 20 + 1:02}.mkv', 'isdir': False,
+			'fingerprint': f'inode={random.randrange(1 << 30)}:size={random.randrange(1 << 32)}',
+			'tile_color': f'#{random.randrange(1 << 24):06x}', 'duration': random.randrange(600, 4000)})
+	files.append({'name': 'Extras', 'isdir': True, 'fingerprint': None})
+	return {'meta': {'version': dbs.INDEX_META_VERSION}, 'files': files}
+
+
+def broken(index):
+	"""Yields (description, data, schema) of DBs that fail validation."""
+	def variant(func):
+		data = copy.deepcopy(index)
+		func(data)
+		return data
+	yield 'not an object', [], dbs.INDEX_DB_SCHEMA
+	yield 'extra key', variant(lambda d: d.update(extra=1)), dbs.INDEX_DB_SCHEMA
+	yield 'missing key', variant(lambda d: d.pop('meta')), dbs.INDEX_DB_SCHEMA
+	yield 'wrong type', variant(lambda d: d['files'][-2].update(duration='long')), dbs.INDEX_DB_SCHEMA
+	yield 'null in mandatory', variant(lambda d: d['files'][3].update(name=None)), dbs.INDEX_DB_SCHEMA
+	yield 'missing nested', variant(lambda d: d['files'][7].pop('isdir')), dbs.INDEX_DB_SCHEMA
+	yield 'extra meta key', variant(lambda d: d['meta'].update(summary={'mtime': 1})), dbs.INDEX_DB_SCHEMA
+	yield 'bad summary', {'summary': {'mtime': 1}, 'index': [1, 2, 3]}, dbs.SCAN_DB_SCHEMA
+	yield 'state float', {'a': {'position': 'x'}}, dbs.STATE_DB_SCHEMA
+	yield 'state object', {'a': 1}, dbs.STATE_DB_SCHEMA
+
+
+def error(func, data, schema):
+	try:
+		func(data, schema)
+	except dbs.JsonValidationError as e:
+		return str(e)
+	return None
+
+
+def run(func, data, schema):
+	start = time.perf_counter()
+	for i in range(ROUNDS):
+		func(data, schema)
+	return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--entries', type=int, default=5000)
+args = parser.parse_args()
+
+index = generate(args.entries)
+state = {f['name']: {'fingerprint': f['fingerprint'], 'position': random.random()} for f in index['files'] if f['fingerprint']}
+
+print(f'{"db":6} {"entries":>8} {"interpreted ms":>15} {"compiled ms":>12} {"speedup":>8}')
+for name, data, schema in [('index', index, dbs.INDEX_DB_SCHEMA), ('state', state, dbs.STATE_DB_SCHEMA)]:
+	entries = len(data['files']) if name == 'index' else len(data)
+	interpreted_ms = run(interpreted_validate, data, schema)
+	compiled_ms = run(dbs.json_validate, data, schema)
+	print(f'{name:6} {entries:8} {interpreted_ms:15.2f} {compiled_ms:12.2f} {interpreted_ms / compiled_ms:7.1f}x')
+
+mismatches = 0
+for description, data, schema in broken(index):
+	expected = error(interpreted_validate, data, schema)
+	got = error(dbs.json_validate, data, schema)
+	if expected != got or expected is None:
+		mismatches += 1
+		print(f'{description}: interpreter says {str(expected)[:80]!r}, compiled says {str(got)[:80]!r}')
+print(f'Error messages: {mismatches} mismatches')
+if mismatches:
+	sys.exit(1)
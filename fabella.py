@@ -16,6 +16,8 @@ import glfw
 import time
 
 import loghelper
+import config
+import dbs
 from window import Window
 from tile import Tile
 from menu import Menu
@@ -54,6 +56,9 @@ else:
 
 
 #### Initialization
+if config.performance.db_cache_mb > 0:
+	dbs.enable_read_cache(config.performance.db_cache_mb * 1024 * 1024)
+
 # FIXME: hardcoded monitor
 window = Window(2, "Fabella")
 draw.State.initialize(window.width, window.height)
@@ -7,7 +7,6 @@
 import os
 import datetime
 import time
-import zipfile
 import PIL.ImageEnhance
 import bisect
 
@@ -15,8 +14,10 @@ import loghelper
 import config
 import dbs
 import draw
+import coverpack
 from tile import Tile
 from font import Font
+from changefeed import ChangeFeed
 
 
 
@@ -40,10 +41,16 @@ class Menu:
 		self.current_offset = 0
 		self.index = []
 		self.tiles = {}
-		self.covers_zip = None
+		self.covers = None
 		self.searching = False
 		self.search_str = ''
 
+		# Clerk's change feed, to refresh the folder shown when it changes. Looked
+		# for again every refresh_interval until Clerk has started one.
+		self.changes = None
+		self.changes_checked = 0
+		self.stale = False
+
 		# Background
 		log.info(f'Loading background image: {config.menu.background_image}')
 		if config.menu.background_image is not None:
@@ -127,6 +134,48 @@ class Menu:
 			meh += '        '
 		self.clock_text.text = meh
 
+		if config.menu.refresh_interval > 0 and time.time() - self.changes_checked >= config.menu.refresh_interval:
+			self.changes_checked = time.time()
+			if self.changes is None:
+				self.changes = ChangeFeed.find(self.path)
+			else:
+				path = os.path.abspath(self.path)
+				changes = self.changes.poll()
+				if changes is None or any(kind != 'state' and changed == path for kind, changed in changes):
+					self.stale = True
+				elif any(changed == path for kind, changed in changes):
+					self.refresh_state(video)
+
+		# Reloading destroys the tiles; not while one is being played, searched or hidden
+		if self.stale and self.enabled and not self.searching and video.tile is None:
+			self.refresh()
+
+
+	def refresh(self):
+		"""Reloads the current folder, keeping the current tile selected."""
+		log.info(f'{self.path} changed, reloading')
+		current = self.current
+		self.load(self.path, previous=current.filename if current else None, animate=False)
+
+
+	def refresh_state(self, video):
+		"""Rereads the state (and folder stats) of the current folder into its tiles,
+		except the one being played, which is ahead of what's on disk."""
+		log.info(f'State of {self.path} changed, updating tiles')
+		state = dbs.json_read([self.path, dbs.STATE_DB_NAME], dbs.STATE_DB_SCHEMA)
+		stats = dbs.json_read([self.path, dbs.STATS_DB_NAME], dbs.STATS_DB_SCHEMA)
+		for idx, entry in enumerate(self.index):
+			entry_state = state.get(entry['name'], {})
+			entry['position'] = entry_state.get('position', 0)
+			entry['tagged'] = entry_state.get('tagged', False)
+			if entry['name'] in stats:
+				entry['stats'] = stats[entry['name']]
+
+			tile = self.tiles.get(idx)
+			if tile is not None and tile is not video.tile:
+				tile.update_meta(entry)
+				tile.render()
+
 
 	def close(self):
 		if not self.enabled:
@@ -169,11 +218,15 @@ class Menu:
 		self.index = []
 		self.current_idx = 0
 		self.current_offset = 0
-		self.covers_zip = None
+		if self.covers is not None:
+			self.covers.close()
+		self.covers = None
 
 
-	def load(self, path, previous=None):
-		if len(path) > len(self.path or ''):
+	def load(self, path, previous=None, animate=True):
+		if not animate:
+			animate_direction = None
+		elif len(path) > len(self.path or ''):
 			animate_direction = 'left'
 		else:
 			animate_direction = 'right'
@@ -181,6 +234,7 @@ class Menu:
 		self.forget(animate=animate_direction)
 		log.info(f'Loading {path}')
 		self.path = path
+		self.stale = False
 		timer = time.time()
 
 		index = dbs.json_read([path, dbs.INDEX_DB_NAME], dbs.INDEX_DB_SCHEMA, default=None)
@@ -194,18 +248,18 @@ class Menu:
 			return
 
 		state = dbs.json_read([path, dbs.STATE_DB_NAME], dbs.STATE_DB_SCHEMA)
+		stats = dbs.json_read([path, dbs.STATS_DB_NAME], dbs.STATS_DB_SCHEMA)
 		index = index['files']
 		for entry in index:
 			entry.update(state.get(entry['name'], {}))
+			if entry['name'] in stats:
+				entry['stats'] = stats[entry['name']]
 		self.index = index
 
-		# Open cover DB
-		cover_db_name = os.path.join(self.path, '.fabella', 'covers.zip')
-		try:
-			self.covers_zip = zipfile.ZipFile(cover_db_name, 'r')
-		except OSError as e:
-			self.covers_zip = None
-			log.error(f'Parsing cover DB {cover_db_name}: {e}')
+		# Open cover DB; this mmaps the cover pack, covers are only read when tiles are shown.
+		# Prefer covers Clerk made for our tile size (see clerk --cover-variant).
+		self.covers = coverpack.open_covers(self.path, (config.tile.width, config.tile.cover_height)) \
+			or coverpack.open_covers(self.path)
 
 		index = None
 		if index is None and previous is not None:
@@ -492,7 +546,7 @@ class Menu:
 				try:
 					tile = self.tiles[idx]
 				except KeyError:
-					tile = Tile(self, self.index[idx], self.covers_zip)
+					tile = Tile(self, self.index[idx], self.covers)
 				tile.show(
 					(self.tile_hstart + x * self.tile_hoffset - Tile.xoff,
 					self.height - self.tile_vstart - y * self.tile_voffset - config.tile.cover_height - Tile.yoff),
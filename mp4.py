@@ -0,0 +1,156 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Minimal ISO base media file format (MP4/M4V/MOV) reader.
+# Only understands enough boxes to get the duration and embedded cover art:
+#   moov/mvhd                     -> duration
+#   moov/udta/meta/ilst/covr/data -> cover image
+
+import os
+import struct
+
+import loghelper
+
+log = loghelper.get_logger('MP4', loghelper.Color.Blue)
+
+# Box types we descend into, and the path to the cover art
+CONTAINERS = {b'moov', b'udta', b'meta', b'ilst', b'covr'}
+COVER_PATH = [b'moov', b'udta', b'meta', b'ilst', b'covr', b'data']
+COVER_TYPES = {13: 'image/jpeg', 14: 'image/png', 27: 'image/bmp'}
+# Refuse to read absurdly large boxes into memory
+MAX_COVER_SIZE = 64 * 1024 * 1024
+
+
+
+class Error(Exception):
+	pass
+
+
+
+class MP4:
+	"""Parses duration and cover art from a seekable binary file object.
+
+	duration is in seconds (float) or None if unknown.
+	cover is the raw image data (bytes) or None; cover_mimetype its type.
+	"""
+
+	def __init__(self, fd):
+		self.fd = fd
+		self.duration = None
+		self.cover = None
+		self.cover_mimetype = None
+
+		size = fd.seek(0, os.SEEK_END)
+		found_moov = False
+		for btype, start, end in self.boxes(0, size):
+			if btype == b'moov':
+				found_moov = True
+				self.parse_moov(start, end)
+				break
+
+		if not found_moov:
+			raise Error('No moov box found')
+
+
+	def boxes(self, start, end):
+		"""Yields (type, payload start, payload end) for every box between start and end."""
+		pos = start
+		while pos + 8 <= end:
+			self.fd.seek(pos)
+			header = self.fd.read(8)
+			if len(header) < 8:
+				raise Error(f'Short read at offset {pos}')
+			size, btype = struct.unpack('>I4s', header)
+			header_size = 8
+
+			if size == 1:
+				# 64-bit largesize follows the type
+				largesize = self.fd.read(8)
+				if len(largesize) < 8:
+					raise Error(f'Short read at offset {pos}')
+				size, = struct.unpack('>Q', largesize)
+				header_size = 16
+			elif size == 0:
+				# Box extends to the end of its container
+				size = end - pos
+
+			if size < header_size or pos + size > end:
+				raise Error(f'Invalid size {size} for box {btype!r} at offset {pos}')
+
+			yield btype, pos + header_size, pos + size
+			pos += size
+
+
+	def read(self, start, end):
+		self.fd.seek(start)
+		data = self.fd.read(end - start)
+		if len(data) < end - start:
+			raise Error(f'Short read at offset {start}')
+		return data
+
+
+	def parse_moov(self, start, end):
+		for btype, bstart, bend in self.boxes(start, end):
+			if btype == b'mvhd':
+				self.parse_mvhd(self.read(bstart, min(bend, bstart + 32)))
+			elif btype == b'udta':
+				self.parse_cover(bstart, bend, COVER_PATH[2:])
+
+
+	def parse_mvhd(self, data):
+		if len(data) < 1:
+			raise Error('Empty mvhd box')
+		version = data[0]
+		if version == 1:
+			if len(data) < 32:
+				raise Error('Short mvhd box')
+			timescale, duration = struct.unpack('>IQ', data[20:32])
+			unknown = 0xffffffffffffffff
+		else:
+			if len(data) < 20:
+				raise Error('Short mvhd box')
+			timescale, duration = struct.unpack('>II', data[12:20])
+			unknown = 0xffffffff
+
+		if timescale and duration != unknown:
+			self.duration = duration / timescale
+
+
+	def parse_cover(self, start, end, path):
+		"""Descends into the boxes named in path, looking for cover art."""
+		btype_wanted = path[0]
+
+		if btype_wanted == b'ilst' and self.read(start, min(start + 8, end))[4:8] != b'hdlr':
+			# We're in a 'meta' box. In MP4 this is a full box (version + flags), in
+			# QuickTime it's a plain container. In the latter case, the first child
+			# (hdlr) follows immediately.
+			start += 4
+
+		for btype, bstart, bend in self.boxes(start, end):
+			if btype != btype_wanted:
+				continue
+
+			if btype != b'data':
+				self.parse_cover(bstart, bend, path[1:])
+			else:
+				# data box: type indicator, locale, then the payload
+				if bend - bstart < 8:
+					raise Error('Short data box')
+				if bend - bstart - 8 > MAX_COVER_SIZE:
+					raise Error(f'Cover art of {bend - bstart - 8} bytes is too large')
+				type_indicator, _ = struct.unpack('>II', self.read(bstart, bstart + 8))
+				self.cover_mimetype = COVER_TYPES.get(type_indicator & 0xffffff)
+				self.cover = self.read(bstart + 8, bend)
+
+			if self.cover is not None:
+				return
+
+
+	def __str__(self):
+		return f'MP4(duration={self.duration}, cover_mimetype={self.cover_mimetype})'
+
+	def __repr__(self):
+		return self.__str__()
@@ -0,0 +1,111 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Tells whether files are completely written, so they aren't analyzed half-copied.
+
+import os
+import re
+import time
+import threading
+
+import loghelper
+
+log = loghelper.get_logger('Readiness', loghelper.Color.Green)
+
+# Temporary names of files being downloaded/copied; {name} is the final name.
+# rsync writes to .name.XXXXXX and renames it when done.
+RSYNC_TEMP_RE = re.compile(r'^\.(.+)\.[A-Za-z0-9]{6}$')
+PARTIAL_SUFFIXES = ('.part', '.partial', '.crdownload', '.!qB', '.aria2')
+
+# Without a close, a file being written counts as abandoned when it hasn't been
+# modified for this long.
+WRITE_STALE_SECONDS = 3600
+# How often to check again on files that are being written. Their close normally
+# triggers a scan before that.
+WRITING_RETRY_SECONDS = 60
+
+
+
+def partial_names(names):
+	"""Returns the names in a directory listing that are still being written,
+	judging by the temporary files next to them."""
+	partial = set()
+	for name in names:
+		m = RSYNC_TEMP_RE.match(name)
+		if m:
+			partial.add(m.group(1))
+		elif name.endswith(PARTIAL_SUFFIXES):
+			partial.add(name[:name.rindex('.')])
+	return partial
+
+
+
+class Readiness:
+	"""Tracks per file whether it's being written, from watcher events: 'created'
+	and 'modified' start a write, 'closed' ends it. Only use events if the watcher
+	reports closes (trust_events). Files without (trusted) events are ready once
+	their mtime is settle_seconds old.
+	"""
+
+	WRITING = 'writing'
+	CLOSED = 'closed'
+
+	def __init__(self, settle_seconds, trust_events=True):
+		self.settle_seconds = settle_seconds
+		self.trust_events = trust_events
+		self.lock = threading.Lock()
+		self.files = {}
+
+
+	def event(self, event):
+		if event.isdir or not self.trust_events:
+			return
+		with self.lock:
+			if event.evtype in {'created', 'modified'}:
+				self.files[event.path] = self.WRITING
+			elif event.evtype == 'closed':
+				self.files[event.path] = self.CLOSED
+			elif event.evtype == 'deleted':
+				self.files.pop(event.path, None)
+
+
+	def check(self, path, mtime, partial=()):
+		"""Returns None if file path (last modified at mtime) is ready, otherwise
+		the number of seconds after which it's worth checking again. partial is
+		the result of partial_names() for its directory."""
+		if os.path.basename(path) in partial:
+			log.info(f'{path} has a partial download/transfer next to it, not ready')
+			return WRITING_RETRY_SECONDS
+
+		age = time.time() - mtime
+		with self.lock:
+			state = self.files.get(path)
+			if state == self.CLOSED and age >= self.settle_seconds:
+				# Old enough to not need the close anymore
+				del self.files[path]
+			elif state == self.WRITING and age > WRITE_STALE_SECONDS:
+				# Abandoned; no close is coming to remove it
+				del self.files[path]
+
+		if state == self.CLOSED:
+			return None
+		if state == self.WRITING:
+			if age > WRITE_STALE_SECONDS:
+				log.warning(f'{path} was never closed, but not modified in {int(age)}s; assuming it is ready')
+				return None
+			log.info(f'{path} is being written, not ready')
+			return WRITING_RETRY_SECONDS
+		if age < self.settle_seconds:
+			log.info(f'{path} was modified {age:.1f}s ago, not ready')
+			return self.settle_seconds - age
+		return None
+
+
+	def __str__(self):
+		return f'Readiness(settle_seconds={self.settle_seconds}, tracking={len(self.files)})'
+
+	def __repr__(self):
+		return self.__str__()
@@ -10,6 +10,8 @@ import sys
 import subprocess
 
 import dbs
+import config
+from catalog import Catalog
 
 if len(sys.argv) < 2 or sys.argv[1] not in {'find-tagged', 'mark-seen', 'mark-new', 'do-tagged'}:
 	print(f'Usage:')
@@ -38,8 +40,20 @@ def find_tagged(path):
 	return files
 
 
+def tagged_files():
+	"""Lists the tagged files below the current directory: from the library
+	catalog if there is one, otherwise by walking the index and state DBs."""
+	catalog = Catalog.find('.')
+	if catalog is None:
+		return find_tagged('')
+	try:
+		return [os.path.relpath(fn) for fn in catalog.tagged(os.path.abspath('.'))]
+	finally:
+		catalog.close()
+
+
 if sys.argv[1] == 'find-tagged':
-	for fn in find_tagged(''):
+	for fn in tagged_files():
 		print(fn)
 
 if sys.argv[1] == 'do-tagged':
@@ -62,7 +76,7 @@ if sys.argv[1] == 'do-tagged':
 		print(f'Need a command before {mode}')
 		exit(1)
 
-	files = find_tagged('')
+	files = tagged_files()
 	if not files:
 		print('No tagged files.')
 		exit(1)
@@ -77,7 +91,7 @@ if sys.argv[1] == 'mark-seen':
 	count = 0
 	for f in sys.argv[2:]:
 		path, file = os.path.split(f)
-		dbs.json_write([path, dbs.QUEUE_DIR_NAME, ...], {file: {'position': 1}})
+		dbs.write_state_update(path, {file: {'position': 1}}, journal=config.performance.state_journal)
 		count += 1
 	print(f'Marked {count} files as seen.')
 
@@ -85,6 +99,6 @@ if sys.argv[1] == 'mark-new':
 	count = 0
 	for f in sys.argv[2:]:
 		path, file = os.path.split(f)
-		dbs.json_write([path, dbs.QUEUE_DIR_NAME, ...], {file: {'position': 0}})
+		dbs.write_state_update(path, {file: {'position': 0}}, journal=config.performance.state_journal)
 		count += 1
 	print(f'Marked {count} files as new.')
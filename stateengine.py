@@ -0,0 +1,482 @@
+# Fabella - Simple, elegant video library and player.
+#
+# Copyright 2020-2023 Marcel Moreaux.
+# Licensed under GPL v2.0, or (at your option) any later version.
+# (SPDX GPL-2.0-or-later) See LICENSE file for details.
+
+# Folds the state updates clients leave in .fabella/queue into state.json.gz, and
+# propagates a summary of each directory's state to its parent, along with
+# aggregate stats of the videos in and below it.
+
+import os
+import heapq
+import collections
+
+import dbs
+import loghelper
+
+log = loghelper.get_logger('StateEngine', loghelper.Color.Magenta)
+
+# Fully read journals larger than this are retired: renamed, so the client starts
+# a new one, and removed once records appended while renaming have been read.
+JOURNAL_RETIRE_BYTES = 1024 * 1024
+RETIRED_SUFFIX = '.retired'
+
+STATS_SUMMED = ('files', 'unseen', 'watching', 'duration', 'remaining')
+
+
+
+def stat_key(filename):
+	"""Returns something that changes when filename is replaced, or None if it's missing."""
+	try:
+		st = os.stat(filename)
+	except FileNotFoundError:
+		return None
+	return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+
+def reconcile(previous_state, index):
+	"""Returns the state for the files in index, taken from previous_state: matched on
+	name and fingerprint, on fingerprint (renamed files), or on name (updated files).
+	previous_state is consumed."""
+	new_state = {}
+
+	# Match index to previous state on name AND fingerprint
+	remaining = []
+	for idx in index:
+		name = idx['name']
+		state = previous_state.get(name, {})
+		fp = state.get('fingerprint', None)
+		if fp is not None and fp == idx['fingerprint']:
+			new_state[name] = state
+			previous_state.pop(name)
+			log.debug(f'Found name+fingerprint match in previous state for "{name}"')
+		else:
+			remaining.append(idx)
+
+	# Match index to previous state on just fingerprint; these were probably renamed
+	index = remaining
+	remaining = []
+	duplicate_fps = {None} \
+		| {fp for fp, c in collections.Counter([i.get('fingerprint') for i in index]).items() if c > 1} \
+		| {fp for fp, c in collections.Counter([s.get('fingerprint') for s in previous_state.values()]).items() if c > 1}
+	if duplicate_fps != {None}:
+		log.warning(f'Duplicate fingerprints will be ignored: {duplicate_fps}')
+	previous_state_by_fp = {s['fingerprint']: (n, s) for n, s in previous_state.items() if s.get('fingerprint') not in duplicate_fps}
+	for idx in index:
+		name = idx['name']
+		fp = idx.get('fingerprint')
+		if fp in duplicate_fps:
+			remaining.append(idx)
+			continue
+		try:
+			oldname, state = previous_state_by_fp[fp]
+		except KeyError:
+			remaining.append(idx)
+			continue
+		else:
+			new_state[name] = state
+			previous_state.pop(oldname)
+			log.info(f'Found fingerprint match in previous state for "{name}"; renamed from "{oldname}"')
+
+	# Match index to previous state on just name; these were probably updated
+	index = remaining
+	for idx in index:
+		name = idx['name']
+		fp = idx.get('fingerprint')
+		try:
+			state = previous_state[name]
+		except KeyError:
+			new_state[name] = {} if fp is None else {'fingerprint': fp}
+			log.info(f'New file "{name}" has no match in previous state')
+		else:
+			log.info(f'Found name match in previous state for "{name}" fingerprint changed from {state.get("fingerprint")} to {fp}')
+			if fp is None:
+				state.pop('fingerprint', None)
+			else:
+				state['fingerprint'] = fp
+			new_state[name] = state
+			previous_state.pop(name)
+
+	# Remaining entries from previous state are unmatched; they were probably removed
+	for n, s in previous_state.items():
+		log.info(f'"{n}" in previous state was not matched to any current file; ignored')
+
+	return new_state
+
+
+
+def apply_update(state, updates):
+	"""Applies a state update (name: {position, tagged}) to state."""
+	for name, update in updates.items():
+		log.debug(f'State update for {name}: {update}')
+
+		if name not in state:
+			state[name] = {}
+		this_state = state[name]
+
+		if 'position' in update:
+			if update['position'] > 0:
+				this_state['position'] = update['position']
+			else:
+				this_state.pop('position', None)
+
+		if 'tagged' in update:
+			if update['tagged']:
+				this_state['tagged'] = True
+			else:
+				this_state.pop('tagged', None)
+
+
+
+def index_files(index, mtimes):
+	"""Returns {name: (duration, mtime)} of the videos in index, with their mtimes
+	as recorded by the scan (dbs.SCAN_DB_NAME)."""
+	return {f['name']: (f.get('duration') or 0, mtimes.get(f['name'], 0)) for f in index if not f['isdir']}
+
+
+
+def aggregate(state, files, substats):
+	"""Returns the stats of a directory from its videos (files, as returned by
+	index_files()) and their state, and the stats of its subdirectories."""
+	stats = dict.fromkeys(STATS_SUMMED + ('newest',), 0)
+	for name, (duration, mtime) in files.items():
+		position = state.get(name, {}).get('position', 0)
+		stats['files'] += 1
+		stats['unseen'] += position == 0
+		stats['watching'] += 0 < position < 1
+		stats['duration'] += duration
+		stats['remaining'] += round(duration * (1 - position))
+		stats['newest'] = max(stats['newest'], mtime)
+
+	for s in substats.values():
+		for key in STATS_SUMMED:
+			stats[key] += s[key]
+		stats['newest'] = max(stats['newest'], s['newest'])
+
+	return stats
+
+
+
+def flatten(state, files, substats):
+	"""Returns the state of a directory as seen from its parent, with its stats."""
+	flat = {'tagged': any(s.get('tagged', False) for s in state.values())}
+
+	if any(0 < s.get('position', 0) < 1 for s in state.values()):
+		flat['position'] = 0.5
+	elif any(s.get('position', 0) == 0 for s in state.values()):
+		flat['position'] = 0
+	else:
+		flat['position'] = 1
+
+	flat['stats'] = aggregate(state, files, substats)
+	return flat
+
+
+
+def copy_state(state):
+	return {n: dict(s) for n, s in state.items()}
+
+
+
+class DirState:
+	"""Cached state of a directory, valid as long as its state DB and index (and
+	scan DB) are unchanged on disk. saved is the state as last read from or written
+	to disk. files are its videos (see index_files()), substats the stats of its
+	subdirectories, as in its stats DB. offsets are the journal offsets, read when
+	first needed. flat is what was last propagated to the parent."""
+
+	def __init__(self, state, saved, state_key, index_key, files, substats):
+		self.state = state
+		self.saved = saved
+		self.state_key = state_key
+		self.index_key = index_key
+		self.files = files
+		self.substats = substats
+		self.saved_substats = dict(substats)
+		self.offsets = None
+		self.flat = None
+
+
+
+class StateEngine:
+	"""Keeps the state of recently used directories in memory (at most max_dirs),
+	so processing their queues doesn't reread state and index DBs that haven't
+	changed. process() handles a batch of directories deepest first: the summary
+	of each changed directory is applied to its parent in memory rather than
+	through the parent's queue, so every state DB on the way up to the root is
+	written once per batch. locks(path) is a context manager that serializes
+	access to a directory with others (scans). State changes are also applied to
+	the Catalogs in catalogs (root: Catalog), if any, and recorded in the
+	ChangeLogs in changelogs (root: ChangeLog).
+	"""
+
+	def __init__(self, roots, locks, max_dirs=4096, catalogs=None, changelogs=None):
+		self.roots = roots
+		self.locks = locks
+		self.max_dirs = max_dirs
+		self.catalogs = catalogs or {}
+		self.changelogs = changelogs or {}
+		self.cache = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+
+	def load(self, path):
+		"""Returns the DirState of path, reconciled with its current index."""
+		state_db_name = os.path.join(path, dbs.STATE_DB_NAME)
+		index_db_name = os.path.join(path, dbs.INDEX_DB_NAME)
+		scan_db_name = os.path.join(path, dbs.SCAN_DB_NAME)
+		state_key = stat_key(state_db_name)
+		index_key = (stat_key(index_db_name), stat_key(scan_db_name))
+
+		cached = self.cache.get(path)
+		if cached is not None and cached.state_key == state_key:
+			self.cache.move_to_end(path)
+			if cached.index_key == index_key:
+				self.hits += 1
+				return cached
+			# Only the index changed; the cached state is still what's on disk
+			previous_state = cached.state
+			saved = cached.saved
+			substats = cached.saved_substats
+		else:
+			previous_state = dbs.json_read(state_db_name, dbs.STATE_DB_SCHEMA)
+			saved = copy_state(previous_state)
+			substats = dbs.json_read([path, dbs.STATS_DB_NAME], dbs.STATS_DB_SCHEMA)
+		self.misses += 1
+
+		index = dbs.json_read(index_db_name, dbs.INDEX_DB_SCHEMA, default={'files': []})['files']
+		mtimes = dbs.json_read(scan_db_name, dbs.SCAN_DB_SCHEMA, default={'mtimes': {}})['mtimes']
+		cached = DirState(reconcile(previous_state, index), saved, state_key, index_key, index_files(index, mtimes), substats)
+		# Forget the stats of subdirectories that are gone
+		dirs = {f['name'] for f in index if f['isdir']}
+		cached.substats = {name: s for name, s in substats.items() if name in dirs}
+		self.cache[path] = cached
+		self.cache.move_to_end(path)
+		while len(self.cache) > max(self.max_dirs, 1):
+			self.cache.popitem(last=False)
+		return cached
+
+
+	def process(self, paths):
+		"""Processes the state queues of paths, and propagates changes upwards."""
+		heap = [(-path.count('/'), path) for path in set(paths)]
+		heapq.heapify(heap)
+		queued = set(paths)
+		# path: {name: flattened state} of its changed subdirectories
+		propagated = collections.defaultdict(dict)
+		changed_dirs = 0
+
+		while heap:
+			_, path = heapq.heappop(heap)
+			try:
+				with self.locks(path):
+					flat = self.process_dir(path, propagated.pop(path, {}))
+			except Exception:
+				# Don't let one bad directory keep the rest of the batch from being processed
+				log.exception(f'Processing state of {path}')
+				self.cache.pop(path, None)
+				continue
+			if flat is None:
+				continue
+			changed_dirs += 1
+
+			# Propagate state upwards (but not outside root dir)
+			if path not in self.roots:
+				parent = os.path.dirname(path)
+				propagated[parent][os.path.basename(path)] = flat
+				if parent not in queued:
+					queued.add(parent)
+					heapq.heappush(heap, (-parent.count('/'), parent))
+
+		log.debug(f'Processed state of {len(queued)} directories, {changed_dirs} changed')
+
+
+	def process_dir(self, path, propagated):
+		"""Applies the queued and propagated (from subdirectories) updates for path,
+		and writes its state DB if that changed. Returns the flattened state for the
+		parent if it changed, otherwise None."""
+		if not os.path.isdir(path):
+			log.debug(f'{path} is gone, nothing to do')
+			self.cache.pop(path, None)
+			return None
+
+		log.info(f'Processing state events for {path}')
+
+		queue_dir_name = os.path.join(path, dbs.QUEUE_DIR_NAME)
+		state_db_name = os.path.join(path, dbs.STATE_DB_NAME)
+
+		new = not os.path.isdir(queue_dir_name)
+
+		# Ensure queue dir exists
+		os.makedirs(queue_dir_name, exist_ok=True)
+		os.chmod(queue_dir_name, 0o775)
+
+		cached = self.load(path)
+		state = cached.state
+
+		#### Collect any state update files and journals
+		# [(time, updates)], and the files to remove once they're applied
+		state_queue = []
+		queue_files = []
+		journals = []
+		try:
+			for f in os.scandir(queue_dir_name):
+				try:
+					if not f.is_file() or f.path.endswith(dbs.NEW_SUFFIX):
+						continue
+					if f.name.endswith((dbs.JOURNAL_SUFFIX, dbs.JOURNAL_SUFFIX + RETIRED_SUFFIX)):
+						journals.append(f)
+						continue
+					updates = dbs.json_read(f.path, dbs.STATE_UPDATE_SCHEMA, default={})
+					state_queue.append((f.stat().st_mtime, updates))
+					queue_files.append(f.path)
+				except OSError as e:
+					log.error(f'Reading {f.path}: {str(e)}')
+		except OSError as e:
+			log.error(f'Reading {queue_dir_name}: {str(e)}')
+			state_queue, queue_files, journals = [], [], []
+
+		offsets_changed = False
+		if journals or cached.offsets:
+			offsets_changed = self.read_journals(path, cached, journals, state_queue, queue_files)
+
+		#### Apply the requested state updates, then those of subdirectories. Stats
+		#### only come from subdirectories, never from clients' updates.
+		for update_time, updates in sorted(state_queue, key=lambda u: u[0]):
+			apply_update(state, updates)
+		for name, flat in propagated.items():
+			apply_update(state, {name: {k: v for k, v in flat.items() if k != 'stats'}})
+			cached.substats[name] = flat['stats']
+
+		#### Write new state
+		changed = state != cached.saved
+		if not changed:
+			log.debug('State unchanged, not updating.')
+		elif state:
+			dbs.json_write(state_db_name, state)
+		else:
+			log.debug(f'Empty state; removing {state_db_name}')
+			try:
+				os.unlink(state_db_name)
+			except FileNotFoundError:
+				pass
+			except OSError as e:
+				log.error(f'Removing {state_db_name}: {str(e)}')
+		if changed:
+			cached.saved = copy_state(state)
+			cached.state_key = stat_key(state_db_name)
+
+		#### Write new stats of subdirectories
+		stats_changed = cached.substats != cached.saved_substats
+		if stats_changed:
+			if cached.substats:
+				dbs.json_write([path, dbs.STATS_DB_NAME], cached.substats)
+			else:
+				try:
+					os.unlink(os.path.join(path, dbs.STATS_DB_NAME))
+				except FileNotFoundError:
+					pass
+				except OSError as e:
+					log.error(f'Removing {dbs.STATS_DB_NAME} in {path}: {str(e)}')
+			cached.saved_substats = dict(cached.substats)
+
+		if changed or stats_changed:
+			changelog = self.of_root(self.changelogs, path)
+			if changelog is not None:
+				changelog.record('state', path)
+
+		catalog = self.of_root(self.catalogs, path)
+		if catalog is not None and (changed or catalog.needs_state(path)):
+			catalog.update_state(path, state)
+
+		# Only now that their records are applied, remember how far journals were read
+		if offsets_changed:
+			if cached.offsets:
+				dbs.json_write([path, dbs.JOURNAL_OFFSETS_NAME], cached.offsets)
+			else:
+				try:
+					os.unlink(os.path.join(path, dbs.JOURNAL_OFFSETS_NAME))
+				except FileNotFoundError:
+					pass
+				except OSError as e:
+					log.error(f'Removing {dbs.JOURNAL_OFFSETS_NAME} in {path}: {str(e)}')
+
+		for update_name in queue_files:
+			try:
+				log.debug(f'Removing {update_name}')
+				os.unlink(update_name)
+			except OSError as e:
+				log.error(f'Removing {update_name}: {str(e)}')
+
+		# A new directory always propagates its state to the parent (notably, for
+		# position: 1); stats also change when only the index did
+		flat = flatten(state, cached.files, cached.substats)
+		if not (changed or new or flat != cached.flat):
+			return None
+		cached.flat = flat
+		return flat
+
+
+	@staticmethod
+	def of_root(objects, path):
+		"""Returns the value in objects (root: object) for the root path is in, or None."""
+		for root, obj in objects.items():
+			if os.path.commonpath((path, root)) == root:
+				return obj
+		return None
+
+
+	def read_journals(self, path, cached, journals, state_queue, queue_files):
+		"""Reads the new records of journals (DirEntries) into state_queue. Retired
+		journals go to queue_files for removal; live ones are retired once they're
+		read completely and large. Returns whether cached.offsets changed."""
+		if cached.offsets is None:
+			cached.offsets = dbs.json_read([path, dbs.JOURNAL_OFFSETS_NAME], dbs.JOURNAL_OFFSETS_SCHEMA)
+		offsets = {}
+
+		for f in journals:
+			try:
+				st = f.stat()
+				known = cached.offsets.get(f.name)
+				# Start over if the journal was replaced or truncated
+				offset = 0
+				if known is not None and known['inode'] == st.st_ino and known['offset'] <= st.st_size:
+					offset = known['offset']
+
+				if offset < st.st_size:
+					records, offset = dbs.journal_read(f.path, dbs.JOURNAL_RECORD_SCHEMA, offset)
+					log.debug(f'Read {len(records)} records from {f.path}')
+					# Record times are from the client's clock, queue files are ordered by
+					# their mtime. The journal's mtime is that of its last append, on the
+					# same clock as queue files; shift record times by the difference.
+					if records:
+						skew = st.st_mtime - records[-1]['time']
+						state_queue.extend((record['time'] + skew, record['updates']) for record in records)
+
+				if f.name.endswith(RETIRED_SUFFIX):
+					queue_files.append(f.path)
+				elif offset == st.st_size and offset >= JOURNAL_RETIRE_BYTES:
+					log.info(f'Retiring journal {f.path}')
+					os.rename(f.path, f.path + RETIRED_SUFFIX)
+					# Records appended meanwhile are read from the retired journal next time
+					offsets[f.name + RETIRED_SUFFIX] = {'inode': st.st_ino, 'offset': offset}
+				else:
+					offsets[f.name] = {'inode': st.st_ino, 'offset': offset}
+			except OSError as e:
+				log.error(f'Reading {f.path}: {str(e)}')
+				if f.name in cached.offsets:
+					offsets[f.name] = cached.offsets[f.name]
+
+		changed = offsets != cached.offsets
+		cached.offsets = offsets
+		return changed
+
+
+	def __str__(self):
+		return f'StateEngine(cached={len(self.cache)}, hits={self.hits}, misses={self.misses})'
+
+	def __repr__(self):
+		return self.__str__()
@@ -7,9 +7,11 @@
 import os
 import io
 import time
+import zlib
 import PIL.Image, PIL.ImageFilter, PIL.features, PIL.ImageDraw, PIL.ImageOps
 
 import dbs
+import coverpack
 import config
 import loghelper
 import draw
@@ -89,7 +91,7 @@ class Tile:
 				setattr(cls, f'tx_{emblem}', draw.Texture(new))
 
 
-	def __init__(self, menu, meta, covers_zip=None):
+	def __init__(self, menu, meta, covers=None):
 		self.menu = menu
 		self.path = menu.path
 		self.font = menu.tile_font # FIXME Yuck
@@ -144,7 +146,7 @@ class Tile:
 		self.quad_posback = None
 
 		self.update_meta(meta)
-		self.update_cover(covers_zip)
+		self.update_cover(covers)
 
 
 	def update_meta(self, meta):
@@ -176,6 +178,15 @@ class Tile:
 			else:
 				self.info.text = util.duration_format(int(self.duration), seconds=False)
 
+		# Folder stats: videos, unseen ones and their total duration
+		if 'stats' in meta:
+			stats = meta['stats']
+			if not self.info:
+				self.info = self.font.text(z=204, group=self.quads, color=config.tile.text_color,
+					x=self.xoff + config.tile.width - 4, y=self.yoff, anchor='br')
+			unseen = f'{stats["unseen"]} new · ' if stats['unseen'] else ''
+			self.info.text = f'{unseen}{stats["files"]} · {util.duration_format(stats["duration"], seconds=False)}'
+
 		if 'position' in meta:
 			self.position = meta['position']
 
@@ -183,27 +194,26 @@ class Tile:
 			self.tagged = meta['tagged']
 
 
-	def update_cover(self, covers_zip):
-		try:
-			with covers_zip.open(self.filename) as fd:
-				cover_data = fd.read()
-		except KeyError:
-			cover_data = None
-			log.warning(f'Loading thumbnail for {self.filename}: Not found in zip')
+	def update_cover(self, covers):
+		"""Loads the cover from covers, a cover DB as returned by coverpack.open_covers()."""
+		texture = None
+		if covers is not None:
+			try:
+				cover_data = covers.get(self.filename)
+				if cover_data is None:
+					log.warning(f'Loading thumbnail for {self.filename}: Not found in cover DB')
+				elif cover_data:
+					texture = self.cover_texture(cover_data, covers.meta)
+			except (OSError, ValueError, KeyError, zlib.error, coverpack.Error) as e:
+				log.error(f'Loading thumbnail for {self.filename}: {e}')
 
 		# FIXME: reuse instead of recreate
 		if self.cover:
 			self.cover.destroy()
-		if cover_data:
-			img = PIL.Image.open(io.BytesIO(cover_data))
-			# Always convert to RGBA; 4-byte pixels avoid alignment problems
-			img = img.convert('RGBA')
-			if (img.width, img.height) != (config.tile.width, config.tile.cover_height):
-				#img = PIL.ImageOps.fit(img, (config.tile.width, config.tile.cover_height))
-				img = util.img_crop_ratio(img, (config.tile.width, config.tile.cover_height))
+		if texture:
 			self.cover = draw.Quad(z=203, group=self.quads,
 				x=self.xoff, y=self.yoff, w=config.tile.width, h=config.tile.cover_height,
-				image=img
+				texture=texture
 			)
 		else:
 			self.cover = draw.FlatQuad(z=203, group=self.quads,
@@ -212,6 +222,28 @@ class Tile:
 			)
 
 
+	@staticmethod
+	def cover_texture(cover_data, cover_meta):
+		"""Creates a texture from cover data. Raw RGBA covers (made by Clerk for our tile
+		size) are uploaded as-is; JPEG covers are decoded and cropped to size first."""
+		if cover_meta.get('encoding', 'jpeg') == 'rgba':
+			width, height = (int(v) for v in cover_meta['dimensions'].split('x'))
+			pixels = zlib.decompress(cover_data)
+			if len(pixels) != width * height * 4:
+				raise ValueError(f'Got {len(pixels)} bytes of pixel data for {width}x{height} cover')
+			texture = draw.Texture(persistent=False)
+			texture.update_raw(width, height, 'RGBA', pixels)
+			return texture
+
+		img = PIL.Image.open(io.BytesIO(cover_data))
+		# Always convert to RGBA; 4-byte pixels avoid alignment problems
+		img = img.convert('RGBA')
+		if (img.width, img.height) != (config.tile.width, config.tile.cover_height):
+			#img = PIL.ImageOps.fit(img, (config.tile.width, config.tile.cover_height))
+			img = util.img_crop_ratio(img, (config.tile.width, config.tile.cover_height))
+		return draw.Texture(image=img, persistent=False)
+
+
 	def show(self, pos, selected):
 		selected_before = self.selected
 
@@ -308,7 +340,7 @@ class Tile:
 		if state is None:
 			state = {'position': self.position}
 		log.info(f'Writing state for {self.filename}: {state}')
-		dbs.json_write([self.path, dbs.QUEUE_DIR_NAME, ...], {self.filename: state})
+		dbs.write_state_update(self.path, {self.filename: state}, journal=config.performance.state_journal)
 
 
 	@property
@@ -2,6 +2,7 @@ import loghelper
 import functools
 import time
 import os
+import math
 
 
 log = loghelper.get_logger('Util', loghelper.Color.BrightYellow)
@@ -27,6 +28,14 @@ def render_thread_count(minimum=1):
 	return threads
 
 
+def img_fit_draft_size(image_size, size):
+	"""Returns the smallest size an image of image_size can be scaled to (keeping its
+	aspect ratio) that still covers size entirely, as PIL.ImageOps.fit() needs.
+	Pass it to Image.draft() to let the JPEG decoder scale down (by up to 8x) while decoding."""
+	scale = max(size[0] / image_size[0], size[1] / image_size[1])
+	return (math.ceil(image_size[0] * scale), math.ceil(image_size[1] * scale))
+
+
 def img_crop_ratio(image, size):
 	input_ratio = image.width / image.height
 	output_ratio = size[0] / size[1]
@@ -4,12 +4,66 @@
 # Licensed under GPL v2.0, or (at your option) any later version.
 # (SPDX GPL-2.0-or-later) See LICENSE file for details.
 
+# Watches the library for changes. Sources (backends) of filesystem events all
+# feed Events into one queue:
+#   inotify   Linux inotify through ctypes. Only reports completed writes
+#             ('closed') and tells when a directory has 'settled': no more
+#             files being written in it.
+#   watchdog  The generic watchdog Observer, for other platforms.
+#   poll      Periodically stats directories, for network filesystems where
+#             events don't reach us. Keeps a snapshot on disk, so changes made
+#             while Clerk wasn't running are noticed too.
+# Polled subtrees are left out of the inotify source, so a mostly static part
+# of the library doesn't use up inotify watches.
+
 import os
+import stat
 import queue
+import struct
+import ctypes
+import ctypes.util
 import pathlib
+import threading
+import time
 from dataclasses import dataclass
-import watchdog.events
-import watchdog.observers
+
+import loghelper
+import dbs
+
+log = loghelper.get_logger('Watch', loghelper.Color.Yellow)
+
+try:
+	import watchdog.events
+	import watchdog.observers
+except ModuleNotFoundError:
+	log.warning("Couldn't load watchdog module; only the inotify watcher is available")
+	watchdog = None
+
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+INOTIFY_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF \
+	| IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+
+# Rewriting the poll snapshot costs time proportional to the whole tree; a lost
+# snapshot only costs a rescan, so changes are saved at most this often
+POLL_SAVE_SECONDS = 600
+
 
 
 @dataclass
@@ -22,42 +76,465 @@ class Event:
 		return any(part.startswith('.') for part in pathlib.Path(self.path).parts)
 
 
-class Handler(watchdog.events.FileSystemEventHandler):
-	def __init__(self):
-		super().__init__()
-		self.queue = queue.Queue()
 
-	def on_any_event(self, event):
-		#print(event, event.event_type)
-		if event.event_type in {'created', 'closed', 'deleted', 'modified'}:
-			self.queue.put(Event(event.src_path, event.is_directory, event.event_type))
-		if event.event_type == 'moved':
-			self.queue.put(Event(event.src_path, event.is_directory, 'deleted'))
-			self.queue.put(Event(event.dest_path, event.is_directory, 'created'))
+class Unavailable(Exception):
+	pass
 
 
-class Watcher:
-	def __init__(self, roots):
-		self.roots = roots
-		self.handler = Handler()
+
+class WatchdogSource:
+	"""Events from a watchdog Observer. Can't tell when directories settle."""
+	settles = False
+
+	class Handler(watchdog.events.FileSystemEventHandler if watchdog else object):
+		def __init__(self, queue):
+			super().__init__()
+			self.queue = queue
+
+		def on_any_event(self, event):
+			#print(event, event.event_type)
+			if event.event_type in {'created', 'closed', 'deleted', 'modified'}:
+				self.queue.put(Event(event.src_path, event.is_directory, event.event_type))
+			if event.event_type == 'moved':
+				self.queue.put(Event(event.src_path, event.is_directory, 'deleted'))
+				self.queue.put(Event(event.dest_path, event.is_directory, 'created'))
+
+	def __init__(self, queue, roots, exclude=()):
+		# Excluded (polled) subtrees are watched anyway; double events do no harm
+		if watchdog is None:
+			raise Unavailable('watchdog module not loaded')
+		self.handler = self.Handler(queue)
 		self.observer = watchdog.observers.Observer()
 		for root in roots:
 			self.observer.schedule(self.handler, root, recursive=True)
 		self.observer.start()
 
-	def events(self, timeout=None):
+
+
+class InotifySource:
+	"""Events from Linux inotify. Every directory under the roots gets a watch for
+	creation, deletion, renames and completed writes (IN_CLOSE_WRITE); not for
+	IN_MODIFY, which fires for every chunk written.
+
+	Files that were created but not yet closed are being written. When a batch of
+	events leaves a directory without such files, a 'settled' event is emitted for
+	that directory.
+	"""
+	settles = True
+
+	def __init__(self, queue, roots, exclude=()):
+		try:
+			libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+			self.inotify_add_watch = libc.inotify_add_watch
+			self.inotify_rm_watch = libc.inotify_rm_watch
+			self.fd = libc.inotify_init1(IN_CLOEXEC)
+		except (OSError, AttributeError) as e:
+			raise Unavailable(f'inotify not available: {e}')
+		if self.fd < 0:
+			raise Unavailable(f'inotify_init1: {os.strerror(ctypes.get_errno())}')
+
+		self.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+		self.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+		self.queue = queue
+		self.roots = roots
+		self.exclude = set(exclude)
+		# wd: directory path, and back
+		self.paths = {}
+		self.wds = {}
+		# directory path: names of files created but not closed yet
+		self.writing = {}
+
+		for root in roots:
+			self.watch_tree(root)
+		log.info(f'Watching {len(self.wds)} directories with inotify')
+
+		self.thread = threading.Thread(target=self.run, name='inotify', daemon=True)
+		self.thread.start()
+
+
+	def watch(self, path):
+		wd = self.inotify_add_watch(self.fd, os.fsencode(path), INOTIFY_MASK)
+		if wd < 0:
+			errno = ctypes.get_errno()
+			if errno == 28: # ENOSPC
+				log.error(f'Out of inotify watches, not watching {path}; raise fs.inotify.max_user_watches')
+			else:
+				log.warning(f'Watching {path}: {os.strerror(errno)}')
+			return False
+		self.paths[wd] = path
+		self.wds[path] = wd
+		return True
+
+
+	def watch_tree(self, path):
+		"""Watches path and all directories under it, except excluded subtrees.
+		Returns the directories watched."""
+		watched = []
+		if path in self.exclude:
+			return watched
+		if self.watch(path):
+			watched.append(path)
+		try:
+			for de in os.scandir(path):
+				if de.is_dir(follow_symlinks=False):
+					watched += self.watch_tree(de.path)
+		except OSError as e:
+			log.warning(f'Watching {path}: {e}')
+		return watched
+
+
+	def unwatch_tree(self, path):
+		prefix = path + '/'
+		for p in [p for p in self.wds if p == path or p.startswith(prefix)]:
+			wd = self.wds.pop(p)
+			self.paths.pop(wd, None)
+			self.writing.pop(p, None)
+			self.inotify_rm_watch(self.fd, wd)
+
+
+	def read(self):
+		"""Blocks until events are available; returns all of them as (wd, mask, name)."""
+		data = os.read(self.fd, INOTIFY_READ_SIZE)
+		events = []
+		pos = 0
+		while pos + INOTIFY_EVENT.size <= len(data):
+			wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, pos)
+			pos += INOTIFY_EVENT.size
+			name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+			pos += length
+			events.append((wd, mask, name))
+		return events
+
+
+	def run(self):
 		while True:
 			try:
-				yield self.handler.queue.get(timeout=timeout)
-			except queue.Empty:
-				yield None
+				events = self.read()
+			except OSError as e:
+				log.error(f'Reading inotify events: {e}')
+				return
+
+			touched = set()
+			for wd, mask, name in events:
+				if mask & IN_Q_OVERFLOW:
+					log.warning('inotify queue overflowed, rescanning everything')
+					self.overflow()
+					continue
+				if mask & IN_IGNORED:
+					path = self.paths.pop(wd, None)
+					if path is not None and self.wds.get(path) == wd:
+						del self.wds[path]
+						self.writing.pop(path, None)
+					continue
+
+				parent = self.paths.get(wd)
+				if parent is None or not name:
+					continue
+				path = os.path.join(parent, name)
+				isdir = bool(mask & IN_ISDIR)
+				writing = self.writing.setdefault(parent, set())
+				touched.add(parent)
+
+				if mask & (IN_CREATE | IN_MOVED_TO):
+					self.queue.put(Event(path, isdir, 'created'))
+					if isdir:
+						# New directories may already have contents (e.g. moved in); their
+						# subdirectories need scanning as much as the directory itself
+						watched = self.watch_tree(path)
+						for subdir in watched:
+							if subdir != path:
+								self.queue.put(Event(subdir, True, 'created'))
+						touched.update(watched)
+					elif mask & IN_CREATE and self.is_new_file(path):
+						writing.add(name)
+					else:
+						# Renamed into place, or a link; it's complete already
+						self.queue.put(Event(path, False, 'closed'))
+				elif mask & IN_CLOSE_WRITE:
+					writing.discard(name)
+					self.queue.put(Event(path, False, 'closed'))
+				elif mask & (IN_DELETE | IN_MOVED_FROM):
+					writing.discard(name)
+					if isdir:
+						self.unwatch_tree(path)
+					self.queue.put(Event(path, isdir, 'deleted'))
+
+			for path in touched:
+				if path in self.wds and not self.writing.get(path):
+					self.queue.put(Event(path, True, 'settled'))
+
+
+	@staticmethod
+	def is_new_file(path):
+		"""True if path looks like a file that is going to be written. Symlinks,
+		hard links and the like are created complete, and never closed."""
+		try:
+			st = os.lstat(path)
+		except OSError:
+			return False
+		return stat.S_ISREG(st.st_mode) and st.st_nlink == 1
+
+
+	def overflow(self):
+		"""Events were lost. Watch any new directories, forget about pending writes,
+		and report every directory as modified so it gets scanned."""
+		self.writing.clear()
+		for root in self.roots:
+			for path in self.watch_tree(root):
+				self.queue.put(Event(path, True, 'modified'))
+
+
+
+class PollSource:
+	"""Events from polling a directory tree every interval seconds. Only directories
+	whose mtime changed are listed again; that covers files being added, removed
+	or renamed. Files that were seen changing are stat'ed every cycle until they
+	hold still ('closed'), after which their directory has 'settled'.
+	The snapshot of the tree is kept in POLL_SNAPSHOT_NAME in the polled directory,
+	saved at most every POLL_SAVE_SECONDS.
+	"""
+	settles = True
+
+	def __init__(self, queue, path, interval):
+		self.queue = queue
+		self.path = path
+		self.interval = interval
+		self.snapshot_name = os.path.join(path, dbs.POLL_SNAPSHOT_NAME)
+		self.ignore = {dbs.POLL_SNAPSHOT_NAME, dbs.POLL_SNAPSHOT_NAME + dbs.NEW_SUFFIX}
+		# directory path relative to path: {'mtime': ..., 'dirs': [...], 'files': {name: [size, mtime]}}
+		self.dirs = None
+		# directory path: names of files that changed since last cycle
+		self.changing = {}
+		# Whether self.dirs has changes that aren't in the snapshot file yet
+		self.dirty = False
+		self.saved = time.monotonic()
+
+		snapshot = dbs.json_read(self.snapshot_name, dbs.POLL_SNAPSHOT_SCHEMA, default=None)
+		if snapshot is not None and snapshot['version'] == dbs.POLL_SNAPSHOT_VERSION:
+			self.dirs = snapshot['dirs']
+			log.info(f'Polling {path} every {interval}s, {len(self.dirs)} directories in snapshot')
+		else:
+			log.info(f'Polling {path} every {interval}s, no usable snapshot')
+
+		self.thread = threading.Thread(target=self.run, name='poll', daemon=True)
+		self.thread.start()
+
+
+	def run(self):
+		if self.dirs is None:
+			# Nothing to compare to; the initial scan takes care of the current state
+			self.dirs = {}
+			self.list_dir('.', emit=False)
+			self.save()
+
+		while True:
+			self.poll()
+			time.sleep(self.interval)
+
+
+	def save(self):
+		dbs.json_write(self.snapshot_name, {'version': dbs.POLL_SNAPSHOT_VERSION, 'dirs': self.dirs})
+		self.dirty = False
+		self.saved = time.monotonic()
+
+
+	def poll(self):
+		"""Runs one cycle; saves the snapshot if anything changed and it's been
+		POLL_SAVE_SECONDS since the last save."""
+		touched = set()
+
+		# Files that were changing: done once their size and mtime hold still
+		for rel, names in list(self.changing.items()):
+			files = self.dirs.get(rel, {}).get('files', {})
+			for name in list(names):
+				try:
+					st = os.stat(os.path.join(self.path, rel, name), follow_symlinks=False)
+				except OSError:
+					names.discard(name)
+					continue
+				touched.add(rel)
+				if files.get(name) == [st.st_size, st.st_mtime_ns]:
+					names.discard(name)
+					self.put(rel, name, False, 'closed')
+				else:
+					files[name] = [st.st_size, st.st_mtime_ns]
+			if not names:
+				del self.changing[rel]
+
+		# Journals are appended to in place, which doesn't change their directory's mtime
+		for rel, entry in self.dirs.items():
+			if not rel.endswith(dbs.QUEUE_DIR_NAME):
+				continue
+			for name, old in entry['files'].items():
+				if not name.endswith(dbs.JOURNAL_SUFFIX):
+					continue
+				try:
+					st = os.stat(os.path.join(self.path, rel, name), follow_symlinks=False)
+				except OSError:
+					continue
+				if [st.st_size, st.st_mtime_ns] != old:
+					entry['files'][name] = [st.st_size, st.st_mtime_ns]
+					touched.add(rel)
+					self.put(rel, name, False, 'modified')
+
+		# Directories whose entries changed
+		for rel in list(self.dirs):
+			if rel not in self.dirs:
+				# Removed with its parent, this cycle
+				continue
+			try:
+				mtime = os.stat(os.path.join(self.path, rel)).st_mtime_ns
+			except FileNotFoundError:
+				# Its parent changed too, and will notice
+				continue
+			except OSError as e:
+				log.warning(f'Polling {os.path.join(self.path, rel)}: {e}')
+				continue
+			if mtime != self.dirs[rel]['mtime'] and self.list_dir(rel):
+				touched.add(rel)
+
+		for rel in touched:
+			if rel in self.dirs and not self.changing.get(rel):
+				self.put(rel, '', True, 'settled')
+
+		# Writing the snapshot changes its own directory's mtime; don't list it again for that
+		self.dirty = self.dirty or bool(touched)
+		if self.dirty and time.monotonic() - self.saved >= POLL_SAVE_SECONDS:
+			self.save()
+			rel = os.path.dirname(dbs.POLL_SNAPSHOT_NAME)
+			if rel in self.dirs:
+				try:
+					self.dirs[rel]['mtime'] = os.stat(os.path.join(self.path, rel)).st_mtime_ns
+				except OSError:
+					pass
+
+
+	def list_dir(self, rel, emit=True):
+		"""Lists directory rel, updates the snapshot and emits events for the
+		differences. New subdirectories are listed too. Returns True if there were
+		any differences."""
+		full = os.path.join(self.path, rel)
+		old = self.dirs.get(rel, {'mtime': 0, 'dirs': [], 'files': {}})
+		dirs, files = [], {}
+		try:
+			# Stat before listing; changes made while listing show up next cycle
+			mtime = os.stat(full).st_mtime_ns
+			for de in os.scandir(full):
+				if de.is_dir(follow_symlinks=False):
+					dirs.append(de.name)
+				elif os.path.join(rel, de.name) not in self.ignore:
+					st = de.stat(follow_symlinks=False)
+					files[de.name] = [st.st_size, st.st_mtime_ns]
+		except OSError as e:
+			log.warning(f'Polling {full}: {e}')
+			return False
+		self.dirs[rel] = {'mtime': mtime, 'dirs': sorted(dirs), 'files': files}
+		changed = files != old['files'] or sorted(dirs) != old['dirs']
+
+		if emit:
+			changing = self.changing.setdefault(rel, set())
+			for name, st in files.items():
+				if name not in old['files']:
+					changing.add(name)
+					self.put(rel, name, False, 'created')
+				elif st != old['files'][name]:
+					changing.add(name)
+					self.put(rel, name, False, 'modified')
+			for name in old['files'].keys() - files.keys():
+				changing.discard(name)
+				self.put(rel, name, False, 'deleted')
+			for name in set(old['dirs']) - set(dirs):
+				self.forget(os.path.normpath(os.path.join(rel, name)))
+				self.put(rel, name, True, 'deleted')
+
+		for name in set(dirs) - set(old['dirs']):
+			if emit:
+				self.put(rel, name, True, 'created')
+			self.list_dir(os.path.normpath(os.path.join(rel, name)), emit=emit)
+
+		return changed
+
+
+	def forget(self, rel):
+		prefix = rel + '/'
+		for r in [r for r in self.dirs if r == rel or r.startswith(prefix)]:
+			del self.dirs[r]
+			self.changing.pop(r, None)
+
+
+	def put(self, rel, name, isdir, evtype):
+		path = os.path.normpath(os.path.join(self.path, rel, name))
+		self.queue.put(Event(path, isdir, evtype))
+
+
+
+SOURCES = {
+	'inotify': InotifySource,
+	'watchdog': WatchdogSource,
+}
+
+
+
+class Watcher:
+	"""Reports changes under roots as Events. backend is one of SOURCES, 'auto' for
+	the best one available, or 'poll' to poll all roots. Subtrees in poll are
+	polled every poll_interval seconds instead. If settles is True, directories get
+	'settled' events once no more files are being written in them."""
+
+	def __init__(self, roots, backend='auto', poll=(), poll_interval=60):
+		self.roots = roots
+		self.queue = queue.Queue()
+		self.sources = []
+
+		poll = [os.path.abspath(p) for p in poll]
+		for path in poll:
+			if not self.within_roots(path):
+				raise ValueError(f'Polled path {path} is not in the library')
+
+		if backend == 'poll':
+			poll = list(roots)
+		else:
+			names = ['inotify', 'watchdog'] if backend == 'auto' else [backend]
+			for name in names:
+				try:
+					self.sources.append(SOURCES[name](self.queue, roots, exclude=poll))
+					break
+				except Unavailable as e:
+					log.warning(f'Not using {name} watcher: {e}')
+			else:
+				raise Unavailable(f'No watcher backend available (tried {", ".join(names)})')
+
+		for path in poll:
+			self.sources.append(PollSource(self.queue, path, poll_interval))
+
+		self.settles = all(source.settles for source in self.sources)
+		log.info(f'Using {", ".join(source.__class__.__name__ for source in self.sources)}')
+
+	def within_roots(self, path):
+		return any(os.path.commonpath((path, root)) == root for root in self.roots)
+
+	def get(self, timeout=None):
+		"""Returns the next Event, or None if there was none for timeout seconds."""
+		try:
+			return self.queue.get(timeout=timeout)
+		except queue.Empty:
+			return None
+
+	def wake(self):
+		"""Makes a pending get() return None right away."""
+		self.queue.put(None)
+
+	def events(self, timeout=None):
+		while True:
+			yield self.get(timeout)
 
 	def push(self, path, skip_hidden=True, recursive=False):
 		# Don't stray outside of our roots
-		if not any(os.path.commonpath((path, root)) == root for root in self.roots):
+		if not self.within_roots(path):
 			return
 
-		self.handler.queue.put(Event(os.path.normpath(path), True, 'modified'))
+		self.queue.put(Event(os.path.normpath(path), True, 'modified'))
 
 		if recursive:
 			for de in os.scandir(path):